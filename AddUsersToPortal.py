@@ -16,9 +16,8 @@ import sys
 import logging
 import smtplib
 import arcpy
-import urllib
-import urllib2
 import json
+import TokenManager
 import Queue
 
 # Enable data to be overwritten
@@ -70,24 +69,16 @@ def mainFunction(portalUrl, portalAdminName, portalAdminPassword, typeUsers, use
                 userDict['f'] = 'json'
                 userDict['token'] = token
                 userDict['provider'] = provider
-                params = urllib.urlencode(userDict)
-
-                request = urllib2.Request(portalUrl + "/portaladmin/security/users/createUser?",params, { 'Referer' : portalUrl })
 
                 # POST the create request
-                response = urllib2.urlopen(request).read()
-                responseJSON = json.loads(response)
+                responseJSON = TokenManager.requestJSON(portalUrl + "/portaladmin/security/users/createUser",userDict,"POST",{ 'Referer' : portalUrl })
 
                 # Log results
                 if responseJSON.has_key('error'):
+                    # Expired tokens are renewed by the token manager so any error here is reported
                     errDict = responseJSON['error']
-                    if int(errDict['code'])==498:
-                        message = "Token Expired. Getting new token... Username: " + userDict['username'] + " will be added later..."
-                        token = generateToken(username,password, portalUrl)
-                        usersData.put(userDict)
-                    else:
-                        message =  "Error Code: %s \n Message: %s" % (errDict['code'],
-                        errDict['message'])
+                    message =  "Error Code: %s \n Message: %s" % (errDict['code'],
+                    errDict['message'])
                     arcpy.AddError(message)
                 else:
                     # Success
@@ -213,18 +204,16 @@ def getUserDataFromFile(inUserFile,provider):
 # Start of get token function
 def generateToken(username, password, portalUrl):
     '''Retrieves a token to be used with API requests.'''
-    parameters = urllib.urlencode({'username' : username,
-                                   'password' : password,
-                                   'client' : 'referer',
-                                   'referer': portalUrl,
-                                   'expiration': 60,
-                                   'f' : 'json'})
+    parameters = {'username' : username,
+                  'password' : password,
+                  'client' : 'referer',
+                  'referer': portalUrl,
+                  'expiration': 60,
+                  'f' : 'json'}
     try:
-        response = urllib2.urlopen(portalUrl + '/sharing/rest/generateToken?',
-                              parameters).read()      
+        responseJSON = TokenManager.requestToken(portalUrl + '/sharing/rest/generateToken',parameters)
     except Exception as e:
         arcpy.AddError( 'Unable to open the url %s/sharing/rest/generateToken' % (portalUrl))
-    responseJSON =  json.loads(response.strip(' \t\n\r'))
     # Log results
     if responseJSON.has_key('error'):
         errDict = responseJSON['error']
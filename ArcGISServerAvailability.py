@@ -29,10 +29,14 @@ if (useArcPy == "true"):
 if (useArcGISAPIPython == "true"):
     # Import arcgis module
     import arcgis 
-import urllib
-import urllib2
-import ssl
 import json
+import urlparse
+import threading
+import time
+import multiprocessing.pool
+import RESTClient
+import TokenManager
+import JobPoller
 
 # Set global variables
 # Logging
@@ -46,6 +50,15 @@ emailSubject = "" # Subject in email
 emailTo = "" # Address of email sent to
 emailUser = "" # Address of email sent from
 emailPassword = ""
+# Sweep
+maxWorkers = 10 # Number of services to check at the same time
+maxRequestsPerHost = 6 # Maximum number of requests sent to each host at the same time
+checkTimeout = 30 # Seconds to wait to connect and for each read of a request before the check is reported as an error
+gpTimeLimit = 600 # Seconds for each GP job to finish after it is submitted before it is cancelled
+hostLocks = {} # Request limit for each host
+hostLocksLock = threading.Lock()
+# Requests
+verifyCertificate = "false" # Verify SSL certificates (Sites use self signed certificates)
 # Proxy
 enableProxy = "false"
 requestProtocol = "http" # http or https
@@ -84,49 +97,9 @@ def mainFunction(agsSiteURL,agsSiteAdminURL,portalURL,portalUsername,portalPassw
                     # Get all services (If no response the script will stop and error in the getServices function)
                     services = getServices(agsSiteAdminURL, token)
 
-            # Query all services
-            # Iterate through services
-            for eachService in services:
-                # If admin URL provided
-                realtimeStatus = "Unavailable"
-                if (agsSiteAdminURL):
-                    # Get the service status
-                    realtimeStatus = getServiceStatus(agsSiteAdminURL, token, eachService)
-                    
-                # For all service, check the service endpoint
-                serviceInfo = checkService(agsSiteURL, token, eachService)
-                
-                # Query the service if map or feature service
-                if ((queryData.lower() == "true") and ((eachService.split(".")[-1].lower() == "mapserver") or (eachService.split(".")[-1].lower() == "featureserver"))):
-                    queryResultCount = queryService(agsSiteURL, serviceInfo, token, eachService)
-                else:
-                    queryResultCount = None
-                # Query the map if a cached map service
-                if ((str(queryMap).lower() == "true") and (eachService.split(".")[-1].lower() == "mapserver") and (str(serviceInfo["singleFusedMapCache"]).lower() == "true")):
-                    mapResultCount = queryServiceMap(agsSiteURL, serviceInfo, token, eachService)
-                else:
-                    mapResultCount = None
-                 # Submit a job if a GP service
-                if ((str(submitJob).lower() == "true") and (eachService.split(".")[-1].lower() == "gpserver")):
-                    # Submit the job and get a result
-                    submitJobResult = submitServiceJob(agsSiteURL, serviceInfo, token, eachService, gpServiceParameters)
-                    # If error in result
-                    if "error" in str(submitJobResult).lower():
-                        gpResultCount = submitJobResult
-                    # No error
-                    else:
-                        # Get the status of the job and check the job until finished
-                        jobID = submitJobResult["jobId"]
-                        jobStatus = submitJobResult["jobStatus"]
-                        while ((jobStatus.lower() == "esrijobexecuting") or (jobStatus.lower() == "esrijobsubmitted")):
-                            checkJobResult = checkServiceJob(agsSiteURL, serviceInfo, token, eachService, gpServiceParameters, jobID)
-                            jobStatus = checkJobResult["jobStatus"]
-                        gpResultCount = checkJobResult
-                else:
-                    gpResultCount = None
-            
-                # Add service info to list
-                servicesInfo.append({'service': eachService, 'info': serviceInfo, 'status': realtimeStatus, 'mapInfo': mapResultCount, 'queryInfo': queryResultCount, 'gpInfo': gpResultCount})
+            # Query all services concurrently - Results are returned in the same order as the services
+            printMessage("Checking " + str(len(services)) + " services using " + str(maxWorkers) + " workers...","info")
+            servicesInfo = sweepServices(agsSiteURL,agsSiteAdminURL,token,services,queryData,queryMap,submitJob,gpServiceParameters)
 
             # If there are services in the site
             if (len(servicesInfo) > 0):
@@ -271,19 +244,120 @@ def mainFunction(agsSiteURL,agsSiteAdminURL,portalURL,portalUsername,portalPassw
 # End of main function
 
 
+# Start of sweep services function
+def sweepServices(agsSiteURL,agsSiteAdminURL,token,services,queryData,queryMap,submitJob,gpServiceParameters):
+    # No services to check
+    if (len(services) == 0):
+        return []
+
+    # Keep enough connections alive for all the workers
+    if (RESTClient.poolSize < maxWorkers):
+        RESTClient.configurePool(RESTClient.poolConnections,maxWorkers)
+
+    # Check each service on a worker thread
+    pool = multiprocessing.pool.ThreadPool(min(maxWorkers,len(services)))
+    try:
+        servicesInfo = pool.map(lambda eachService: sweepServiceOrError(agsSiteURL,agsSiteAdminURL,token,eachService,queryData,queryMap,submitJob,gpServiceParameters),services,1)
+    finally:
+        pool.close()
+        pool.join()
+    return servicesInfo
+# End of sweep services function
+
+
+# Start of sweep service or error function
+def sweepServiceOrError(agsSiteURL,agsSiteAdminURL,token,eachService,queryData,queryMap,submitJob,gpServiceParameters):
+    try:
+        return sweepService(agsSiteURL,agsSiteAdminURL,token,eachService,queryData,queryMap,submitJob,gpServiceParameters)
+    # Report the error for this service so the rest of the services are still reported
+    except Exception, error:
+        printMessage(eachService + " - Could not be checked - " + str(error),"warning")
+        return {'service': eachService, 'info': "Error: Could not be checked - " + str(error), 'status': "Unavailable", 'mapInfo': None, 'queryInfo': None, 'gpInfo': None}
+# End of sweep service or error function
+
+
+# Start of sweep service function
+def sweepService(agsSiteURL,agsSiteAdminURL,token,eachService,queryData,queryMap,submitJob,gpServiceParameters):
+    # If admin URL provided
+    realtimeStatus = "Unavailable"
+    if (agsSiteAdminURL):
+        # Get the service status
+        realtimeStatus = getServiceStatus(agsSiteAdminURL, token, eachService)
+
+    # For all service, check the service endpoint
+    serviceInfo = checkService(agsSiteURL, token, eachService)
+
+    # Query the service if map or feature service
+    if ((queryData.lower() == "true") and ((eachService.split(".")[-1].lower() == "mapserver") or (eachService.split(".")[-1].lower() == "featureserver"))):
+        queryResultCount = queryService(agsSiteURL, serviceInfo, token, eachService)
+    else:
+        queryResultCount = None
+    # Query the map if a cached map service
+    if ((str(queryMap).lower() == "true") and (eachService.split(".")[-1].lower() == "mapserver") and isinstance(serviceInfo, dict) and (str(serviceInfo.get("singleFusedMapCache")).lower() == "true")):
+        mapResultCount = queryServiceMap(agsSiteURL, serviceInfo, token, eachService)
+    else:
+        mapResultCount = None
+     # Submit a job if a GP service
+    if ((str(submitJob).lower() == "true") and (eachService.split(".")[-1].lower() == "gpserver")):
+        # Submit the job and get a result
+        submitJobResult = submitServiceJob(agsSiteURL, serviceInfo, token, eachService, gpServiceParameters)
+        # If error in result
+        if "error" in str(submitJobResult).lower():
+            gpResultCount = submitJobResult
+        # No error
+        else:
+            # Check the job until finished, waiting longer between each check and cancelling the job if past the deadline
+            jobID = submitJobResult["jobId"]
+            # Job needs to finish within the time limit from when it was submitted
+            gpDeadline = time.time() + gpTimeLimit
+            pollResult = JobPoller.pollJob(lambda: checkServiceJob(agsSiteURL, serviceInfo, token, eachService, gpServiceParameters, jobID),
+                                           lambda: cancelServiceJob(agsSiteURL, token, eachService, gpServiceParameters, jobID),
+                                           gpDeadline)
+            printMessage(eachService + " job " + str(pollResult["jobStatus"]) + " - Queued for " + str(pollResult["queueTime"]) + " seconds and executed for " + str(pollResult["executionTime"]) + " seconds...","info")
+            # If the job did not finish in time
+            if (pollResult["timedOut"] == True):
+                gpResultCount = "Error: Job did not finish within " + str(gpTimeLimit) + " seconds and was cancelled..."
+            else:
+                gpResultCount = pollResult["result"]
+    else:
+        gpResultCount = None
+
+    # Return service info
+    return {'service': eachService, 'info': serviceInfo, 'status': realtimeStatus, 'mapInfo': mapResultCount, 'queryInfo': queryResultCount, 'gpInfo': gpResultCount}
+# End of sweep service function
+
+
+# Start of request service function
+def requestService(url,parameters):
+    # Limit the number of requests sent to the host at the same time
+    hostLock = getHostLock(url)
+    with hostLock:
+        # Post request - Waits up to the check timeout to connect and for each read
+        return TokenManager.requestJSON(url,parameters,"POST",None,checkTimeout)
+# End of request service function
+
+
+# Start of get host lock function
+def getHostLock(url):
+    host = urlparse.urlsplit(url).netloc.lower()
+    with hostLocksLock:
+        # Create a limit for the host if it hasn't been used yet
+        if host not in hostLocks:
+            hostLocks[host] = threading.BoundedSemaphore(maxRequestsPerHost)
+        return hostLocks[host]
+# End of get host lock function
+
+
 # Start of check AGS site function
 def checkAGSSite(agsSiteURL, token):
     # Setup the parameters
-    parameters = urllib.urlencode({'token': token,
-                  'f': 'json'})
-    queryString = parameters.encode('utf-8')
+    parameters = {'token': token,
+                  'f': 'json'}
 
     # Post request
     try:
         printMessage("Querying ArcGIS Server - " + agsSiteURL + "/rest/services" + "...","info") 
-        context = ssl._create_unverified_context()
-        request = urllib2.Request(agsSiteURL + "/rest/services",queryString)
-        responseJSON = json.loads(urllib2.urlopen(request, context=context).read())
+        responseJSON = TokenManager.requestJSON(agsSiteURL + "/rest/services",parameters)
         if "error" in str(responseJSON).lower():
             printMessage("There is an issue with the ArcGIS Server site - " + agsSiteURL,"error")
             printMessage(responseJSON,"error")
@@ -297,7 +371,7 @@ def checkAGSSite(agsSiteURL, token):
         else:
             # Return response
             return responseJSON['currentVersion']          
-    except urllib2.URLError, error:
+    except RESTClient.RequestError, error:
         printMessage("There is an issue connecting to the ArcGIS Server site - " + agsSiteURL + "...","error")
         printMessage(error,"error")
         if (sendErrorEmail == "true"):
@@ -313,16 +387,13 @@ def checkAGSSite(agsSiteURL, token):
 # Start of get services function
 def getServices(agsSiteAdminURL, token):
     # Setup the parameters
-    parameters = urllib.urlencode({'token': token,
-                  'f': 'json'})
-    queryString = parameters.encode('utf-8')
+    parameters = {'token': token,
+                  'f': 'json'}
 
     # Post request
     try:
         printMessage("Querying ArcGIS Server for a list of services - " + agsSiteAdminURL + "/admin/services" + "...","info")         
-        context = ssl._create_unverified_context()
-        request = urllib2.Request(agsSiteAdminURL + "/admin/services",queryString)
-        responseJSON = json.loads(urllib2.urlopen(request, context=context).read())
+        responseJSON = TokenManager.requestJSON(agsSiteAdminURL + "/admin/services",parameters)
         if "error" in str(responseJSON).lower():
             printMessage(responseJSON,"error")
             if (sendErrorEmail == "true"):
@@ -342,9 +413,7 @@ def getServices(agsSiteAdminURL, token):
             for folder in responseJSON['folders']:
                 # Ignore the system or utilities folder
                 if ((folder.lower() != "system") or (folder.lower() != "utilities")):
-                    context = ssl._create_unverified_context()
-                    request = urllib2.Request(agsSiteAdminURL + "/admin/services/" + folder,queryString)
-                    responseJSON = json.loads(urllib2.urlopen(request, context=context).read())
+                    responseJSON = TokenManager.requestJSON(agsSiteAdminURL + "/admin/services/" + folder,parameters)
                     if "error" in str(responseJSON).lower():
                         printMessage(responseJSON,"error")
                         if (sendErrorEmail == "true"):
@@ -360,7 +429,7 @@ def getServices(agsSiteAdminURL, token):
                             services.append(folder + "/" + eachService['serviceName']+ "." + eachService['type'])
             # Return services list 
             return services           
-    except urllib2.URLError, error:
+    except RESTClient.RequestError, error:
         printMessage("There is an issue connecting to the ArcGIS Server site - " + agsSiteAdminURL + "...","error")
         printMessage(error,"error")
         if (sendErrorEmail == "true"):
@@ -376,22 +445,19 @@ def getServices(agsSiteAdminURL, token):
 # Start of get service status function
 def getServiceStatus(agsSiteAdminURL, token, service):
     # Setup the parameters
-    parameters = urllib.urlencode({'token': token,
-                  'f': 'json'})
-    queryString = parameters.encode('utf-8')
+    parameters = {'token': token,
+                  'f': 'json'}
 
     # Post request
     try:
         printMessage("Querying for service status - " + agsSiteAdminURL + "/admin/services/" + service + "/status" + "...","info")         
-        context = ssl._create_unverified_context()
-        request = urllib2.Request(agsSiteAdminURL + "/admin/services/" + service + "/status",queryString)
-        responseJSON = json.loads(urllib2.urlopen(request, context=context).read())
+        responseJSON = requestService(agsSiteAdminURL + "/admin/services/" + service + "/status",parameters)
         if "error" in str(responseJSON).lower():
             return responseJSON
         else:
             # Return response
             return responseJSON['realTimeState']                     
-    except urllib2.URLError, error:
+    except RESTClient.RequestError, error:
         return "Error: Could not connect..."
 # End of get service status function
 
@@ -399,23 +465,20 @@ def getServiceStatus(agsSiteAdminURL, token, service):
 # Start of check service function
 def checkService(agsSiteURL, token, service):
     # Setup the parameters
-    parameters = urllib.urlencode({'token': token,
-                  'f': 'json'})
-    queryString = parameters.encode('utf-8')
+    parameters = {'token': token,
+                  'f': 'json'}
 
     # Post request
     try:
         printMessage("Querying service for info - " + agsSiteURL + "/rest/services/" + service.replace(".", "/") + "...","info") 
-        context = ssl._create_unverified_context()
-        request = urllib2.Request(agsSiteURL + "/rest/services/" + service.replace(".", "/"),queryString)
-        responseJSON = json.loads(urllib2.urlopen(request, context=context).read())
+        responseJSON = requestService(agsSiteURL + "/rest/services/" + service.replace(".", "/"),parameters)
 
         if "error" in str(json.dumps(responseJSON)).lower():
             return responseJSON
         else:
             # Return response
             return responseJSON                    
-    except urllib2.URLError, error:
+    except RESTClient.RequestError, error:
         return "Error: Could not connect..."
 # End of check service function
 
@@ -423,11 +486,10 @@ def checkService(agsSiteURL, token, service):
 # Start of query service function
 def queryService(agsSiteURL, serviceInfo, token, service):
     # Setup the parameters
-    parameters = urllib.urlencode({'token': token,
+    parameters = {'token': token,
                   'where': '1=1',
                   'returnCountOnly': 'true',
-                  'f': 'json'})
-    queryString = parameters.encode('utf-8')
+                  'f': 'json'}
 
     if "layers" in str(serviceInfo).lower():
         dataLayerFound = False
@@ -447,15 +509,13 @@ def queryService(agsSiteURL, serviceInfo, token, service):
             # Post request
             try:
                 printMessage("Querying data in service - " + agsSiteURL + "/rest/services/" + service.replace(".", "/") + "/" + layerId + "/query" + "...","info")           
-                context = ssl._create_unverified_context()
-                request = urllib2.Request(agsSiteURL + "/rest/services/" + service.replace(".", "/") + "/" + layerId + "/query",queryString)
-                responseJSON = json.loads(urllib2.urlopen(request, context=context).read())
+                responseJSON = requestService(agsSiteURL + "/rest/services/" + service.replace(".", "/") + "/" + layerId + "/query",parameters)
                 if "error" in str(responseJSON).lower():
                     return responseJSON
                 else:
                     # Return response
                     return responseJSON["count"]                    
-            except urllib2.URLError, error:
+            except RESTClient.RequestError, error:
                 return "Error: Could not connect..."
         else:
             return "Error: No data in the service..."          
@@ -467,24 +527,21 @@ def queryService(agsSiteURL, serviceInfo, token, service):
 # Start of query service map function
 def queryServiceMap(agsSiteURL, serviceInfo, token, service):   
     # Setup the parameters
-    parameters = urllib.urlencode({'token': token,
+    parameters = {'token': token,
                   'format': 'png',
                   'bbox': str(serviceInfo["initialExtent"]["xmin"]) + "," + str(serviceInfo["initialExtent"]["ymin"]) + str(serviceInfo["initialExtent"]["xmax"]) + str(serviceInfo["initialExtent"]["ymax"]),
-                  'f': 'json'})
-    queryString = parameters.encode('utf-8')
+                  'f': 'json'}
 
     # Post request
     try:
         printMessage("Querying map in service - " + agsSiteURL + "/rest/services/" + service.replace(".", "/") + "/export" + "...","info")           
-        context = ssl._create_unverified_context()
-        request = urllib2.Request(agsSiteURL + "/rest/services/" + service.replace(".", "/") + "/export",queryString)
-        responseJSON = json.loads(urllib2.urlopen(request, context=context).read())
+        responseJSON = requestService(agsSiteURL + "/rest/services/" + service.replace(".", "/") + "/export",parameters)
         if "error" in str(responseJSON).lower():
             return responseJSON
         else:
             # Return response
             return responseJSON["href"]                   
-    except urllib2.URLError, error:
+    except RESTClient.RequestError, error:
         return "Error: Could not connect..." 
 # End of query service map function
 
@@ -502,23 +559,18 @@ def submitServiceJob(agsSiteURL, serviceInfo, token, service, gpServiceParameter
             if key.lower() != "task":
                 # Load parameter
                 parameters[key] = value
-  
-        # Setup the parameters
-        parameters = urllib.urlencode(parameters)
-        queryString = parameters.encode('utf-8')
+
 
         # Post request
         try:
             printMessage("Querying GP service task - " + agsSiteURL + "/rest/services/" + service.replace(".", "/") + "/" + gpServiceParameters["task"].replace(" ", "%20") + "/submitJob" + "...","info")           
-            context = ssl._create_unverified_context()
-            request = urllib2.Request(agsSiteURL + "/rest/services/" + service.replace(".", "/") + "/" + gpServiceParameters["task"].replace(" ", "%20") + "/submitJob",queryString)
-            responseJSON = json.loads(urllib2.urlopen(request, context=context).read())
+            responseJSON = requestService(agsSiteURL + "/rest/services/" + service.replace(".", "/") + "/" + gpServiceParameters["task"].replace(" ", "%20") + "/submitJob",parameters)
             if "error" in str(responseJSON).lower():
                 return responseJSON
             else:
                 # Return response
                 return responseJSON                  
-        except urllib2.URLError, error:
+        except RESTClient.RequestError, error:
             return "Error: Could not connect..."
     else:
         printMessage("No service parameters provided for GP service...","warning")       
@@ -532,44 +584,54 @@ def checkServiceJob(agsSiteURL, serviceInfo, token, service, gpServiceParameters
     gpServiceParameters = json.loads(gpServiceParameters)
         
     # Setup the parameters
-    parameters = urllib.urlencode({'token': token,
-                  'f': 'json'})
-    queryString = parameters.encode('utf-8')
+    parameters = {'token': token,
+                  'f': 'json'}
 
     # Post request
     try:
         printMessage("Querying GP service task for status - " + agsSiteURL + "/rest/services/" + service.replace(".", "/") + "/" + gpServiceParameters["task"].replace(" ", "%20") + "/jobs/" + jobID + "...","info")           
-        context = ssl._create_unverified_context()
-        request = urllib2.Request(agsSiteURL + "/rest/services/" + service.replace(".", "/") + "/" + gpServiceParameters["task"].replace(" ", "%20") + "/jobs/" + jobID,queryString)
-        responseJSON = json.loads(urllib2.urlopen(request, context=context).read())
+        responseJSON = requestService(agsSiteURL + "/rest/services/" + service.replace(".", "/") + "/" + gpServiceParameters["task"].replace(" ", "%20") + "/jobs/" + jobID,parameters)
         if "error" in str(responseJSON).lower():
             return responseJSON
         else:
             # Return response
             return responseJSON                  
-    except urllib2.URLError, error:
+    except RESTClient.RequestError, error:
         return "Error: Could not connect..."        
 # End of check service job function
 
 
+# Start of cancel service job function
+def cancelServiceJob(agsSiteURL, token, service, gpServiceParameters, jobID):
+    # Get the GP service parameters JSON
+    gpServiceParameters = json.loads(gpServiceParameters)
+
+    # Post request
+    try:
+        printMessage("Cancelling GP service job - " + agsSiteURL + "/rest/services/" + service.replace(".", "/") + "/" + gpServiceParameters["task"].replace(" ", "%20") + "/jobs/" + jobID + "...","warning")
+        hostLock = getHostLock(agsSiteURL)
+        with hostLock:
+            return JobPoller.cancelJob(agsSiteURL + "/rest/services/" + service.replace(".", "/") + "/" + gpServiceParameters["task"].replace(" ", "%20") + "/jobs/" + jobID,token,checkTimeout)
+    except RESTClient.RequestError, error:
+        return "Error: Could not connect..."
+# End of cancel service job function
+
+
 # Start of get token function
 def getToken(portalURL,portalUser,portalPassword):
     printMessage("Getting portal token - " + portalURL + "/sharing/rest/generateToken","info")
         
     # Setup the parameters
-    parameters = urllib.urlencode({'username': portalUser,
+    parameters = {'username': portalUser,
                   'password': portalPassword,
                   'client': 'referer',
                   'referer': portalURL,
                   'expiration': '60',
-                  'f': 'json'})
-    queryString = parameters.encode('utf-8')
+                  'f': 'json'}
 
     # Request to get token
     try:
-        context = ssl._create_unverified_context()
-        request = urllib2.Request(portalURL + "/sharing/rest/generateToken",queryString)
-        responseJSON = json.loads(urllib2.urlopen(request, context=context).read())
+        responseJSON = TokenManager.requestToken(portalURL + "/sharing/rest/generateToken",parameters)
         if "error" in str(responseJSON).lower():
             printMessage(responseJSON,"error")
             if (sendErrorEmail == "true"):
@@ -582,7 +644,7 @@ def getToken(portalURL,portalUser,portalPassword):
         else:
             token = responseJSON.get('token')
             return token
-    except urllib2.URLError, error:
+    except RESTClient.RequestError, error:
         printMessage("Could not connect...","error")
         printMessage(error,"error")
         if (sendErrorEmail == "true"):
@@ -695,10 +757,9 @@ if __name__ == '__main__':
         logger.info("Process started.")
     # Setup the use of a proxy for requests
     if (enableProxy == "true"):
-        # Setup the proxy
-        proxy = urllib2.ProxyHandler({requestProtocol : proxyURL})
-        openURL = urllib2.build_opener(proxy)
-        # Install the proxy
-        urllib2.install_opener(openURL)
+        # Setup the proxy on the shared session
+        RESTClient.setProxy(requestProtocol, proxyURL)
+    # Don't verify SSL certificates on the shared session if turned off
+    RESTClient.setVerifyCertificate(verifyCertificate)
     mainFunction(*argv)
     
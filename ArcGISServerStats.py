@@ -16,13 +16,19 @@ import sys
 import logging
 import smtplib
 import arcpy
-import httplib
 import json
-import urllib
-import urllib2
+import RESTClient
+import TokenManager
 import urlparse
 import time
 import datetime
+import multiprocessing.pool
+import threading
+import sqlite3
+import re
+import numpy
+import itertools
+import LatencySketch
 
 # Enable data to be overwritten
 arcpy.env.overwriteOutput = True
@@ -36,11 +42,29 @@ emailUser = ""
 emailPassword = ""
 emailSubject = ""
 emailMessage = ""
+useStatsDatabase = "true" # Keep hourly stats in a database so each run only queries the logs since the last run
+statsDatabase = os.path.join(os.path.dirname(__file__), "ArcGISServerStats.sqlite") # e.g. os.path.join(os.path.dirname(__file__), "ArcGISServerStats.sqlite")
+keepDays = 31 # Days of hourly stats to keep in the database
+rollupColumns = ["requests","requestTime","draws","drawTime","queries","queryTime","requestSketch","drawSketch","querySketch"]
+sketchIndexes = [6,7,8] # Stats that are latency sketches
+logOperations = ["request","draw","query"] # Operations in the stats and CSV
+logPatterns = [["request successfully processed","request"],
+               ["End ExportMapImage","draw"],
+               ["End Query","query"],
+               ["End Find","query"],
+               ["End Identify","query"]] # Text in the log message and the operation it is counted as
+streamChunkSize = 1000 # Number of log messages read from the response and counted at a time
+logShards = 4 # Number of time shards to split the logs query into, which are queried at the same time
+shardHours = 24 # Most hours of logs in a time shard - Each shard is saved when it finishes, so only a few shards of stats are kept in memory
 enableProxy = "false"
 requestProtocol = "http" # http or https
 proxyURL = ""
 output = None
 
+# One regular expression to find any of the log patterns - Each pattern is a group so the match gives the operation
+logPatternRegex = re.compile("|".join("(" + re.escape(logPattern[0]) + ")" for logPattern in logPatterns))
+logPatternOperations = [logOperations.index(logPattern[1]) for logPattern in logPatterns]
+
 # Start of main function
 def mainFunction(agsServerSite,username,password,csvFile,timeFilter): # Get parameters from ArcGIS Desktop tool by seperating by comma e.g. (var1 is 1st parameter,var2 is 2nd parameter,var3 is 3rd parameter)  
     try:
@@ -81,20 +105,48 @@ def mainFunction(agsServerSite,username,password,csvFile,timeFilter): # Get para
             startTime = int(round(time.time() * 1000))
             endTime = startTime - millisecondsToQuery
 
-            # Query logs
-            servicesStats = {}
-            queryResult,lastRecordDate = queryLogs(serverName,serverPort,startTime,endTime,servicesStats,token)
-
-            # While there are still more queries - More than 10,000
-            while (queryResult == -1):
-                # Query logs
-                queryResult,lastRecordDate = queryLogs(serverName,serverPort,lastRecordDate,endTime,servicesStats,token)         
+            # If keeping the stats in a database, only query the logs not already in the database
+            if (useStatsDatabase == "true"):
+                database = openStatsDatabase(statsDatabase)
+                try:
+                    # Query the logs for the times not in the database e.g. since the last run, older than the last run or a time that failed
+                    missingRanges = getMissingRanges(getHarvestedRanges(database,agsServerSite),endTime,startTime)
+                    failedShards = 0
+                    if (len(missingRanges) > 0):
+                        for shard, shardStats in harvestLogs(serverName,serverPort,missingRanges,token):
+                            # Time could not be queried, so leave it to be queried on the next run
+                            if (shardStats == None):
+                                failedShards += 1
+                                continue
+                            # Save the time queried with the rollups - Saved together so the time is never counted twice
+                            addHarvestedRange(database,agsServerSite,getShardRange(shard))
+                            saveRollups(database,agsServerSite,shardStats)
+                    if (failedShards > 0):
+                        arcpy.AddWarning("Logs for " + str(failedShards) + " time shards could not be queried, these will be queried on the next run...")
+                    # Remove rollups no longer needed for any report
+                    removeOldRollups(database,agsServerSite,startTime)
+
+                    # Get the stats for the time from the hourly rollups
+                    servicesStats = getRollupStats(database,agsServerSite,endTime)
+                finally:
+                    database.close()
+            else:
+                # Query all the logs for the time and add up each shard for each service as it finishes
+                servicesStats = {}
+                failedShards = 0
+                for shard, shardStats in harvestLogs(serverName,serverPort,[[endTime,startTime]],token):
+                    if (shardStats == None):
+                        failedShards += 1
+                    else:
+                        mergeStats(servicesStats,getServiceTotals(shardStats))
+                if (failedShards > 0):
+                    arcpy.AddWarning("Logs for " + str(failedShards) + " time shards could not be queried, the stats do not include these times...")
 
             arcpy.AddMessage("Creating CSV file with stats...")
             
             # Open text file and write header line       
             summaryFile = open(csvFile, "w")        
-            header = "Service,Requests,Request Time,Draw Requests,Draw Time,Query Requests,Query Time\n"
+            header = "Service,Requests,Request Time," + getPercentileHeader("Request") + ",Draw Requests,Draw Time," + getPercentileHeader("Draw") + ",Query Requests,Query Time," + getPercentileHeader("Query") + "\n"
             summaryFile.write(header)
 
             # Read through dictionary and write totals into file 
@@ -120,7 +172,7 @@ def mainFunction(agsServerSite,username,password,csvFile,timeFilter): # Get para
                     avgQueryTime = (1.0 * (queryTimeCount / queryCount))                            
 
                 # Construct and write the comma-separated line         
-                serviceLine = service + "," + str(requestCount) + "," + str(avgRequestTime) + "," + str(drawCount) + "," + str(avgDrawTime) + "," + str(queryCount) + "," + str(avgQueryTime) + "\n"
+                serviceLine = service + "," + str(requestCount) + "," + str(avgRequestTime) + "," + getPercentileValues(servicesStats[service][6]) + "," + str(drawCount) + "," + str(avgDrawTime) + "," + getPercentileValues(servicesStats[service][7]) + "," + str(queryCount) + "," + str(avgQueryTime) + "," + getPercentileValues(servicesStats[service][8]) + "\n"
                 summaryFile.write(serviceLine)
             summaryFile.close() 
             
@@ -186,101 +238,408 @@ def mainFunction(agsServerSite,username,password,csvFile,timeFilter): # Get para
 # End of main function
 
 
+# Start of harvest logs function
+def harvestLogs(serverName,serverPort,timeRanges,token):
+    # Split each time range (Lowest and highest time) into shards and query the logs for each shard at the same time
+    shards = []
+    for lowTime, highTime in timeRanges:
+        # At least the number of shards to query at the same time, and no more than the hours in a shard
+        shardCount = max(int(logShards), -(-(highTime - lowTime) // (int(shardHours) * 3600000)))
+        shards += getShards(highTime,lowTime,shardCount)
+    arcpy.AddMessage("Querying the ArcGIS Server logs in " + str(len(shards)) + " time shards...")
+    threadCount = min(len(shards), max(1, int(logShards)))
+    # Shards being queried or waiting to be saved - Stops finished shards building up in memory
+    shardSlots = threading.Semaphore(threadCount * 2)
+    harvestStopped = threading.Event()
+    # Only give the pool another shard when there is a free slot
+    def queueShards():
+        for shard in shards:
+            shardSlots.acquire()
+            # Stop giving the pool shards if the harvest has stopped early
+            if harvestStopped.is_set():
+                return
+            yield shard
+    def runShard(shard):
+        # Report an error and mark the shard as failed - An error or exit that leaves the worker stops the pool returning results
+        try:
+            return shard, harvestShard(serverName,serverPort,shard,token)
+        except (Exception, SystemExit), error:
+            arcpy.AddError("Error while querying logs - " + str(error))
+            # Logging
+            if (enableLogging == "true"):
+                logger.error("Error while querying logs - " + str(error))
+            return shard, None
+    pool = multiprocessing.pool.ThreadPool(threadCount)
+    try:
+        # Return each shard with its stats as it finishes - Key is the service and hour, or None if the shard failed
+        for shard, shardStats in pool.imap_unordered(runShard,queueShards()):
+            yield shard, shardStats
+            shardSlots.release()
+    finally:
+        # Wake the shard queue if it is waiting for a slot, so it stops and the pool can finish
+        harvestStopped.set()
+        shardSlots.release()
+        pool.close()
+        pool.join()
+# End of harvest logs function
+
+
+# Start of get hour function
+def getHour(recordTime):
+    # Start of the hour the record is in
+    return int(recordTime) - (int(recordTime) % 3600000)
+# End of get hour function
+
+
+# Start of get service totals function
+def getServiceTotals(hourlyStats):
+    servicesStats = {}
+    # Add up the hours for each service
+    for serviceName, hour in hourlyStats:
+        mergeStats(servicesStats,{serviceName: hourlyStats[(serviceName,hour)]})
+    return servicesStats
+# End of get service totals function
+
+
+# Start of open stats database function
+def openStatsDatabase(databaseFile):
+    database = sqlite3.connect(databaseFile)
+    # Create the tables if they don't exist
+    database.execute("CREATE TABLE IF NOT EXISTS rollups (site TEXT, service TEXT, hour INTEGER, requests INTEGER, requestTime REAL, draws INTEGER, drawTime REAL, queries INTEGER, queryTime REAL, PRIMARY KEY (site, service, hour))")
+    database.execute("CREATE TABLE IF NOT EXISTS checkpoints (site TEXT PRIMARY KEY, lowTime INTEGER, highTime INTEGER)")
+    database.execute("CREATE TABLE IF NOT EXISTS harvests (site TEXT, lowTime INTEGER, highTime INTEGER)")
+    # Add the latency sketches to a database created before they were kept
+    columns = [row[1] for row in database.execute("PRAGMA table_info(rollups)")]
+    for column in ["requestSketch","drawSketch","querySketch"]:
+        if column not in columns:
+            database.execute("ALTER TABLE rollups ADD COLUMN " + column + " BLOB")
+    database.commit()
+    return database
+# End of open stats database function
+
+
+# Start of get harvested ranges function
+def getHarvestedRanges(database,site):
+    # Times already queried for the site - Lowest and highest time, both included
+    harvestedRanges = [list(row) for row in database.execute("SELECT lowTime, highTime FROM harvests WHERE site = ? ORDER BY lowTime", (site,))]
+    # Use the checkpoint from a database created before the times were kept as ranges
+    if (len(harvestedRanges) == 0):
+        row = database.execute("SELECT lowTime, highTime FROM checkpoints WHERE site = ?", (site,)).fetchone()
+        if (row != None):
+            harvestedRanges = [list(row)]
+    return harvestedRanges
+# End of get harvested ranges function
+
+
+# Start of get missing ranges function
+def getMissingRanges(harvestedRanges,lowTime,highTime):
+    missingRanges = []
+    # Find the gaps between the times already queried
+    for harvestedLow, harvestedHigh in sorted(harvestedRanges):
+        if (harvestedHigh < lowTime):
+            continue
+        if (harvestedLow > highTime):
+            break
+        if (harvestedLow > lowTime):
+            missingRanges.append([lowTime, harvestedLow - 1])
+        lowTime = max(lowTime, harvestedHigh + 1)
+    if (lowTime <= highTime):
+        missingRanges.append([lowTime, highTime])
+    return missingRanges
+# End of get missing ranges function
+
+
+# Start of add harvested range function
+def addHarvestedRange(database,site,timeRange):
+    # Join to the ranges it overlaps or is next to
+    lowTime, highTime = timeRange
+    # Empty shard
+    if (lowTime > highTime):
+        return
+    harvestedRanges = getHarvestedRanges(database,site)
+    for harvestedLow, harvestedHigh in harvestedRanges:
+        if (harvestedLow <= highTime + 1) and (harvestedHigh >= lowTime - 1):
+            lowTime = min(lowTime, harvestedLow)
+            highTime = max(highTime, harvestedHigh)
+    harvestedRanges = [harvestedRange for harvestedRange in harvestedRanges if (harvestedRange[1] < lowTime) or (harvestedRange[0] > highTime)] + [[lowTime, highTime]]
+    # Replace the ranges for the site - Committed with the rollups
+    database.execute("DELETE FROM harvests WHERE site = ?", (site,))
+    database.execute("DELETE FROM checkpoints WHERE site = ?", (site,))
+    database.executemany("INSERT INTO harvests (site, lowTime, highTime) VALUES (?, ?, ?)", [(site, harvestedLow, harvestedHigh) for harvestedLow, harvestedHigh in harvestedRanges])
+# End of add harvested range function
+
+
+# Start of remove old rollups function
+def removeOldRollups(database,site,highTime):
+    # Keep whole hours, so the times kept match the rollups
+    lowHour = getHour(highTime - (keepDays * 86400000))
+    database.execute("DELETE FROM rollups WHERE site = ? AND hour < ?", (site,lowHour))
+    database.execute("DELETE FROM harvests WHERE site = ? AND highTime < ?", (site,lowHour))
+    database.execute("UPDATE harvests SET lowTime = ? WHERE site = ? AND lowTime < ?", (lowHour,site,lowHour))
+    database.commit()
+# End of remove old rollups function
+
+
+# Start of save rollups function
+def saveRollups(database,site,hourlyStats):
+    for serviceName, hour in hourlyStats:
+        stats = {serviceName: newStats()}
+        mergeStats(stats,{serviceName: hourlyStats[(serviceName,hour)]})
+        # Add to the hour if it is already in the database
+        row = database.execute("SELECT " + ", ".join(rollupColumns) + " FROM rollups WHERE site = ? AND service = ? AND hour = ?", (site,serviceName,hour)).fetchone()
+        if (row != None):
+            mergeStats(stats,{serviceName: getRowStats(row)})
+        database.execute("INSERT OR REPLACE INTO rollups (site, service, hour, " + ", ".join(rollupColumns) + ") VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                         (site,serviceName,hour) + tuple(stats[serviceName][:6]) + tuple(getSketchBlob(sketch) for sketch in stats[serviceName][6:]))
+    database.commit()
+# End of save rollups function
+
+
+# Start of get rollup stats function
+def getRollupStats(database,site,endTime):
+    servicesStats = {}
+    # Add up the hours for each service back to the hour the time starts in
+    for row in database.execute("SELECT service, " + ", ".join(rollupColumns) + " FROM rollups WHERE site = ? AND hour >= ?", (site,getHour(endTime))):
+        mergeStats(servicesStats,{row[0]: getRowStats(row[1:])})
+    return servicesStats
+# End of get rollup stats function
+
+
+# Start of get sketch blob function
+def getSketchBlob(sketch):
+    # No values in the sketch
+    if (sketch == None):
+        return None
+    return sqlite3.Binary(LatencySketch.sketchToBytes(sketch))
+# End of get sketch blob function
+
+
+# Start of get row stats function
+def getRowStats(row):
+    # Counts and times, then the latency sketches
+    return list(row[:6]) + [LatencySketch.sketchFromBytes(data) for data in row[6:]]
+# End of get row stats function
+
+
+# Start of classify message function
+def classifyMessage(message):
+    # Find the first pattern in the message
+    match = logPatternRegex.search(message)
+    if (match == None):
+        return -1
+    # Return the index of the operation for the pattern
+    return logPatternOperations[match.lastindex - 1]
+# End of classify message function
+
+
+# Start of aggregate logs function
+def aggregateLogs(logs,recordTimes,recordOperations,countRecords,servicesStats):
+    indexes = numpy.nonzero(countRecords)[0]
+    # No records to count
+    if (len(indexes) == 0):
+        return
+    # Number each service and hour
+    hours = recordTimes[indexes] - (recordTimes[indexes] % 3600000)
+    keyCodes = {}
+    recordKeys = numpy.array([keyCodes.setdefault((logs[index]["source"],int(hour)), len(keyCodes)) for index, hour in zip(indexes, hours)], dtype=numpy.int64)
+    keys = sorted(keyCodes, key=keyCodes.get)
+    elapsed = numpy.array([float(logs[index]["elapsed"]) for index in indexes])
+    operations = recordOperations[indexes]
+
+    # For each operation
+    for operation in range(len(logOperations)):
+        operationRecords = (operations == operation)
+        if not operationRecords.any():
+            continue
+        operationKeys = recordKeys[operationRecords]
+        operationElapsed = elapsed[operationRecords]
+        # Count and add up the time for each service and hour
+        counts = numpy.bincount(operationKeys, minlength=len(keys))
+        times = numpy.bincount(operationKeys, weights=operationElapsed, minlength=len(keys))
+        # Count the latency buckets for each service and hour
+        bucketCounts = numpy.bincount(operationKeys * LatencySketch.bucketCount + LatencySketch.getBuckets(operationElapsed), minlength=len(keys) * LatencySketch.bucketCount).reshape(len(keys), LatencySketch.bucketCount)
+        # Largest time for each service and hour
+        maxTimes = numpy.zeros(len(keys))
+        numpy.maximum.at(maxTimes, operationKeys, operationElapsed)
+
+        # Add to the stats for each service and hour
+        for code in numpy.nonzero(counts)[0]:
+            if keys[code] not in servicesStats:
+                # Add key with no counts and empty latency sketches
+                servicesStats[keys[code]] = newStats()
+            stats = servicesStats[keys[code]]
+            stats[operation * 2] += int(counts[code])
+            stats[(operation * 2) + 1] += float(times[code])
+            stats[len(logOperations) * 2 + operation] = LatencySketch.addCounts(stats[len(logOperations) * 2 + operation],bucketCounts[code],maxTimes[code])
+# End of aggregate logs function
+
+
+# Start of get shards function
+def getShards(startTime,endTime,shardCount):
+    shards = []
+    shardTime = (startTime - endTime) / max(1, int(shardCount))
+    shardStart = startTime
+    # Split the time into shards - Most recent time first as the logs are queried backwards
+    for count in range(max(1, int(shardCount))):
+        shardEnd = shardStart - shardTime
+        # Last shard finishes at the end time
+        if (count == max(1, int(shardCount)) - 1):
+            shardEnd = endTime
+        # Records at the start of a shard are in the shard before it, except for the first shard
+        shards.append({'start': shardStart,
+                       'end': shardEnd,
+                       'includeStart': (count == 0),
+                       'seenTime': None,
+                       'seen': set()})
+        shardStart = shardEnd
+    return shards
+# End of get shards function
+
+
+# Start of get shard range function
+def getShardRange(shard):
+    # Lowest and highest time counted in the shard - The start time is in the shard before it, except for the first shard
+    if (shard["includeStart"]):
+        return [shard["end"], shard["start"]]
+    return [shard["end"], shard["start"] - 1]
+# End of get shard range function
+
+
+# Start of harvest shard function
+def harvestShard(serverName,serverPort,shard,token):
+    # Query logs
+    servicesStats = {}
+    queryResult,lastRecordDate = queryLogs(serverName,serverPort,shard["start"],shard["end"],servicesStats,token,shard)
+
+    # While there are still more queries - More than 10,000
+    while (queryResult == -1):
+        # Query logs
+        queryResult,lastRecordDate = queryLogs(serverName,serverPort,lastRecordDate,shard["end"],servicesStats,token,shard)
+    # Query failed, so the stats for the shard are not complete
+    if (queryResult == 0):
+        return None
+    return servicesStats
+# End of harvest shard function
+
+
+# Start of new stats function
+def newStats():
+    # Request, draw and query counts and times, then the request, draw and query latency sketches (Created when first used)
+    return [0,0,0,0,0,0,None,None,None]
+# End of new stats function
+
+
+# Start of get percentile header function
+def getPercentileHeader(operation):
+    headers = []
+    for percentile in LatencySketch.percentiles:
+        headers.append(operation + " P" + str(percentile))
+    headers.append(operation + " Max")
+    return ",".join(headers)
+# End of get percentile header function
+
+
+# Start of get percentile values function
+def getPercentileValues(sketch):
+    values = []
+    for percentile in LatencySketch.percentiles:
+        values.append(str(LatencySketch.getPercentile(sketch,percentile)))
+    values.append(str(LatencySketch.getMax(sketch)))
+    return ",".join(values)
+# End of get percentile values function
+
+
+# Start of merge stats function
+def mergeStats(servicesStats,shardStats):
+    for serviceName in shardStats:
+        if serviceName in servicesStats:
+            # Add the counts and times from the shard
+            for index in range(len(shardStats[serviceName])):
+                # Merge the latency sketches
+                if (index in sketchIndexes):
+                    servicesStats[serviceName][index] = LatencySketch.mergeSketch(servicesStats[serviceName][index],shardStats[serviceName][index])
+                else:
+                    servicesStats[serviceName][index] += shardStats[serviceName][index]
+        else:
+            servicesStats[serviceName] = newStats()
+            mergeStats(servicesStats,{serviceName: shardStats[serviceName]})
+# End of merge stats function
+
+
 # Start of query logs function
-def queryLogs(serverName,serverPort,startTime,endTime,servicesStats,token):
+def queryLogs(serverName,serverPort,startTime,endTime,servicesStats,token,shard):
     # Construct URL to query the logs
     logQueryURL = "/arcgis/admin/logs/query"
     logFilter = "{'services':'*','server':'*','machines':'*'}"          
-    params = urllib.urlencode({'level': 'FINE', 'startTime': startTime, 'endTime': endTime, 'filter':logFilter, 'token': token, 'f': 'json', 'pageSize':10000})
+    params = {'level': 'FINE', 'startTime': startTime, 'endTime': endTime, 'filter':logFilter, 'token': token, 'f': 'json', 'pageSize':10000}
     headers = {"Content-type": "application/x-www-form-urlencoded", "Accept": "text/plain"}
 
     # Connect to URL and post parameters
     arcpy.AddMessage("Querying the ArcGIS Server logs...")
     arcpy.AddMessage("ArcGIS Server logs query showing from " + datetime.datetime.fromtimestamp(int(startTime) / 1000).strftime('%d/%m/%Y %H:%M:%S') + "...")
             
-    httpConn = httplib.HTTPConnection(serverName, int(serverPort))
-    httpConn.request("POST", logQueryURL, params, headers)
-    
-    # Read response
-    response = httpConn.getresponse()
-    if (response.status != 200):
-        httpConn.close()
+    # Records on the last page at the time this page starts from
+    pageSeenTime = shard["seenTime"]
+    pageSeen = shard["seen"]
+    shard["seen"] = set()
+    responseInfo = {}
+    lastRecordDate = None
+    try:
+        # Read the log messages as they arrive and count them in chunks
+        logs = TokenManager.streamJSON("http://" + serverName + ":" + str(serverPort) + logQueryURL, params, "logMessages", responseInfo, "POST", headers)
+        chunk = list(itertools.islice(logs, streamChunkSize))
+        while (len(chunk) > 0):
+            # Only count the records in this shard
+            recordTimes = numpy.array([int(item["time"]) for item in chunk], dtype=numpy.int64)
+            countRecords = (recordTimes >= shard["end"]) & ((recordTimes < shard["start"]) | ((recordTimes == shard["start"]) & shard["includeStart"]))
+            # Don't count the records that were on the last page - Compared on all their values
+            for index in numpy.nonzero(recordTimes == (pageSeenTime or -1))[0]:
+                if (json.dumps(chunk[index], sort_keys=True) in pageSeen):
+                    countRecords[index] = False
+            # Keep the records at the oldest time so far - The next page starts from the oldest time
+            if (lastRecordDate == None) or (int(recordTimes.min()) < lastRecordDate):
+                lastRecordDate = int(recordTimes.min())
+                shard["seen"] = set()
+            for index in numpy.nonzero(recordTimes == lastRecordDate)[0]:
+                shard["seen"].add(json.dumps(chunk[index], sort_keys=True))
+
+            # Get the operation for each message e.g. request, draw or query
+            recordOperations = numpy.array([classifyMessage(item["message"]) for item in chunk], dtype=numpy.int32)
+            countRecords &= (recordOperations >= 0)
+            # Add the counts, times and latencies for each service and hour
+            aggregateLogs(chunk,recordTimes,recordOperations,countRecords,servicesStats)
+            chunk = list(itertools.islice(logs, streamChunkSize))
+    except RESTClient.RequestError, error:
         arcpy.AddError("Error while querying logs.")
         # Logging
         if (enableLogging == "true"):      
             logger.error("Error while querying logs.")
-        return
-    else:
-        data = response.read()
+        return 0,None
 
-        # Check that data returned is not an error object
-        if not assertJsonSuccess(data):
-            arcpy.AddError("Error returned by operation. " + data)
-            # Logging
-            if (enableLogging == "true"):      
-                logger.error("Error returned by operation. " + data)
-        else:
-            # Deserialize response into Python object
-            dataObj = json.loads(data)
-            httpConn.close()
-            # Setup the variables       
-            logs = dataObj["logMessages"]
-            logCount = 0           
-
-            # For each log message                    
-            for item in logs:
-                # Get request stats
-                if "request successfully processed" in item["message"]:
-                    serviceName = item["source"]
-
-                    if serviceName in servicesStats:
-                        # Add 1 to request count
-                        servicesStats[serviceName][0] += 1
-                        
-                        # Add elapsed time to request time count
-                        servicesStats[serviceName][1] += float(item["elapsed"])
-                    else:
-                        # Add key with one count and total elapsed time
-                        servicesStats[serviceName] = [1,float(item["elapsed"]),0,0,0,0]
-                        
-                # Get draw stats
-                if "End ExportMapImage" in item["message"]:
-                    serviceName = item["source"]
-
-                    if serviceName in servicesStats:
-                        # Add 1 to draw count
-                        servicesStats[serviceName][2] += 1
-                        
-                        # Add elapsed time to draw time count
-                        servicesStats[serviceName][3] += float(item["elapsed"])
-                    else:
-                        # Add key with one count and total elapsed time
-                        servicesStats[serviceName] = [0,0,1,float(item["elapsed"]),0,0]
-
-                # Get query stats
-                if ("End Query" or "End Find" or "End Identify") in item["message"]:
-                    serviceName = item["source"]
-
-                    if serviceName in servicesStats:
-                        # Add 1 to query count
-                        servicesStats[serviceName][4] += 1
-                        
-                        # Add elapsed time to draw time count
-                        servicesStats[serviceName][5] += float(item["elapsed"])
-                    else:
-                        # Add key with one count and total elapsed time
-                        servicesStats[serviceName] = [0,0,0,0,1,float(item["elapsed"])]
-
-                # When at the last record
-                if (logCount == (len(logs)-1)):
-                    lastRecordDate = item["time"]
-                    arcpy.AddMessage("ArcGIS Server logs query to (Last log record found to filter set) " + datetime.datetime.fromtimestamp(int(lastRecordDate) / 1000).strftime('%d/%m/%Y %H:%M:%S') + "...")
-                    if (dataObj["hasMore"] == 1):
-                        return -1,lastRecordDate
-                    else:
-                        arcpy.AddMessage("Querying finished...")
-                        return 1,lastRecordDate
-                logCount += 1 
+    # Check that data returned is not an error object
+    if not assertJsonSuccess(json.dumps(responseInfo)):
+        arcpy.AddError("Error returned by operation. " + json.dumps(responseInfo))
+        # Logging
+        if (enableLogging == "true"):      
+            logger.error("Error returned by operation. " + json.dumps(responseInfo))
+        return 0,None
+
+    # No logs in the time
+    if (lastRecordDate == None):
+        arcpy.AddMessage("Querying finished...")
+        return 1,startTime
+
+    # Next page starts from the time of the last record
+    shard["seenTime"] = lastRecordDate
+    # If the whole page is at the same time, keep the records from the last page too
+    if (lastRecordDate == pageSeenTime):
+        shard["seen"].update(pageSeen)
+    arcpy.AddMessage("ArcGIS Server logs query to (Last log record found to filter set) " + datetime.datetime.fromtimestamp(int(lastRecordDate) / 1000).strftime('%d/%m/%Y %H:%M:%S') + "...")
+    if (responseInfo.get("hasMore") in [1, True]):
+        return -1,lastRecordDate
+    else:
+        arcpy.AddMessage("Querying finished...")
+        return 1,lastRecordDate
 # End of query logs function
 
       
@@ -291,11 +650,10 @@ def getToken(username, password, serverName, serverPort):
                   'expiration': "60",
                   'client':     'requestip'}
     
-    query_string = urllib.urlencode(query_dict)
     url = "http://{}:{}/arcgis/admin/generateToken?f=json".format(serverName, serverPort)
    
     try:
-        token = json.loads(urllib2.urlopen(url, query_string).read())
+        token = TokenManager.requestToken(url, query_dict)
         if "token" not in token or token == None:
             arcpy.AddError("Failed to get token, return message from server:")
             arcpy.AddError(token['messages'])            
@@ -308,7 +666,7 @@ def getToken(username, password, serverName, serverPort):
             # Return the token to the function which called for it
             return token['token']
     
-    except urllib2.URLError, error:
+    except RESTClient.RequestError, error:
         arcpy.AddError("Could not connect to machine {} on port {}".format(serverName, serverPort))
         arcpy.AddError(error)
         # Logging
@@ -373,7 +731,9 @@ def assertJsonSuccess(data):
                 # Logging
                 if (enableLogging == "true"):      
                     logger.error(errMsg)
-            sys.exit()
+            # Only exit on the main thread - Shards are queried on worker threads, which return that the query failed
+            if (threading.current_thread().name == "MainThread"):
+                sys.exit()
         return False
     else:
         return True
@@ -433,10 +793,7 @@ if __name__ == '__main__':
         logger.info("Process started.")
     # Setup the use of a proxy for requests
     if (enableProxy == "true"):
-        # Setup the proxy
-        proxy = urllib2.ProxyHandler({requestProtocol : proxyURL})
-        openURL = urllib2.build_opener(proxy)
-        # Install the proxy
-        urllib2.install_opener(openURL)
+        # Setup the proxy on the shared session
+        RESTClient.setProxy(requestProtocol, proxyURL)
     mainFunction(*argv)
     
@@ -1,6 +1,9 @@
 #-------------------------------------------------------------
 # Name:       ArcGIS Application Test
-# Purpose:    Tests an ArcGIS web application (that uses a web map) for performance.
+# Purpose:    Tests an ArcGIS web application (that uses a web map) for performance. Each request is timed
+#             with a breakdown of DNS, connect, TLS, wait (Server time to first byte) and transfer time.
+#             Requests are loaded like a browser - Independent requests at the same time, limited per host,
+#             and the app, web map then layers in order. A HAR file of the waterfall can also be exported.
 #             - Need to install requests python package.
 # Author:     Shaun Weston (shaun_weston@eagle.co.nz)
 # Date Created:    22/07/2016
@@ -29,6 +32,12 @@ emailUser = ""
 emailPassword = ""
 emailSubject = ""
 emailMessage = ""
+# Waterfall
+browserConnections = 6 # Requests sent to each host at the same time, as a browser does
+harExport = "true" # Also write a HAR file of the requests (Same name as the CSV file) e.g. to view the waterfall in browser developer tools
+# Results
+useResultsDatabase = "true" # Keep the timings of every run (See ResultsStore) and compare them to the previous runs to find slowdowns
+failOnRegression = "false" # Exit with an error code if significantly slower than the previous runs
 # Proxy
 enableProxy = "false"
 requestProtocol = "http" # http or https
@@ -44,17 +53,15 @@ if (arcgisDesktop == "true"):
     import arcpy
     # Enable data to be overwritten
     arcpy.env.overwriteOutput = True
-# Python version check
-if sys.version_info[0] >= 3:
-    # Python 3.x
-    import urllib.request as urllib2
-else:
-    # Python 2.x
-    import urllib2  
-import urllib
 import json
 import csv
-import requests
+import re
+import datetime
+import threading
+import multiprocessing.pool
+import RESTClient
+import TokenManager
+import ResultsStore
 
 
 # Start of main function
@@ -66,18 +73,18 @@ def mainFunction(portalUrl, portalAdminName, portalAdminPassword, webmapId, appl
         # Generate token for portal
         token = generateToken(portalAdminName, portalAdminPassword, portalUrl)
 
-        # Setup the requests needed
+        # Setup the requests needed and the requests each one has to wait for - App, then web map, then layers
         webRequests = []
-        webRequests.append(javascriptAPIURL + "/init.js")
-        webRequests.append(portalUrl + "/sharing/rest/portals/self?f=json&token=" + token)
-        webRequests.append(portalUrl + "/sharing/rest/content/items/" + webmapId + "/data?f=json&token=" + token)
-        webRequests.append(portalUrl + "/sharing/rest/content/items/" + applicationId + "/data?f=json&token=" + token)
+        webRequests.append({"url": javascriptAPIURL + "/init.js", "dependsOn": []})
+        webRequests.append({"url": portalUrl + "/sharing/rest/portals/self?f=json&token=" + token, "dependsOn": []})
+        webRequests.append({"url": portalUrl + "/sharing/rest/content/items/" + applicationId + "/data?f=json&token=" + token, "dependsOn": []})
+        webRequests.append({"url": portalUrl + "/sharing/rest/content/items/" + webmapId + "/data?f=json&token=" + token, "dependsOn": [2]})
 
         # Get all the service requests needed from the webmap
         printMessage("Retrieving all services from the web map - " + webmapId + "...","info")
         serviceRequests = servicesWebmap(portalUrl,token,webmapId)
         for servicesRequest in serviceRequests:
-            webRequests.append(servicesRequest)
+            webRequests.append({"url": servicesRequest, "dependsOn": [3]})
 
         printMessage("Creating report CSV file - " + csvFile + "...","info")
         # Create a CSV file and setup header
@@ -87,24 +94,61 @@ def mainFunction(portalUrl, portalAdminName, portalAdminPassword, webmapId, appl
         # Add in header information   
         headerRow = []                               
         headerRow.append("Request")
+        headerRow.append("Start (Seconds)")
+        headerRow.append("Blocked (Seconds)")
         headerRow.append("Time (Seconds)")
+        headerRow.append("DNS (Seconds)")
+        headerRow.append("Connect (Seconds)")
+        headerRow.append("TLS (Seconds)")
+        headerRow.append("Wait (Seconds)")
+        headerRow.append("Transfer (Seconds)")
+        headerRow.append("Bytes")
         writer.writerow(headerRow)
         
-        # Make all the web requests needed
-        totalRequestTime = 0
+        # Make all the web requests needed like a browser would
+        printMessage("Making " + str(len(webRequests)) + " web requests, up to " + str(browserConnections) + " at a time to each host...","info")
+        waterfallStart = datetime.datetime.utcnow()
+        waterfallTime = runWaterfall(webRequests)
+        totalTiming = RESTClient.newTiming()
         for request in webRequests:
-            printMessage("Making web request - " + request + "...","info")
-            time = webRequest(request)
-            totalRequestTime = totalRequestTime + float(time.microseconds)
-            printMessage("Time - " + str(round(float(time.microseconds)/1000000,4)) + "...","info")
+            RESTClient.addTiming(totalTiming, request["timing"])
+            printMessage("Web request - " + request["url"] + " - Time - " + str(round(request["timing"]["total"],4)) + " (Wait - " + str(round(request["timing"]["wait"],4)) + ", Transfer - " + str(round(request["timing"]["transfer"],4)) + ")...","info")
 
             # Write results to CSV
             row = []                               
-            row.append(request)
-            row.append(str(round(float(time.microseconds)/1000000,4)))
+            row.append(request["url"])
+            row.append(str(round(request["start"],4)))
+            row.append(str(round(request["blocked"],4)))
+            for key in ["total","dns","connect","tls","wait","transfer"]:
+                row.append(str(round(request["timing"][key],4)))
+            row.append(str(request["timing"]["bytes"]))
             writer.writerow(row)
+        file.close()
                 
-        printMessage("Total request time - " + str(round(totalRequestTime/1000000,4)) + "...","info")
+        printMessage("Total request time - " + str(round(totalTiming["total"],4)) + "...","info")
+        printMessage("Critical path time (App, web map then slowest layer) - " + str(round(getCriticalPath(webRequests),4)) + "...","info")
+        printMessage("Page load time - " + str(round(waterfallTime,4)) + "...","info")
+        printMessage("Total time waiting for the server - " + str(round(totalTiming["wait"],4)) + ", connecting - " + str(round(totalTiming["dns"] + totalTiming["connect"] + totalTiming["tls"],4)) + ", transferring - " + str(round(totalTiming["transfer"],4)) + "...","info")
+
+        # Write out the HAR file
+        if (harExport == "true"):
+            harFile = os.path.splitext(csvFile)[0] + ".har"
+            printMessage("Creating HAR file - " + harFile + "...","info")
+            writeHAR(harFile, webRequests, waterfallStart, waterfallTime, applicationId)
+
+        # Compare the request times to the previous runs
+        regressionFound = False
+        if (useResultsDatabase == "true"):
+            runTimings = [[removeToken(request["url"]), request["timing"]["total"]] for request in webRequests]
+            runTimings.append(["Page load", waterfallTime])
+            runInfo = {"portal": portalUrl,
+                       "webmap": webmapId,
+                       "javascriptAPI": javascriptAPIURL}
+            # Settings that change what is requested - Runs are only compared to previous runs with the same settings
+            workload = {"webmap": webmapId,
+                        "javascriptAPI": javascriptAPIURL,
+                        "browserConnections": browserConnections}
+            regressionFound = reportComparisons(ResultsStore.checkRun("ArcGISWebAppTest", portalUrl + "/" + applicationId, runTimings, runInfo, None, workload))
             
         # --------------------------------------- End of code --------------------------------------- #
         # If called from gp tool return the arcpy parameter   
@@ -130,6 +174,9 @@ def mainFunction(portalUrl, portalAdminName, portalAdminPassword, webmapId, appl
             logMessage.flush()
             logMessage.close()
             logger.handlers = []
+        # Exit with an error if slower than the previous runs
+        if (regressionFound == True) and (failOnRegression == "true"):
+            sys.exit(1)
     # If arcpy error
     except arcpy.ExecuteError:           
         # Build and show the error message
@@ -194,41 +241,158 @@ def mainFunction(portalUrl, portalAdminName, portalAdminPassword, webmapId, appl
 # Start of web request function
 def webRequest(url):
     # Make the request
-    response = requests.get(url)
-    # Return the load time
-    return response.elapsed
+    response, timing = RESTClient.timeRequest(url, None, "GET")
+    # Return the response and the load time for each part of the request
+    return response, timing
 # End of web request function
 
 
+# Start of run waterfall function
+def runWaterfall(webRequests):
+    # Limit the requests to each host like a browser
+    hostLimits = {}
+    for request in webRequests:
+        host = re.sub("^[a-z]+://", "", request["url"].lower()).split("/")[0]
+        if host not in hostLimits:
+            hostLimits[host] = threading.BoundedSemaphore(int(browserConnections))
+        request["hostLimit"] = hostLimits[host]
+        request["finished"] = threading.Event()
+
+    # Keep enough connections alive for each host
+    if (RESTClient.poolSize < int(browserConnections)) or (RESTClient.poolConnections < len(hostLimits)):
+        RESTClient.configurePool(max(RESTClient.poolConnections, len(hostLimits)), max(RESTClient.poolSize, int(browserConnections)))
+
+    # Requests are started in order one at a time, so a request only waits for requests already started
+    startTime = RESTClient.clock()
+    pool = multiprocessing.pool.ThreadPool(min(len(webRequests), int(browserConnections) * len(hostLimits)))
+    try:
+        pool.map(lambda request: waterfallRequest(webRequests, request, startTime), webRequests, 1)
+    finally:
+        pool.close()
+        pool.join()
+    for request in webRequests:
+        del request["hostLimit"]
+        del request["finished"]
+    # Time until the last request finished
+    return RESTClient.clock() - startTime
+# End of run waterfall function
+
+
+# Start of waterfall request function
+def waterfallRequest(webRequests, request, startTime):
+    try:
+        # Wait for the requests this one depends on e.g. layers wait for the web map
+        for index in request["dependsOn"]:
+            webRequests[index]["finished"].wait()
+        # Wait for a free connection to the host
+        readyTime = RESTClient.clock()
+        with request["hostLimit"]:
+            request["start"] = RESTClient.clock() - startTime
+            request["blocked"] = request["start"] - (readyTime - startTime)
+            try:
+                response, request["timing"] = webRequest(request["url"])
+                request["status"] = response.status_code
+                request["statusText"] = response.reason
+                request["headers"] = dict(response.headers)
+            # If the request failed e.g. timed out
+            except RESTClient.RequestError as error:
+                printMessage("Web request failed - " + request["url"] + " - " + str(error),"warning")
+                request["timing"] = RESTClient.newTiming()
+                request["timing"]["total"] = RESTClient.clock() - startTime - request["start"]
+                request["status"] = 0
+                request["statusText"] = str(error)
+                request["headers"] = {}
+    finally:
+        request["finished"].set()
+# End of waterfall request function
+
+
+# Start of get critical path function
+def getCriticalPath(webRequests):
+    # Longest chain of requests that have to be made one after another
+    pathTimes = []
+    for request in webRequests:
+        pathTimes.append(request["timing"]["total"] + max([0] + [pathTimes[index] for index in request["dependsOn"]]))
+    return max(pathTimes)
+# End of get critical path function
+
+
+# Start of remove token function
+def removeToken(url):
+    return re.sub("([?&])token=[^&]*&?", "\\1", url).rstrip("?&")
+# End of remove token function
+
+
+# Start of report comparisons function
+def reportComparisons(comparisons):
+    # Not enough previous runs to compare to
+    if (comparisons == None):
+        printMessage("Saved the results, not enough previous runs to compare to yet...","info")
+        return False
+    regressionMessage = ResultsStore.getRegressionMessage(comparisons)
+    # If nothing is slower
+    if not regressionMessage:
+        printMessage("No significant slowdown compared to the previous runs...","info")
+        return False
+    printMessage("Significantly slower than the previous runs:","warning")
+    printMessage(regressionMessage,"warning")
+    # Logging
+    if (enableLogging == "true"):
+        logger.warning("Significantly slower than the previous runs:")
+        logger.warning(regressionMessage)
+    if (sendErrorEmail == "true"):
+        # Send email
+        sendEmail("Significantly slower than the previous runs:\n" + regressionMessage)
+    return True
+# End of report comparisons function
+
+
+# Start of write HAR function
+def writeHAR(harFile, webRequests, waterfallStart, waterfallTime, pageTitle):
+    entries = []
+    for request in webRequests:
+        timing = request["timing"]
+        # Remove the token from the URL
+        url = removeToken(request["url"])
+        headers = request["headers"]
+        # Times are in milliseconds and connect includes TLS
+        entries.append({"pageref": "page_1",
+                        "startedDateTime": (waterfallStart + datetime.timedelta(seconds=request["start"])).isoformat() + "Z",
+                        "time": round((request["blocked"] + timing["total"]) * 1000, 3),
+                        "request": {"method": "GET", "url": url, "httpVersion": "HTTP/1.1", "headers": [], "queryString": [], "cookies": [], "headersSize": -1, "bodySize": 0},
+                        "response": {"status": request["status"], "statusText": request["statusText"], "httpVersion": "HTTP/1.1",
+                                     "headers": [{"name": name, "value": headers[name]} for name in headers if name.lower() not in ["set-cookie"]],
+                                     "cookies": [], "redirectURL": "", "headersSize": -1, "bodySize": timing["bytes"],
+                                     "content": {"size": timing["bytes"], "mimeType": headers.get("Content-Type", headers.get("content-type", ""))}},
+                        "cache": {},
+                        "timings": {"blocked": round(request["blocked"] * 1000, 3),
+                                    "dns": round(timing["dns"] * 1000, 3),
+                                    "connect": round((timing["connect"] + timing["tls"]) * 1000, 3),
+                                    "ssl": round(timing["tls"] * 1000, 3),
+                                    "send": 0,
+                                    "wait": round(timing["wait"] * 1000, 3),
+                                    "receive": round(timing["transfer"] * 1000, 3)}})
+    har = {"log": {"version": "1.2",
+                   "creator": {"name": "ArcGIS Application Test", "version": "1.0"},
+                   "pages": [{"id": "page_1",
+                              "title": pageTitle,
+                              "startedDateTime": waterfallStart.isoformat() + "Z",
+                              "pageTimings": {"onLoad": round(waterfallTime * 1000, 3)}}],
+                   "entries": entries}}
+    harData = open(harFile, "w")
+    json.dump(har, harData, indent=2)
+    harData.close()
+# End of write HAR function
+
+
 # Start of services in web map function
 def servicesWebmap(portalUrl,token,webmap):
     # Setup parameters for web map query
     dict = {}
     dict['f'] = 'json'
     dict['token'] = token
-    # Python version check
-    if sys.version_info[0] >= 3:
-        # Python 3.x
-        # Encode parameters
-        params = urllib.parse.urlencode(dict)
-    else:
-        # Python 2.x
-        # Encode parameters
-        params = urllib.urlencode(dict)
-    params = params.encode('utf-8')
-
     # POST the request - web map query
-    requestURL = urllib2.Request(portalUrl + "/sharing/rest/content/items/" + webmap + "/data",params)
-    response = urllib2.urlopen(requestURL)
-    # Python version check
-    if sys.version_info[0] >= 3:
-        # Python 3.x
-        # Read json response
-        responseJSON = json.loads(response.read().decode('utf8'))
-    else:
-        # Python 2.x
-        # Read json response
-        responseJSON = json.loads(response.read())
+    responseJSON = TokenManager.requestJSON(portalUrl + "/sharing/rest/content/items/" + webmap + "/data",dict)
 
     # Log results
     if "error" in responseJSON:
@@ -262,19 +426,17 @@ def servicesWebmap(portalUrl,token,webmap):
 # Start of get token function
 def generateToken(username, password, portalUrl):
     '''Retrieves a token to be used with API requests.'''
-    parameters = urllib.urlencode({'username' : username,
-                                   'password' : password,
-                                   'client' : 'referer',
-                                   'referer': portalUrl,
-                                   'expiration': 60,
-                                   'f' : 'json'})
+    parameters = {'username' : username,
+                  'password' : password,
+                  'client' : 'referer',
+                  'referer': portalUrl,
+                  'expiration': 60,
+                  'f' : 'json'}
     try:
-        response = urllib2.urlopen(portalUrl + '/sharing/rest/generateToken?',
-                              parameters).read()     
+        responseJSON = TokenManager.requestToken(portalUrl + '/sharing/rest/generateToken',parameters)
     except Exception as e:
         arcpy.AddError( 'Unable to open the url %s/sharing/rest/generateToken' % (portalUrl))
         arcpy.AddError(e)
-    responseJSON =  json.loads(response.strip(' \t\n\r'))
     # Log results
     if responseJSON.has_key('error'):
         errDict = responseJSON['error']
@@ -369,9 +531,6 @@ if __name__ == '__main__':
         logger.info("Process started.")
     # Setup the use of a proxy for requests
     if (enableProxy == "true"):
-        # Setup the proxy
-        proxy = urllib2.ProxyHandler({requestProtocol : proxyURL})
-        openURL = urllib2.build_opener(proxy)
-        # Install the proxy
-        urllib2.install_opener(openURL)
+        # Setup the proxy on the shared session
+        RESTClient.setProxy(requestProtocol, proxyURL)
     mainFunction(*argv)
@@ -16,12 +16,13 @@ import sys
 import logging
 import smtplib
 import arcpy
-import httplib
 import json
 import urllib
-import urllib2
+import RESTClient
+import TokenManager
 import urlparse
 import time
+import JobPoller
 import xml.etree.ElementTree as ET
 
 # Enable data to be overwritten
@@ -36,6 +37,8 @@ emailUser = ""
 emailPassword = ""
 emailSubject = ""
 emailMessage = ""
+waitForCache = "false" # Wait for the cache job to finish and report how long it was queued and executing for
+cacheTimeLimit = 86400 # Seconds to wait for the cache job to finish before it is cancelled
 output = None
         
 # Start of main function
@@ -87,7 +90,7 @@ def mainFunction(agsServerSite,username,password,mapService,updateMode,cacheInst
                 jobID = createCache(serverName, serverPort, protocol, mapService, token, cacheFolder, tileOrigin, scales, storageFormat, cacheFormat, tileCompressQuality, dpi, tileWidth, tileHeight, useLocalCache)
 
                 # Check job status of cache
-                jobStatus, messages = checkRunningCache(serverName, serverPort, protocol, token, jobID)
+                jobStatus, messages = checkCreateCache(serverName, serverPort, protocol, token, jobID)
 
                 # If the job has successfully started
                 if  ((jobStatus.lower() == "esrijobsubmitted") or (jobStatus.lower() == "esrijobwaiting") or (jobStatus.lower() == "esrijobexecuting") or (jobStatus.lower() == "esrijobsucceeded")):
@@ -97,6 +100,9 @@ def mainFunction(agsServerSite,username,password,mapService,updateMode,cacheInst
                         if (enableLogging == "true"):   
                             logger.info("Map caching - Started...")
                             logger.info("Check Cache Status from ArcGIS Server Manager for an update on progress...") 
+                        # If waiting for the cache to finish
+                        if (waitForCache == "true"):
+                            waitCache(serverName, serverPort, protocol, token, "Create Map Cache", jobID, checkCreateCache)
                 # Caching has failed
                 else:
                     arcpy.AddError("Caching has failed, see service logs for more details...")
@@ -135,6 +141,9 @@ def mainFunction(agsServerSite,username,password,mapService,updateMode,cacheInst
                             if (enableLogging == "true"):   
                                 logger.info("Map caching - Started...")
                                 logger.info("Check Cache Status from ArcGIS Server Manager for an update on progress...") 
+                            # If waiting for the cache to finish
+                            if (waitForCache == "true"):
+                                waitCache(serverName, serverPort, protocol, token, "Manage Map Cache Tiles", jobID, checkRunningCache)
                     # Caching has failed
                     else:
                         arcpy.AddError("Caching has failed, see service logs for more details...")
@@ -214,7 +223,7 @@ def mainFunction(agsServerSite,username,password,mapService,updateMode,cacheInst
 
 # Start of get tile info function
 def getTileInfo(serverName, serverPort, protocol, mapService, token):
-    params = urllib.urlencode({'token': token, 'f': 'json'})
+    params = {'token': token, 'f': 'json'}
             
     # Construct URL to get the service tile info
     url = "/arcgis/rest/services/" + mapService + "/MapServer"
@@ -231,7 +240,7 @@ def getTileInfo(serverName, serverPort, protocol, mapService, token):
         return -1
 
     # If there is an error
-    if (response.status != 200):
+    if (response.status_code != 200):
         arcpy.AddError("Error getting map service tile info.")
         arcpy.AddError(str(data))
         # Logging
@@ -271,19 +280,19 @@ def getTileInfo(serverName, serverPort, protocol, mapService, token):
 
 # Start of create cache function
 def createCache(serverName, serverPort, protocol, mapService, token, cacheFolder, tileOrigin, scales, storageFormat, cacheFormat, tileCompressQuality, dpi, tileWidth, tileHeight, useLocalCache):
-    params = urllib.urlencode({'service_url': mapService + ":MapServer",
-                               'out_folder': cacheFolder,
-                               'tile_origin': tileOrigin,
-                               'levels': scales,
-                               'storage_format': storageFormat,
-                               'cache_format': cacheFormat,
-                               'tile_compression_quality': tileCompressQuality,
-                               'dpi': dpi,
-                               'tile_width': tileWidth,
-                               'tile_height': tileHeight,
-                               'use_local_cache_dir': useLocalCache,
-                               'token': token,
-                               'f': 'json'})
+    params = {'service_url': mapService + ":MapServer",
+              'out_folder': cacheFolder,
+              'tile_origin': tileOrigin,
+              'levels': scales,
+              'storage_format': storageFormat,
+              'cache_format': cacheFormat,
+              'tile_compression_quality': tileCompressQuality,
+              'dpi': dpi,
+              'tile_width': tileWidth,
+              'tile_height': tileHeight,
+              'use_local_cache_dir': useLocalCache,
+              'token': token,
+              'f': 'json'}
                 
     # Construct URL to start the updating of the cache
     url = "/arcgis/rest/services/System/CachingTools/GPServer/Create Map Cache/submitJob"
@@ -300,7 +309,7 @@ def createCache(serverName, serverPort, protocol, mapService, token, cacheFolder
         return -1
 
     # If there is an error
-    if (response.status != 200):
+    if (response.status_code != 200):
         arcpy.AddError("Error creating map service cache.")
         arcpy.AddError(str(data))
         # Logging
@@ -339,12 +348,12 @@ def createCache(serverName, serverPort, protocol, mapService, token, cacheFolder
 
 # Start of start cache function
 def startCache(serverName, serverPort, protocol, mapService, token, scales, updateMode, cacheInstances):
-    params = urllib.urlencode({'service_url': mapService + ":MapServer",
-                               'levels': scales,
-                               'thread_count': cacheInstances,
-                               'update_mode': updateMode,
-                               'token': token,
-                               'f': 'json'})
+    params = {'service_url': mapService + ":MapServer",
+              'levels': scales,
+              'thread_count': cacheInstances,
+              'update_mode': updateMode,
+              'token': token,
+              'f': 'json'}
             
     # Construct URL to start the updating of the cache
     url = "/arcgis/rest/services/System/CachingTools/GPServer/Manage Map Cache Tiles/submitJob"
@@ -361,7 +370,7 @@ def startCache(serverName, serverPort, protocol, mapService, token, scales, upda
         return -1
 
     # If there is an error
-    if (response.status != 200):
+    if (response.status_code != 200):
         arcpy.AddError("Error updating map service cache.")
         arcpy.AddError(str(data))
         # Logging
@@ -400,8 +409,8 @@ def startCache(serverName, serverPort, protocol, mapService, token, scales, upda
 
 # Start of check cache creation function
 def checkCreateCache(serverName, serverPort, protocol, token, jobID): 
-    params = urllib.urlencode({'token': token,
-                               'f': 'json'})
+    params = {'token': token,
+              'f': 'json'}
             
     # Construct URL to start the updating of the cache
     url = "/arcgis/rest/services/System/CachingTools/GPServer/Create Map Cache/jobs/" + jobID
@@ -418,7 +427,7 @@ def checkCreateCache(serverName, serverPort, protocol, token, jobID):
         return -1
 
     # If there is an error
-    if (response.status != 200):
+    if (response.status_code != 200):
         arcpy.AddError("Error checking map service cache creation.")
         arcpy.AddError(str(data))
         # Logging
@@ -445,8 +454,8 @@ def checkCreateCache(serverName, serverPort, protocol, token, jobID):
 
 # Start of check running cache function
 def checkRunningCache(serverName, serverPort, protocol, token, jobID):
-    params = urllib.urlencode({'token': token,
-                               'f': 'json'})
+    params = {'token': token,
+              'f': 'json'}
             
     # Construct URL to start the updating of the cache
     url = "/arcgis/rest/services/System/CachingTools/GPServer/Manage Map Cache Tiles/jobs/" + jobID
@@ -463,7 +472,7 @@ def checkRunningCache(serverName, serverPort, protocol, token, jobID):
         return -1
 
     # If there is an error
-    if (response.status != 200):
+    if (response.status_code != 200):
         arcpy.AddError("Error checking map service cache.")
         arcpy.AddError(str(data))
         # Logging
@@ -488,6 +497,68 @@ def checkRunningCache(serverName, serverPort, protocol, token, jobID):
 # End of check running cache function
 
 
+# Start of wait cache function
+def waitCache(serverName, serverPort, protocol, token, task, jobID, checkCacheFunction):
+    arcpy.AddMessage("Waiting for map caching to finish...")
+    # Check the job until finished, waiting longer between each check and cancelling the job if past the time limit
+    pollResult = JobPoller.pollJob(lambda: getCacheJob(checkCacheFunction(serverName, serverPort, protocol, token, jobID)),
+                                   lambda: cancelCache(serverName, serverPort, protocol, token, task, jobID),
+                                   time.time() + cacheTimeLimit)
+    message = "Map caching - " + str(pollResult["jobStatus"]) + " - Queued for " + str(pollResult["queueTime"]) + " seconds and executed for " + str(pollResult["executionTime"]) + " seconds..."
+
+    # If the cache finished successfully
+    if (str(pollResult["jobStatus"]).lower() == "esrijobsucceeded"):
+        arcpy.AddMessage(message)
+        # Logging
+        if (enableLogging == "true"):
+            logger.info(message)
+    else:
+        # If the cache did not finish in time
+        if (pollResult["timedOut"] == True):
+            message = message + " Did not finish within " + str(cacheTimeLimit) + " seconds and was cancelled..."
+        arcpy.AddError(message)
+        # Logging
+        if (enableLogging == "true"):
+            logger.error(message)
+    return pollResult
+# End of wait cache function
+
+
+# Start of get cache job function
+def getCacheJob(cacheJob):
+    # Job status and messages returned
+    if isinstance(cacheJob, tuple):
+        return {'jobStatus': cacheJob[0], 'messages': cacheJob[1]}
+    # Error checking the job
+    return cacheJob
+# End of get cache job function
+
+
+# Start of cancel cache function
+def cancelCache(serverName, serverPort, protocol, token, task, jobID):
+    params = {'token': token,
+              'f': 'json'}
+
+    # Construct URL to cancel the cache job
+    url = "/arcgis/rest/services/System/CachingTools/GPServer/" + task + "/jobs/" + jobID + "/cancel"
+
+    # Post to the server
+    try:
+        response, data = postToServer(serverName, serverPort, protocol, url, params)
+    except:
+        arcpy.AddError("Error cancelling map service cache on " + serverName + ".")
+        # Logging
+        if (enableLogging == "true"):
+            logger.error("Error cancelling map service cache on " + serverName + ".")
+        return -1
+
+    # Return the job status after cancelling
+    if (response.status_code == 200) and (assertJsonSuccess(data)):
+        return json.loads(data)
+    return -1
+# End of cancel cache function
+
+
 # Start of get token function
 def getToken(username, password, serverName, serverPort):
     query_dict = {'username':   username,
@@ -495,11 +566,10 @@ def getToken(username, password, serverName, serverPort):
                   'expiration': "60",
                   'client':     'requestip'}
     
-    query_string = urllib.urlencode(query_dict)
     url = "http://{}:{}/arcgis/admin/generateToken?f=json".format(serverName, serverPort)
    
     try:
-        token = json.loads(urllib2.urlopen(url, query_string).read())
+        token = TokenManager.requestToken(url, query_dict)
         if "token" not in token or token == None:
             arcpy.AddError("Failed to get token, return message from server:")
             arcpy.AddError(token['messages'])            
@@ -512,7 +582,7 @@ def getToken(username, password, serverName, serverPort):
             # Return the token to the function which called for it
             return token['token']
     
-    except urllib2.URLError, error:
+    except RESTClient.RequestError, error:
         arcpy.AddError("Could not connect to machine {} on port {}".format(serverName, serverPort))
         arcpy.AddError(error)
         # Logging
@@ -532,25 +602,15 @@ def postToServer(serverName, serverPort, protocol, url, params):
     # If on secure port
     if (serverPort == -1 and protocol == 'https'):
         serverPort = 443
-        
-    if (protocol == 'http'):
-        httpConn = httplib.HTTPConnection(serverName, int(serverPort))
 
-    if (protocol == 'https'):
-        httpConn = httplib.HTTPSConnection(serverName, int(serverPort))
-        
     headers = {"Content-type": "application/x-www-form-urlencoded", "Accept": "text/plain",'referer':'backuputility','referrer':'backuputility'}
-     
+
     # URL encode the resource URL
     url = urllib.quote(url.encode('utf-8'))
 
-    # Build the connection to add the roles to the server
-    httpConn.request("POST", url, params, headers) 
-
-    response = httpConn.getresponse()
-    data = response.read()
-
-    httpConn.close()
+    # Post the request on the shared session - Connection is kept alive for the next request and an expired token is renewed
+    response = TokenManager.sendRequest(protocol + "://" + serverName + ":" + str(serverPort) + url, params, "POST", headers)
+    data = response.content
 
     # Return response
     return (response, data)
@@ -43,15 +43,8 @@ if (arcgisDesktop == "true"):
     import arcpy
     # Enable data to be overwritten
     arcpy.env.overwriteOutput = True
-# Python version check
-if sys.version_info[0] >= 3:
-    # Python 3.x
-    import urllib.request as urllib2
-else:
-    # Python 2.x
-    import urllib2  
-import urllib
-import ssl
+import RESTClient
+import TokenManager
 import json
 import string
 
@@ -164,29 +157,9 @@ def getItemsFolder(portalUrl,portalAdminName,folderID,itemAccess,newOwner,newFol
     dict = {}
     dict['f'] = 'json'
     dict['token'] = token    
-    # Python version check
-    if sys.version_info[0] >= 3:
-        # Python 3.x
-        # Encode parameters
-        params = urllib.parse.urlencode(dict)
-    else:
-        # Python 2.x
-        # Encode parameters
-        params = urllib.urlencode(dict)
-    params = params.encode('utf-8')
 
     # POST the request - Check folders
-    requestURL = urllib2.Request(portalUrl + "/sharing/rest/content/users/" + portalAdminName + "/" + folderID,params)
-    response = urllib2.urlopen(requestURL)
-    # Python version check
-    if sys.version_info[0] >= 3:
-        # Python 3.x
-        # Read json response
-        responseJSON = json.loads(response.read().decode('utf8'))
-    else:
-        # Python 2.x
-        # Read json response
-        responseJSON = json.loads(response.read())   
+    responseJSON = TokenManager.requestJSON(portalUrl + "/sharing/rest/content/users/" + portalAdminName + "/" + folderID,dict)
     # Log results
     if "error" in responseJSON:
         errDict = responseJSON['error']
@@ -220,29 +193,8 @@ def reassignItem(portalUrl,portalAdminName,folderID,itemId,newOwner,newFolder,to
     dict['targetUsername'] = newOwner
     dict['targetFolderName'] = newFolder
 
-    # Python version check
-    if sys.version_info[0] >= 3:
-        # Python 3.x
-        # Encode parameters
-        params = urllib.parse.urlencode(dict)
-    else:
-        # Python 2.x
-        # Encode parameters
-        params = urllib.urlencode(dict)
-    params = params.encode('utf-8')
-
     # POST the request - share item
-    requestURL = urllib2.Request(portalUrl + "/sharing/rest/content/users/" + portalAdminName + "/" + folderID + "/items/" + itemId + "/reassign",params)
-    response = urllib2.urlopen(requestURL)
-    # Python version check
-    if sys.version_info[0] >= 3:
-        # Python 3.x
-        # Read json response
-        responseJSON = json.loads(response.read().decode('utf8'))
-    else:
-        # Python 2.x
-        # Read json response
-        responseJSON = json.loads(response.read())    
+    responseJSON = TokenManager.requestJSON(portalUrl + "/sharing/rest/content/users/" + portalAdminName + "/" + folderID + "/items/" + itemId + "/reassign",dict)
 
     # Log results
     if "error" in responseJSON:
@@ -272,29 +224,9 @@ def shareItem(portalUrl,portalAdminName,folderID,itemId,itemAccess,groupID,token
         dict['org'] = "true"
     if groupID:
         dict['groups'] = groupID
-    # Python version check
-    if sys.version_info[0] >= 3:
-        # Python 3.x
-        # Encode parameters
-        params = urllib.parse.urlencode(dict)
-    else:
-        # Python 2.x
-        # Encode parameters
-        params = urllib.urlencode(dict)
-    params = params.encode('utf-8')
 
     # POST the request - share item
-    requestURL = urllib2.Request(portalUrl + "/sharing/rest/content/users/" + portalAdminName + "/" + folderID + "/items/" + itemId + "/share",params)
-    response = urllib2.urlopen(requestURL)
-    # Python version check
-    if sys.version_info[0] >= 3:
-        # Python 3.x
-        # Read json response
-        responseJSON = json.loads(response.read().decode('utf8'))
-    else:
-        # Python 2.x
-        # Read json response
-        responseJSON = json.loads(response.read())    
+    responseJSON = TokenManager.requestJSON(portalUrl + "/sharing/rest/content/users/" + portalAdminName + "/" + folderID + "/items/" + itemId + "/share",dict)
 
     # Log results
     if "error" in responseJSON:
@@ -312,29 +244,9 @@ def getfolderID(portalUrl,portalAdminName,folderName,token):
     dict = {}
     dict['f'] = 'json'
     dict['token'] = token    
-    # Python version check
-    if sys.version_info[0] >= 3:
-        # Python 3.x
-        # Encode parameters
-        params = urllib.parse.urlencode(dict)
-    else:
-        # Python 2.x
-        # Encode parameters
-        params = urllib.urlencode(dict)
-    params = params.encode('utf-8')
 
     # POST the request - Check folders
-    requestURL = urllib2.Request(portalUrl + "/sharing/rest/content/users/" + portalAdminName,params)
-    response = urllib2.urlopen(requestURL)
-    # Python version check
-    if sys.version_info[0] >= 3:
-        # Python 3.x
-        # Read json response
-        responseJSON = json.loads(response.read().decode('utf8'))
-    else:
-        # Python 2.x
-        # Read json response
-        responseJSON = json.loads(response.read())   
+    responseJSON = TokenManager.requestJSON(portalUrl + "/sharing/rest/content/users/" + portalAdminName,dict)
     # Log results
     if "error" in responseJSON:
         errDict = responseJSON['error']
@@ -352,43 +264,19 @@ def getfolderID(portalUrl,portalAdminName,folderName,token):
 
 # Start of get token function
 def generateToken(username, password, portalUrl):
-    # Python version check
-    if sys.version_info[0] >= 3:
-        # Python 3.x
-        # Encode parameters
-        parameters = urllib.parse.urlencode({'username' : username,
-                        'password' : password,
-                        'client' : 'referer',
-                        'referer': portalUrl,
-                        'expiration': 180,
-                        'f' : 'json'})
-    else:
-        # Python 2.x
-        # Encode parameters
-        parameters = urllib.urlencode({'username' : username,
-                        'password' : password,
-                        'client' : 'referer',
-                        'referer': portalUrl,
-                        'expiration': 180,
-                        'f' : 'json'})
-    parameters = parameters.encode('utf-8')
+    # Setup the parameters
+    parameters = {'username' : username,
+                  'password' : password,
+                  'client' : 'referer',
+                  'referer': portalUrl,
+                  'expiration': 180,
+                  'f' : 'json'}
     try:
-        urllib2.urlopen(portalUrl + '/sharing/rest/generateToken?',parameters)
-        response = urllib2.urlopen(portalUrl + '/sharing/rest/generateToken?',parameters) 
+        responseJSON = TokenManager.requestToken(portalUrl + '/sharing/rest/generateToken',parameters)
     except Exception as e:
         printMessage( 'Unable to open the url %s/sharing/rest/generateToken' % (portalUrl),'error')
         printMessage(e,'error')
 
-    # Python version check
-    if sys.version_info[0] >= 3:
-        # Python 3.x
-        # Read json response
-        responseJSON = json.loads(response.read().decode('utf8'))
-    else:
-        # Python 2.x
-        # Read json response
-        responseJSON = json.loads(response.read())
-
     # Log results
     if "error" in responseJSON:
         errDict = responseJSON['error']
@@ -483,9 +371,6 @@ if __name__ == '__main__':
         logger.info("Process started.")
     # Setup the use of a proxy for requests
     if (enableProxy == "true"):
-        # Setup the proxy
-        proxy = urllib2.ProxyHandler({requestProtocol : proxyURL})
-        openURL = urllib2.build_opener(proxy)
-        # Install the proxy
-        urllib2.install_opener(openURL)
+        # Setup the proxy on the shared session
+        RESTClient.setProxy(requestProtocol, proxyURL)
     mainFunction(*argv)
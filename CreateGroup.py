@@ -15,9 +15,9 @@ import sys
 import logging
 import smtplib
 import arcpy
-import urllib
-import urllib2
 import json
+import RESTClient
+import TokenManager
 
 # Enable data to be overwritten
 arcpy.env.overwriteOutput = True
@@ -55,14 +55,9 @@ def mainFunction(portalUrl, portalAdminName, portalAdminPassword, groupName, gro
         dict['tags'] = groupTags
         dict['access'] = groupAccess  
         dict['thumbnail'] = groupThumbnail        
-        params = urllib.urlencode(dict)
-
-        # Setup the request
-        request = urllib2.Request(portalUrl + "/sharing/rest/community/createGroup",params)
 
         # POST the request
-        response = urllib2.urlopen(request).read()
-        responseJSON = json.loads(response)
+        responseJSON = TokenManager.requestJSON(portalUrl + "/sharing/rest/community/createGroup",dict)
 
         # Log results
         if responseJSON.has_key('error'):
@@ -79,14 +74,9 @@ def mainFunction(portalUrl, portalAdminName, portalAdminPassword, groupName, gro
             dict['f'] = 'json'
             dict['token'] = token
             dict['users'] = userNames                 
-            params = urllib.urlencode(dict)
-
-            # Setup the request
-            request = urllib2.Request(portalUrl + "/sharing/rest/community/groups/" + groupId + "/addUsers",params)
 
             # POST the request
-            response = urllib2.urlopen(request).read()
-            responseJSON = json.loads(response)
+            responseJSON = TokenManager.requestJSON(portalUrl + "/sharing/rest/community/groups/" + groupId + "/addUsers",dict)
 
             # Log results
             if responseJSON.has_key('error'):
@@ -162,19 +152,17 @@ def mainFunction(portalUrl, portalAdminName, portalAdminPassword, groupName, gro
 # Start of get token function
 def generateToken(username, password, portalUrl):
     '''Retrieves a token to be used with API requests.'''
-    parameters = urllib.urlencode({'username' : username,
-                                   'password' : password,
-                                   'client' : 'referer',
-                                   'referer': portalUrl,
-                                   'expiration': 60,
-                                   'f' : 'json'})
+    parameters = {'username' : username,
+                  'password' : password,
+                  'client' : 'referer',
+                  'referer': portalUrl,
+                  'expiration': 60,
+                  'f' : 'json'}
     try:
-        response = urllib2.urlopen(portalUrl + '/sharing/rest/generateToken?',
-                              parameters).read()     
+        responseJSON = TokenManager.requestToken(portalUrl + '/sharing/rest/generateToken',parameters)
     except Exception as e:
         arcpy.AddError( 'Unable to open the url %s/sharing/rest/generateToken' % (portalUrl))
         arcpy.AddError(e)
-    responseJSON =  json.loads(response.strip(' \t\n\r'))
     # Log results
     if responseJSON.has_key('error'):
         errDict = responseJSON['error']
@@ -243,9 +231,6 @@ if __name__ == '__main__':
         logger.info("Process started.")
     # Setup the use of a proxy for requests
     if (enableProxy == "true"):
-        # Setup the proxy
-        proxy = urllib2.ProxyHandler({requestProtocol : proxyURL})
-        openURL = urllib2.build_opener(proxy)
-        # Install the proxy
-        urllib2.install_opener(openURL)
+        # Setup the proxy on the shared session
+        RESTClient.setProxy(requestProtocol, proxyURL)
     mainFunction(*argv)
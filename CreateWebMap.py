@@ -43,14 +43,8 @@ if (arcgisDesktop == "true"):
     import arcpy
     # Enable data to be overwritten
     arcpy.env.overwriteOutput = True
-# Python version check
-if sys.version_info[0] >= 3:
-    # Python 3.x
-    import urllib.request as urllib2
-else:
-    # Python 2.x
-    import urllib2  
-import urllib
+import RESTClient
+import TokenManager
 import json
 import csv
 
@@ -118,29 +112,9 @@ def mainFunction(portalUrl,portalAdminName,portalAdminPassword,webMapTitle,webMa
 
         dict['f'] = 'json'
         dict['token'] = token
-        # Python version check
-        if sys.version_info[0] >= 3:
-            # Python 3.x
-            # Encode parameters
-            params = urllib.parse.urlencode(dict)
-        else:
-            # Python 2.x
-            # Encode parameters
-            params = urllib.urlencode(dict)
-        params = params.encode('utf-8')
 
         # POST the request - Creating the web map query
-        requestURL = urllib2.Request(portalUrl + "/sharing/rest/content/users/" + portalAdminName + "/addItem",params)
-        response = urllib2.urlopen(requestURL)
-        # Python version check
-        if sys.version_info[0] >= 3:
-            # Python 3.x
-            # Read json response
-            responseJSON = json.loads(response.read().decode('utf8'))
-        else:
-            # Python 2.x
-            # Read json response
-            responseJSON = json.loads(response.read())
+        responseJSON = TokenManager.requestJSON(portalUrl + "/sharing/rest/content/users/" + portalAdminName + "/addItem",dict)
 
         # Log results
         if "error" in responseJSON:
@@ -239,43 +213,19 @@ def mainFunction(portalUrl,portalAdminName,portalAdminPassword,webMapTitle,webMa
 
 # Start of get token function
 def generateToken(username, password, portalUrl):
-    # Python version check
-    if sys.version_info[0] >= 3:
-        # Python 3.x
-        # Encode parameters
-        parameters = urllib.parse.urlencode({'username' : username,
-                        'password' : password,
-                        'client' : 'referer',
-                        'referer': portalUrl,
-                        'expiration': 60,
-                        'f' : 'json'})
-    else:
-        # Python 2.x
-        # Encode parameters
-        parameters = urllib.urlencode({'username' : username,
-                        'password' : password,
-                        'client' : 'referer',
-                        'referer': portalUrl,
-                        'expiration': 60,
-                        'f' : 'json'})
-    parameters = parameters.encode('utf-8')
+    # Setup the parameters
+    parameters = {'username' : username,
+                  'password' : password,
+                  'client' : 'referer',
+                  'referer': portalUrl,
+                  'expiration': 60,
+                  'f' : 'json'}
     try:
-        urllib2.urlopen(portalUrl + '/sharing/rest/generateToken?',parameters)
-        response = urllib2.urlopen(portalUrl + '/sharing/rest/generateToken?',parameters) 
+        responseJSON = TokenManager.requestToken(portalUrl + '/sharing/rest/generateToken',parameters)
     except Exception as e:
         printMessage( 'Unable to open the url %s/sharing/rest/generateToken' % (portalUrl),'error')
         printMessage(e,'error')
 
-    # Python version check
-    if sys.version_info[0] >= 3:
-        # Python 3.x
-        # Read json response
-        responseJSON = json.loads(response.read().decode('utf8'))
-    else:
-        # Python 2.x
-        # Read json response
-        responseJSON = json.loads(response.read())
-
     # Log results
     if "error" in responseJSON:
         errDict = responseJSON['error']
@@ -370,9 +320,6 @@ if __name__ == '__main__':
         logger.info("Process started.")
     # Setup the use of a proxy for requests
     if (enableProxy == "true"):
-        # Setup the proxy
-        proxy = urllib2.ProxyHandler({requestProtocol : proxyURL})
-        openURL = urllib2.build_opener(proxy)
-        # Install the proxy
-        urllib2.install_opener(openURL)
+        # Setup the proxy on the shared session
+        RESTClient.setProxy(requestProtocol, proxyURL)
     mainFunction(*argv)
@@ -43,15 +43,8 @@ if (arcgisDesktop == "true"):
     import arcpy
     # Enable data to be overwritten
     arcpy.env.overwriteOutput = True
-# Python version check
-if sys.version_info[0] >= 3:
-    # Python 3.x
-    import urllib.request as urllib2
-else:
-    # Python 2.x
-    import urllib2  
-import urllib
-import ssl
+import RESTClient
+import TokenManager
 import json
 import string
 import time
@@ -77,54 +70,31 @@ def mainFunction(portalUrl,portalAdminName,portalAdminPassword,featureServiceURL
         dict['f'] = 'json'
         dict['token'] = token
         dict['where'] = '1=1'
-        dict['outFields'] = '*'        
-        # Python version check
-        if sys.version_info[0] >= 3:
-            # Python 3.x
-            # Encode parameters
-            params = urllib.parse.urlencode(dict)
-        else:
-            # Python 2.x
-            # Encode parameters
-            params = urllib.urlencode(dict)
-        params = params.encode('utf-8')
+        dict['outFields'] = 'objectid,' + dateTimeField
 
-        # POST the request
-        requestURL = urllib2.Request(featureServiceURL + "/query",params)
-        response = urllib2.urlopen(requestURL)
-        # Python version check
-        if sys.version_info[0] >= 3:
-            # Python 3.x
-            # Read json response
-            responseJSON = json.loads(response.read().decode('utf8'))
-        else:
-            # Python 2.x
-            # Read json response
-            responseJSON = json.loads(response.read())    
+        # POST the request - Read the features as they arrive
+        responseInfo = {}
+        featuresToDelete = []
+        deleteFeaturesQuery = ""
+        for feature in TokenManager.streamJSON(featureServiceURL + "/query",dict,"features",responseInfo):
+            featureDateTime = feature["attributes"][dateTimeField]
+            # Get the features that are older than the max time
+            if (featureDateTime < unixmaxTime):
+                featuresToDelete.append(feature["attributes"]["objectid"])
+
+                # If the first feature to delete
+                if (deleteFeaturesQuery == ""):
+                    deleteFeaturesQuery = "OBJECTID = '" + str(feature["attributes"]["objectid"]) + "'"
+                else:
+                    deleteFeaturesQuery = deleteFeaturesQuery + " OR " + "OBJECTID = '" + str(feature["attributes"]["objectid"]) + "'"
 
         # Log results
-        if "error" in responseJSON:
-            errDict = responseJSON['error']
+        if "error" in responseInfo:
+            errDict = responseInfo['error']
             message =  "Error Code: %s \n Message: %s" % (errDict['code'],
             errDict['message'])
             printMessage(message,"error")
         else:
-            featuresToDelete = []
-            deleteFeaturesQuery = ""
-            count = 0
-            for feature in responseJSON["features"]:
-                featureDateTime = feature["attributes"][dateTimeField]
-                # Get the features that are older than the max time
-                if (featureDateTime < unixmaxTime):
-                    featuresToDelete.append(feature["attributes"]["objectid"])
-
-                    # If the first feature
-                    if count == 0:
-                        deleteFeaturesQuery = "OBJECTID = '" + str(feature["attributes"]["objectid"]) + "'"
-                    else:
-                        deleteFeaturesQuery = deleteFeaturesQuery + " OR " + "OBJECTID = '" + str(feature["attributes"]["objectid"]) + "'"
-                count = count + 1
-     
             printMessage("Object IDs of features to delete - " + str(featuresToDelete) + "...","info")
             printMessage("Querying Feature Service - " + featureServiceURL + "/deleteFeatures" + "...","info")
             # Setup parameters for web map query
@@ -132,30 +102,9 @@ def mainFunction(portalUrl,portalAdminName,portalAdminPassword,featureServiceURL
             dict['f'] = 'json'
             dict['token'] = token
             dict['where'] = deleteFeaturesQuery
-            # Python version check
-            if sys.version_info[0] >= 3:
-                # Python 3.x
-                # Encode parameters
-                params = urllib.parse.urlencode(dict)
-            else:
-                # Python 2.x
-                # Encode parameters
-                params = urllib.urlencode(dict)
-            params = params.encode('utf-8')
 
             # POST the request
-            requestURL = urllib2.Request(featureServiceURL + "/deleteFeatures",params)
-            response = urllib2.urlopen(requestURL)
-            printMessage(response.read(),"info") 
-            # Python version check
-            if sys.version_info[0] >= 3:
-                # Python 3.x
-                # Read json response
-                responseJSON = json.loads(response.read().decode('utf8'))
-            else:
-                # Python 2.x
-                # Read json response
-                responseJSON = json.loads(response.read())    
+            responseJSON = TokenManager.requestJSON(featureServiceURL + "/deleteFeatures",dict)
 
             # Log results
             if "error" in responseJSON:
@@ -252,43 +201,19 @@ def mainFunction(portalUrl,portalAdminName,portalAdminPassword,featureServiceURL
 
 # Start of get token function
 def generateToken(username, password, portalUrl):
-    # Python version check
-    if sys.version_info[0] >= 3:
-        # Python 3.x
-        # Encode parameters
-        parameters = urllib.parse.urlencode({'username' : username,
-                        'password' : password,
-                        'client' : 'referer',
-                        'referer': portalUrl,
-                        'expiration': 180,
-                        'f' : 'json'})
-    else:
-        # Python 2.x
-        # Encode parameters
-        parameters = urllib.urlencode({'username' : username,
-                        'password' : password,
-                        'client' : 'referer',
-                        'referer': portalUrl,
-                        'expiration': 180,
-                        'f' : 'json'})
-    parameters = parameters.encode('utf-8')
+    # Setup the parameters
+    parameters = {'username' : username,
+                  'password' : password,
+                  'client' : 'referer',
+                  'referer': portalUrl,
+                  'expiration': 180,
+                  'f' : 'json'}
     try:
-        urllib2.urlopen(portalUrl + '/sharing/rest/generateToken?',parameters)
-        response = urllib2.urlopen(portalUrl + '/sharing/rest/generateToken?',parameters) 
+        responseJSON = TokenManager.requestToken(portalUrl + '/sharing/rest/generateToken',parameters)
     except Exception as e:
         printMessage( 'Unable to open the url %s/sharing/rest/generateToken' % (portalUrl),'error')
         printMessage(e,'error')
 
-    # Python version check
-    if sys.version_info[0] >= 3:
-        # Python 3.x
-        # Read json response
-        responseJSON = json.loads(response.read().decode('utf8'))
-    else:
-        # Python 2.x
-        # Read json response
-        responseJSON = json.loads(response.read())
-
     # Log results
     if "error" in responseJSON:
         errDict = responseJSON['error']
@@ -383,9 +308,6 @@ if __name__ == '__main__':
         logger.info("Process started.")
     # Setup the use of a proxy for requests
     if (enableProxy == "true"):
-        # Setup the proxy
-        proxy = urllib2.ProxyHandler({requestProtocol : proxyURL})
-        openURL = urllib2.build_opener(proxy)
-        # Install the proxy
-        urllib2.install_opener(openURL)
+        # Setup the proxy on the shared session
+        RESTClient.setProxy(requestProtocol, proxyURL)
     mainFunction(*argv)
@@ -25,7 +25,7 @@
 #                       for the parent data ID layer e.g. "ParentGlobalID" (Optional) 
 # Author:               Shaun Weston (shaun_weston@eagle.co.nz)
 # Date Created:         09/04/2019
-# Last Updated:         17/12/2019
+# Last Updated:         18/10/2026
 # ArcGIS Version:       ArcGIS API for Python 1.6.1+
 # Python Version:       3.6.5+ (Anaconda 5.2+)
 #--------------------------------
@@ -50,8 +50,18 @@ import time
 import shutil
 import csv
 import json
-import multiprocessing.pool
+import hashlib
+import threading
+import concurrent.futures
 import itertools
+import tarfile
+import zipfile
+import RESTClient
+# Zstandard compression used for tar.zst archives (Optional - Only needed if using tar.zst archives)
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 # Set global variables
 # Logging
@@ -71,15 +81,67 @@ emailMessage = ""
 enableProxy = "false"
 requestProtocol = "http" # http or https
 proxyURL = ""
+# Parallel processing
+maxWorkers = 16 # Threads shared by all the items, features and attachments being processed
+maxMetadataCalls = 8 # Portal and service queries made at the same time e.g. querying features or listing attachments
+maxDownloads = 4 # Files downloaded or exported at the same time
+maxQueuedTasks = 200 # Tasks waiting for a thread before new tasks are run straight away by the thread adding them
+# Attachments
+featurePageSize = 1000 # Features queried at a time, no more than the max record count of the layer
+attachmentBatchSize = 500 # Features to list attachments for in each query attachments request
+# Downloads
+downloadChunkSize = 1048576 # Bytes read and written to file at a time, so memory use is the same for any size of file
+downloadRetries = 5 # Times to resume a download from where it stopped after it fails
+downloadTimeout = 120 # Seconds to wait to connect and for each read
+# Incremental backup
+useManifest = "true" # Only download new or changed items and attachments, linking unchanged files from the previous backup
+manifestFile = "BackupManifest.json" # Created in the download location
+# Archive output
+archiveFormat = "" # Write the backup into archives instead of folders e.g. "zip" or "tar.zst" (Needs zstandard), blank to use folders
+archiveMaxSize = 4294967296 # Bytes written to an archive before a new archive is started
+archiveCompressionLevel = 3 # Compression level for tar.zst archives
+archiveIndexFile = "ArchiveIndex.json" # Index of where each file is in the archives, created in the backup folder
+# Object store
+useObjectStore = "true" # Store each file once by its content hash and hard link it into the dated backup folders
+objectFolder = "Objects" # Created in the download location
+backupRetention = 0 # Number of dated backup folders to keep, older backups and files no longer used are deleted after each backup (0 keeps all)
 # Output
 output = None
-featureFolderLocations = []
+
+# Folder for each feature by data ID and feature ID, used to find the parent folder for layers joined to it
+featureFolderIndex = {}
+featureFolderDataIDs = set()
+featureFolderLock = threading.Lock()
+
+# Shared worker pool and limits - Setup when the script runs
+executor = None
+metadataLimit = threading.BoundedSemaphore(maxMetadataCalls)
+downloadLimit = threading.BoundedSemaphore(maxDownloads)
+queuedTasks = threading.BoundedSemaphore(maxQueuedTasks)
+
+# Manifest from the previous backup and the one for this backup - Setup when the script runs
+previousManifest = None
+manifest = None
+manifestLock = threading.Lock()
+# Object store folder - Setup when the script runs
+objectLocation = None
+# Archives being written for this backup - Setup when the script runs
+archiveLocation = None
+openArchives = []
+archiveCount = 0
+archiveIndex = {}
+archiveFolders = set()
+archiveLock = threading.Lock()
 
 
 # Start of main function
 def mainFunction(portalURL,portalUser,portalPassword,configFile,createFolder,downloadLocation,parallelProcessing): # Add parameters sent to the script here e.g. (var1 is 1st parameter,var2 is 2nd parameter,var3 is 3rd parameter)
+    global objectLocation, archiveLocation
     try:
         # --------------------------------------- Start of code --------------------------------------- #
+        # Start the worker pool used for all the items, features and attachments
+        startExecutor()
+
         # Connect to GIS portal
         printMessage("Connecting to GIS Portal - {}...".format(portalURL),"info")
         
@@ -99,7 +161,8 @@ def mainFunction(portalURL,portalUser,portalPassword,configFile,createFolder,dow
                         for itemConfig in configData["items"]:
                             if "itemID" in itemConfig:
                                 # Get the item
-                                item = gisPortal.content.get(itemConfig["itemID"])
+                                with metadataLimit:
+                                    item = gisPortal.content.get(itemConfig["itemID"])
                                 itemDict = {}
                                 itemDict["item"] = item
                                 itemDict["itemConfig"] = itemConfig
@@ -122,6 +185,15 @@ def mainFunction(portalURL,portalUser,portalPassword,configFile,createFolder,dow
 
         # If there are items
         if len(itemDicts) > 0:
+            # Load the manifest from the previous backup
+            manifestPath = os.path.join(downloadLocation,manifestFile)
+            if (useManifest.lower() == "true") and (not archiveFormat):
+                loadManifest(manifestPath)
+            # Setup the object store
+            backupLocation = downloadLocation
+            if (useObjectStore.lower() == "true") and (not archiveFormat):
+                objectLocation = os.path.join(downloadLocation,objectFolder)
+
             # Setup a folder if necessary
             if (createFolder.lower() == "true"):
                 if not os.path.exists(os.path.join(downloadLocation,"AGSBackup-" + time.strftime("%Y%m%d"))):
@@ -129,16 +201,38 @@ def mainFunction(portalURL,portalUser,portalPassword,configFile,createFolder,dow
                     printMessage("Creating folder - " + os.path.join(downloadLocation,"AGSBackup-" + time.strftime("%Y%m%d")) + "...","info")
                     os.makedirs(os.path.join(downloadLocation,"AGSBackup-" + time.strftime("%Y%m%d")))
                 downloadLocation = os.path.join(downloadLocation,"AGSBackup-" + time.strftime("%Y%m%d"))
+            # Start the manifest for this backup
+            if (manifest != None):
+                manifest["backupFolder"] = os.path.abspath(downloadLocation)
+            # Setup the archives
+            if (archiveFormat):
+                if (archiveFormat.lower() == "tar.zst") and (zstandard == None):
+                    raise Exception("The zstandard module is needed to write tar.zst archives...")
+                archiveLocation = downloadLocation
 
+            # Process parent layers before the layers joined to them
+            itemDicts = sortItems(itemDicts)
             # If using parallel processing to download the items
             if (parallelProcessing.lower() == "true"):            
-                # Download data for items - Pool items for processing   
-                multiprocessing.pool.ThreadPool().starmap(downloadItem,zip(itemDicts,itertools.repeat(configData),itertools.repeat(downloadLocation)))
+                # Download data for items - Pool items for processing, each item starts when its parent has finished
+                runItems(itemDicts,configData,downloadLocation)
             else:
                 # For each item
                 for itemDict in itemDicts:
                     # Download data for item
                     downloadItem(itemDict,configData,downloadLocation)                
+
+            # Finish the archives and write the index
+            if (archiveLocation != None):
+                closeArchives()
+            # Save the manifest for the next backup
+            if (manifest != None):
+                saveManifest(manifestPath)
+            # Delete old backups and files no longer used
+            if (objectLocation != None):
+                collectGarbage(backupLocation)
+        # Wait for any tasks still running and close the worker pool
+        stopExecutor(False)
         # --------------------------------------- End of code --------------------------------------- #
         # If called from ArcGIS GP tool
         if __name__ == '__main__':
@@ -165,6 +259,11 @@ def mainFunction(portalURL,portalUser,portalPassword,configFile,createFolder,dow
             logger.handlers = []
     # If error
     except Exception as e:
+        # Cancel the tasks that have not started and close the worker pool
+        stopExecutor(True)
+        # Finish the archives written so far
+        if (archiveLocation != None):
+            closeArchives()
         errorMessage = ""
         # Build and show the error message
         # If many arguments
@@ -199,6 +298,19 @@ def downloadItem(itemDict,configData,downloadLocation):
     exportData = True
     result = None
 
+    # If the item has not changed since the previous backup and is not exporting attachments
+    itemVersion = None
+    if (manifest != None):
+        itemVersion = getItemVersion(itemDict["item"])
+        if not (configData and itemDict["itemConfig"] and ("layerID" in itemDict["itemConfig"])):
+            # Link the files from the previous backup
+            previousEntry = previousManifest["items"].get(itemDict["item"].id)
+            if (itemVersion) and (previousEntry) and (previousEntry["version"] == itemVersion) and (linkPreviousFiles(previousEntry["files"],downloadLocation,None,previousEntry.get("hashes"))):
+                printMessage("Item has not changed, linked data from previous backup - " + itemDict["item"].id + " (Title - " + itemDict["item"].title + ")...","info")
+                with manifestLock:
+                    manifest["items"][itemDict["item"].id] = previousEntry
+                return
+
     # If item is a hosted feature service 
     if (isHostedFeatureService(itemDict["item"])):
         # If config data
@@ -217,9 +329,10 @@ def downloadItem(itemDict,configData,downloadLocation):
         # If exporting data               
         if (exportData == True):
             printMessage("Exporting data for feature service - " + itemDict["item"].id + " (Title - " + itemDict["item"].title + ")...","info")
-            fgdbItem = itemDict["item"].export(itemDict["item"].title, "File Geodatabase")
-            result = fgdbItem.download(downloadLocation)
-            fgdbItem.delete()
+            with downloadLimit:
+                fgdbItem = itemDict["item"].export(itemDict["item"].title, "File Geodatabase")
+                result = downloadItemFile(fgdbItem,downloadLocation)
+                fgdbItem.delete()
 
     # If item is a feature service
     if (itemDict["item"].type.lower() == "feature service"):
@@ -227,14 +340,16 @@ def downloadItem(itemDict,configData,downloadLocation):
         if "Hosted Service" not in itemDict["item"].typeKeywords:
             # Download the JSON data
             printMessage("Downloading data from item - " + itemDict["item"].id + " (Title - " + itemDict["item"].title + ")...","info")         
-            result = itemDict["item"].download(downloadLocation)                    
+            with downloadLimit:
+                result = downloadItemFile(itemDict["item"],downloadLocation)                    
     elif (itemDict["item"].type.lower() == "code attachment"):
         printMessage("Not downloading data for code attachment - " + itemDict["item"].id + " (Title - " + itemDict["item"].title + ")...","warning")
         exportData = False
     else:
         # Download the JSON data
         printMessage("Downloading data from item - " + itemDict["item"].id + " (Title - " + itemDict["item"].title + ")...","info")         
-        result = itemDict["item"].download(downloadLocation)
+        with downloadLimit:
+            result = downloadItemFile(itemDict["item"],downloadLocation)
 
     # If exporting data  
     if (exportData == True):
@@ -251,6 +366,19 @@ def downloadItem(itemDict,configData,downloadLocation):
                 os.rename(result, result + ".json")
                 filePath = result + ".json"       
             printMessage("Downloaded data to " + filePath,"info")
+            # Move the file into the archive
+            fileHash = None
+            if (archiveLocation != None):
+                addFileToArchive(filePath)
+            # Move the file to the object store
+            elif (objectLocation != None):
+                fileHash = storeFile(filePath)
+            # Add the item to the manifest
+            if (manifest != None):
+                with manifestLock:
+                    manifest["items"][itemDict["item"].id] = {"version": itemVersion,
+                                                              "files": [os.path.relpath(filePath,manifest["backupFolder"])],
+                                                              "hashes": [fileHash]}
         else:
             printMessage("There was an error downloading the data for item " + itemDict["item"].id,"error")      
 # End of download item function
@@ -265,44 +393,82 @@ def exportAttachments(item,configItem,downloadLocation):
         # Get the ID fields
         objectIDField,idField,idJoin = getIDFields(featureLayer,configItem)
 
-        # Get the features
+        # For each page of features
         printMessage("Querying feature service...","info")
-        featureSet = featureLayer.query(return_geometry=False)
-
-        # Get a list of features to download attachments for - Pool features for processing       
-        featureFolders = multiprocessing.pool.ThreadPool().starmap(processFeature,zip(featureSet.features,itertools.repeat(configItem),itertools.repeat(featureLayer),itertools.repeat(objectIDField),itertools.repeat(idField),itertools.repeat(idJoin),itertools.repeat(downloadLocation)))                      
-        # For each feature returned
-        for featureFolder in featureFolders:
-            # Check base folder location exists
-            if not os.path.exists(featureFolder["baseLocation"]):
-                # Create the folder
-                printMessage("Creating folder - {}...".format(featureFolder["baseLocation"]),"info")
-                os.mkdir(featureFolder["baseLocation"])            
-            # Check folder location exists
-            if not os.path.exists(featureFolder["location"]):
-                # Create the folder
-                printMessage("Creating folder - {}...".format(featureFolder["location"]),"info")
-                os.mkdir(featureFolder["location"])
+        for features in getFeaturePages(featureLayer,objectIDField,idField,idJoin):
+            # Get the attachments for the features in batches
+            attachmentIndex = getAttachmentIndex(featureLayer,[feature.attributes[objectIDField] for feature in features])
 
-            # For each sub folder
-            for subFolder in featureFolder["subFolders"]:
-                if not os.path.exists(os.path.join(featureFolder["location"],subFolder)):
-                    # Create the folder
-                    printMessage("Creating folder - {}...".format(os.path.join(featureFolder["location"],subFolder)),"info")
-                    os.mkdir(os.path.join(featureFolder["location"],subFolder))
-                
-            # If there are attachments
-            if (len(featureFolder["featureAttachments"]) > 0):
-                # Download attachments - Pool downloads for processing
-                printMessage("Querying attachments for {}...".format(featureFolder["featureID"]),"info")
-                multiprocessing.pool.ThreadPool().starmap(downloadAttachments,zip(featureFolder["featureAttachments"],itertools.repeat(featureLayer),itertools.repeat(featureFolder["objectid"]),itertools.repeat(featureFolder["location"])))                                           
+            # Get a list of features to download attachments for - Pool features for processing       
+            featureFolders = runTasks(processFeature,zip(features,itertools.repeat(configItem),itertools.repeat(featureLayer),itertools.repeat(objectIDField),itertools.repeat(idField),itertools.repeat(idJoin),itertools.repeat(downloadLocation),itertools.repeat(attachmentIndex)))
+            # Create the folders and download the attachments for the page
+            exportFeatureFolders(featureFolders,featureLayer,item.id + "/" + str(configItem["layerID"]))
     else:
         printMessage("No layer or table name found in item - " + configItem["name"] + "...","warning")
 # End of export attachments function
+
+
+# Start of get feature pages function
+def getFeaturePages(featureLayer,objectIDField,idField,idJoin):
+    # Get the object IDs of all the features - Not limited by the max record count
+    with metadataLimit:
+        objectIDs = sorted(featureLayer.query(return_ids_only=True).get("objectIds") or [])
+    printMessage("{} features in layer...".format(len(objectIDs)),"info")
+
+    # Only query the ID fields
+    outFields = [objectIDField]
+    for field in [idField,idJoin]:
+        if (field) and (field not in outFields):
+            outFields.append(field)
+    pageSize = featurePageSize
+    if (featureLayer.properties.get("maxRecordCount")):
+        pageSize = min(pageSize,featureLayer.properties.get("maxRecordCount"))
+
+    # Query each page of features when it is needed
+    for index in range(0, len(objectIDs), pageSize):
+        pageObjectIDs = objectIDs[index:index + pageSize]
+        with metadataLimit:
+            featureSet = featureLayer.query(object_ids=",".join(str(objectID) for objectID in pageObjectIDs),out_fields=",".join(outFields),return_geometry=False)
+        printMessage("Queried features {} to {} of {}...".format(index + 1,index + len(pageObjectIDs),len(objectIDs)),"info")
+        yield featureSet.features
+# End of get feature pages function
+
+
+# Start of export feature folders function
+def exportFeatureFolders(featureFolders,featureLayer,manifestKey):
+    attachmentDownloads = []
+    # For each feature returned
+    for featureFolder in featureFolders:
+        # Check base folder location exists
+        if not folderExists(featureFolder["baseLocation"]):
+            # Create the folder
+            printMessage("Creating folder - {}...".format(featureFolder["baseLocation"]),"info")
+            makeFolder(featureFolder["baseLocation"])            
+        # Check folder location exists
+        if not folderExists(featureFolder["location"]):
+            # Create the folder
+            printMessage("Creating folder - {}...".format(featureFolder["location"]),"info")
+            makeFolder(featureFolder["location"])
+
+        # For each sub folder
+        for subFolder in featureFolder["subFolders"]:
+            if not folderExists(os.path.join(featureFolder["location"],subFolder)):
+                # Create the folder
+                printMessage("Creating folder - {}...".format(os.path.join(featureFolder["location"],subFolder)),"info")
+                makeFolder(os.path.join(featureFolder["location"],subFolder))
+            
+        # Add the attachments to download
+        for featureAttachment in featureFolder["featureAttachments"]:
+            attachmentDownloads.append((featureAttachment,featureLayer,featureFolder["objectid"],featureFolder["location"],manifestKey))
+
+    # Download attachments for all the features - Pool downloads for processing
+    printMessage("Downloading {} attachments...".format(len(attachmentDownloads)),"info")
+    runTasks(downloadAttachments,attachmentDownloads)
+# End of export feature folders function
         
 
 # Start of process feature function
-def processFeature(feature,configItem,featureLayer,objectIDField,idField,idJoin,downloadLocation):
+def processFeature(feature,configItem,featureLayer,objectIDField,idField,idJoin,downloadLocation,attachmentIndex=None):
     # Get the ID values and set a default
     idValue = "Other"
     joinValue = "Other"
@@ -340,7 +506,12 @@ def processFeature(feature,configItem,featureLayer,objectIDField,idField,idJoin,
     subFolders = configItem["subFolders"].split(",")            
 
     # Get a list of attachments for the feature
-    featureAttachments = featureLayer.attachments.get_list(oid=feature.attributes[objectIDField])
+    if (attachmentIndex != None):
+        featureAttachments = attachmentIndex.get(int(feature.attributes[objectIDField]),[])
+    # Layer doesn't support query attachments, so query the feature
+    else:
+        with metadataLimit:
+            featureAttachments = featureLayer.attachments.get_list(oid=feature.attributes[objectIDField])
     
     # Load location into global array
     featureFolderLocation = {}
@@ -351,43 +522,694 @@ def processFeature(feature,configItem,featureLayer,objectIDField,idField,idJoin,
     featureFolderLocation["objectid"] = feature.attributes[objectIDField] 
     featureFolderLocation["featureAttachments"] = featureAttachments
     featureFolderLocation["subFolders"] = subFolders   
-    featureFolderLocations.append(featureFolderLocation)
+    # Add the location to the index
+    with featureFolderLock:
+        featureFolderIndex[(str(configItem["dataID"]).lower(),idValue.lower())] = downloadFeatureLocation
+        featureFolderDataIDs.add(str(configItem["dataID"]).lower())
     # Return the location
     return featureFolderLocation                    
 # End of process feature function
 
 
 # Start of download attachments function
-def downloadAttachments(featureAttachment,featureLayer,objectID,downloadFeatureLocation):
+def downloadAttachments(featureAttachment,featureLayer,objectID,downloadFeatureLocation,manifestKey=None):
+    filePath = os.path.join(downloadFeatureLocation,featureAttachment["name"])
+    attachmentURL = featureLayer.url + "/" + str(objectID) + "/attachments/" + str(featureAttachment["id"])
+    # If writing to archives, download the attachment straight into an archive
+    if (archiveLocation != None):
+        printMessage("Downloading {}...".format(featureAttachment["name"]),"info")
+        with downloadLimit:
+            addDownloadToArchive(attachmentURL,filePath,getattr(featureLayer._con,"token",None),featureAttachment["size"])
+        return
+
+    # Get the attachment from the previous backup - Key is the item, layer and attachment ID
+    previousEntry = None
+    if (manifest != None) and (manifestKey):
+        manifestKey = manifestKey + "/" + str(featureAttachment["id"])
+        previousEntry = previousManifest["attachments"].get(manifestKey)
+        if (previousEntry) and (previousEntry["size"] != featureAttachment["size"]):
+            previousEntry = None
+
     # Check if file has already been downloaded
     downloadAttachment = False
-    if not os.path.exists(os.path.join(downloadFeatureLocation,featureAttachment["name"])):
-        downloadAttachment = True
-        printMessage("Downloading {}...".format(featureAttachment["name"]),"info")
+    if not os.path.exists(filePath):
+        # If the attachment has not changed, link the file from the previous backup
+        if (previousEntry) and (linkPreviousFiles([previousEntry["file"]],None,[filePath],[previousEntry["hash"]])):
+            printMessage("Attachment has not changed, linked from previous backup - {}...".format(filePath),"info")
+        else:
+            downloadAttachment = True
+            previousEntry = None
+            printMessage("Downloading {}...".format(featureAttachment["name"]),"info")
     else:
-        printMessage("Attachment already exists - {}...".format(os.path.join(downloadFeatureLocation,featureAttachment["name"])),"info")
+        printMessage("Attachment already exists - {}...".format(filePath),"info")
         # Compare attachment file size to the one that is already downloaded
-        if (featureAttachment["size"] != os.path.getsize(os.path.join(downloadFeatureLocation,featureAttachment["name"]))):
+        if (featureAttachment["size"] != os.path.getsize(filePath)):
             downloadAttachment = True
+            previousEntry = None
             printMessage("Attachment has been updated, downloading {}...".format(featureAttachment["name"]),"info")   
     # If downloading the attachment
+    fileHash = None
     if (downloadAttachment == True):
-        featureLayer.attachments.download(oid=objectID,attachment_id=featureAttachment["id"],save_path=downloadFeatureLocation)      
+        with downloadLimit:
+            fileHash = downloadFile(attachmentURL,filePath,getattr(featureLayer._con,"token",None),featureAttachment["size"])
+        # Move the file to the object store
+        if (objectLocation != None):
+            storeFile(filePath,fileHash)
+
+    # Add the attachment to the manifest
+    if (manifest != None) and (manifestKey):
+        # Only hash the file if it is new or changed
+        if (previousEntry):
+            fileHash = previousEntry["hash"]
+        elif (fileHash == None):
+            fileHash = hashFile(filePath)
+        with manifestLock:
+            manifest["attachments"][manifestKey] = {"objectId": objectID,
+                                                    "size": featureAttachment["size"],
+                                                    "hash": fileHash,
+                                                    "file": os.path.relpath(filePath,manifest["backupFolder"])}
 # End of download attachments function
 
 
+# Start of get attachment index function
+def getAttachmentIndex(featureLayer,objectIDs):
+    # If the layer doesn't support query attachments
+    if not supportsQueryAttachments(featureLayer):
+        printMessage("Layer does not support query attachments, querying attachments for each feature...","warning")
+        return None
+
+    # Query the attachments for each batch of features - Pool batches for processing
+    printMessage("Querying attachments for {} features...".format(len(objectIDs)),"info")
+    objectIDs = sorted(int(objectID) for objectID in objectIDs)
+    batches = [objectIDs[index:index + attachmentBatchSize] for index in range(0, len(objectIDs), attachmentBatchSize)]
+    attachmentBatches = runTasks(queryAttachments,zip(itertools.repeat(featureLayer),batches))
+
+    # Index the attachments by the object ID of the feature they belong to
+    attachmentIndex = {}
+    for attachments in attachmentBatches:
+        for attachment in attachments:
+            attachmentIndex.setdefault(attachment["parentObjectId"],[]).append(attachment)
+    return attachmentIndex
+# End of get attachment index function
+
+
+# Start of query attachments function
+def queryAttachments(featureLayer,objectIDs):
+    with metadataLimit:
+        results = featureLayer.attachments.search(object_ids=",".join(str(objectID) for objectID in objectIDs))
+
+    # If the result may have been limited by the max record count, query each half of the batch
+    maxRecordCount = featureLayer.properties.get("maxRecordCount")
+    if (maxRecordCount) and (len(results) >= maxRecordCount) and (len(objectIDs) > 1):
+        middle = len(objectIDs) // 2
+        return queryAttachments(featureLayer,objectIDs[:middle]) + queryAttachments(featureLayer,objectIDs[middle:])
+
+    # Use the same names as the attachment list for a feature
+    attachments = []
+    for result in results:
+        result = dict((key.lower(), value) for key, value in result.items())
+        attachments.append({"id": result["id"],
+                            "name": result["name"],
+                            "size": result["size"],
+                            "contentType": result.get("contenttype"),
+                            "parentObjectId": int(result["parentobjectid"])})
+    return attachments
+# End of query attachments function
+
+
+# Start of supports query attachments function
+def supportsQueryAttachments(featureLayer):
+    properties = featureLayer.properties
+    # Layer property or part of the advanced query capabilities depending on the version
+    if (properties.get("supportsQueryAttachments")):
+        return True
+    advancedQueryCapabilities = properties.get("advancedQueryCapabilities") or {}
+    return (advancedQueryCapabilities.get("supportsQueryAttachments") == True)
+# End of supports query attachments function
+
+
+# Start of download item file function
+def downloadItemFile(item,downloadLocation):
+    # Items without a file name e.g. web maps are JSON, so download with the API
+    if not item.name:
+        return item.download(downloadLocation)
+    # Download the item data
+    itemURL = item._gis._portal.resturl.rstrip("/") + "/content/items/" + item.id + "/data"
+    filePath = os.path.join(downloadLocation,item.name)
+    downloadFile(itemURL,filePath,getattr(item._gis._con,"token",None),item.size)
+    return filePath
+# End of download item file function
+
+
+# Start of download file function
+def downloadFile(url,filePath,token=None,expectedSize=None,expectedHash=None):
+    # Download to a part file, which is kept if the download fails so it can be resumed
+    partPath = filePath + ".part"
+    # Version of the file the part file is from e.g. ETag, so a part file is only resumed if the file has not changed
+    validatorPath = partPath + ".validator"
+    position = 0
+    validator = None
+    if os.path.isfile(partPath):
+        position = os.path.getsize(partPath)
+        if os.path.isfile(validatorPath):
+            with open(validatorPath) as validatorFile:
+                validator = validatorFile.read().strip() or None
+    # Part file is larger than the file or may be from a different version of the file, so start again
+    if (position > 0) and ((validator == None) or ((expectedSize) and (position > expectedSize))):
+        os.remove(partPath)
+        position = 0
+    # Save the version of the file next to the part file
+    def saveValidator(newValidator):
+        with open(validatorPath, "w") as validatorFile:
+            validatorFile.write(newValidator)
+    # Hash the file as it is downloaded, starting with the part already downloaded
+    fileHash = [hashlib.sha256()]
+    if (position > 0):
+        with open(partPath, "rb") as partData:
+            for chunk in iter(lambda: partData.read(downloadChunkSize), b""):
+                fileHash[0].update(chunk)
+    with open(partPath, "ab") as partFile:
+        def writeChunk(chunk):
+            fileHash[0].update(chunk)
+            partFile.write(chunk)
+        # Empty the part file if the download has to start from the beginning
+        def restartOutput():
+            partFile.seek(0)
+            partFile.truncate()
+            fileHash[0] = hashlib.sha256()
+        streamDownload(url,writeChunk,token,position,os.path.basename(filePath),restartOutput,validator,saveValidator)
+
+    # Check the file is complete
+    fileSize = os.path.getsize(partPath)
+    fileHash = fileHash[0].hexdigest()
+    if ((expectedSize) and (fileSize != expectedSize)) or ((expectedHash) and (fileHash != expectedHash)):
+        os.remove(partPath)
+        if os.path.isfile(validatorPath):
+            os.remove(validatorPath)
+        if (expectedSize) and (fileSize != expectedSize):
+            raise Exception("Downloaded file is {} bytes, expected {} bytes - {}".format(fileSize,expectedSize,url))
+        raise Exception("Downloaded file does not match the checksum - " + url)
+    # Replace the file once complete
+    os.replace(partPath,filePath)
+    if os.path.isfile(validatorPath):
+        os.remove(validatorPath)
+    return fileHash
+# End of download file function
+
+
+# Start of stream download function
+def streamDownload(url,writeChunk,token,position,fileName,restartOutput=None,validator=None,saveValidator=None):
+    parameters = None
+    if (token):
+        parameters = {"token": token}
+    for attempt in range(downloadRetries + 1):
+        # Can't tell if the file has changed since the first part was downloaded, so don't join two versions of it
+        if (position > 0) and (not validator):
+            if (restartOutput == None):
+                raise Exception("Server does not return a version for the file, could not resume downloading " + fileName)
+            printMessage("Server does not return a version for the file, downloading {} again...".format(fileName),"warning")
+            restartOutput()
+            position = 0
+        # Ask for the rest of the file - Don't compress, so the range is in bytes of the file
+        headers = {"Accept-Encoding": "identity"}
+        if (position > 0):
+            headers["Range"] = "bytes=" + str(position) + "-"
+            # Only get the rest of the file if it has not changed, otherwise the whole file is returned
+            headers["If-Range"] = validator
+        try:
+            response = RESTClient.sendRequest(url,parameters,"GET",headers,True,downloadTimeout)
+            try:
+                # Already have the whole file
+                if (response.status_code == 416) and (position > 0):
+                    break
+                response.raise_for_status()
+                chunks = response.iter_content(downloadChunkSize)
+                firstChunk = next(chunks, b"")
+                # Error returned as JSON e.g. invalid token - Files can be JSON too, so check for an error in the response
+                if ("json" in response.headers.get("Content-Type", "").lower()) and (isErrorResponse(firstChunk)):
+                    raise Exception("Could not download " + url + " - " + firstChunk.decode("utf-8","replace"))
+                if (response.status_code != 206):
+                    # Start from the beginning if the server doesn't support ranges or the file has changed
+                    if (position > 0):
+                        if (restartOutput == None):
+                            raise Exception("File has changed or server does not support resuming downloads, could not download " + fileName)
+                        printMessage("File has changed or server does not support resuming downloads, downloading {} again...".format(fileName),"warning")
+                        restartOutput()
+                        position = 0
+                    # Version of the file being downloaded - Weak ETags can't be used to resume
+                    validator = response.headers.get("ETag")
+                    if (not validator) or (validator.startswith("W/")):
+                        validator = response.headers.get("Last-Modified")
+                    if (validator) and (saveValidator != None):
+                        saveValidator(validator)
+                # Write each chunk as it is read
+                for chunk in itertools.chain([firstChunk], chunks):
+                    writeChunk(chunk)
+                    position += len(chunk)
+            finally:
+                response.close()
+            break
+        # Connection dropped or timed out
+        except RESTClient.RequestError as error:
+            if (attempt == downloadRetries):
+                raise
+            printMessage("Download of {} failed ({}), resuming...".format(fileName,error),"warning")
+            time.sleep(min(2 ** attempt, 30))
+    return position
+# End of stream download function
+
+
+# Start of is error response function
+def isErrorResponse(content):
+    # ArcGIS errors are a small JSON object with an error e.g. {"error": {"code": 498, ...}}
+    try:
+        contentJSON = json.loads(content.decode("utf-8"))
+    # Not JSON or only part of a larger file
+    except ValueError:
+        return False
+    return isinstance(contentJSON, dict) and ("error" in contentJSON)
+# End of is error response function
+
+
+# Start of add download to archive function
+def addDownloadToArchive(url,filePath,token,expectedSize):
+    # Stream the download into the archive entry - A dropped download is only resumed if the file has the same version (ETag or Last-Modified) as the first response
+    def writeContent(writeChunk):
+        streamDownload(url,writeChunk,token,0,os.path.basename(filePath))
+    addArchiveEntry(filePath,expectedSize,writeContent)
+# End of add download to archive function
+
+
+# Start of add file to archive function
+def addFileToArchive(filePath):
+    # Copy the file into the archive entry, then remove it
+    def writeContent(writeChunk):
+        with open(filePath, "rb") as fileData:
+            for chunk in iter(lambda: fileData.read(downloadChunkSize), b""):
+                writeChunk(chunk)
+    addArchiveEntry(filePath,os.path.getsize(filePath),writeContent)
+    os.remove(filePath)
+# End of add file to archive function
+
+
+# Start of add archive entry function
+def addArchiveEntry(filePath,fileSize,writeContent):
+    # Path in the archive is the same as the path in the backup folder
+    entryName = os.path.relpath(filePath,archiveLocation).replace(os.sep,"/")
+    fileHash = hashlib.sha256()
+    written = [0]
+    archive = getArchive()
+    offset = archive["file"].tell()
+    entryInfo = None
+    try:
+        # Zip - Compressed as it is written
+        if (archive["format"] == "zip"):
+            entryInfo = zipfile.ZipInfo(entryName,time.localtime()[:6])
+            entryInfo.compress_type = zipfile.ZIP_DEFLATED
+            with archive["zip"].open(entryInfo,"w",force_zip64=True) as entry:
+                def writeChunk(chunk):
+                    fileHash.update(chunk)
+                    entry.write(chunk)
+                    written[0] += len(chunk)
+                writeContent(writeChunk)
+        # Tar - Each file is a separate zstandard frame so it can be read without reading the archive before it
+        else:
+            entryInfo = tarfile.TarInfo(entryName)
+            entryInfo.size = fileSize
+            entryInfo.mtime = time.time()
+            entry = zstandard.ZstdCompressor(level=archiveCompressionLevel).stream_writer(archive["file"],closefd=False)
+            entry.write(entryInfo.tobuf(format=tarfile.PAX_FORMAT))
+            def writeChunk(chunk):
+                fileHash.update(chunk)
+                # Size is in the header, so never write more than that
+                entry.write(chunk[:max(0, fileSize - written[0])])
+                written[0] += len(chunk)
+            writeContent(writeChunk)
+            # Fill the rest of the file if short, and up to the end of the tar block
+            entry.write(b"\0" * (max(0, fileSize - written[0]) + ((512 - fileSize % 512) % 512)))
+            entry.flush(zstandard.FLUSH_FRAME)
+        length = archive["file"].tell() - offset
+        if (written[0] != fileSize):
+            raise Exception("Downloaded file is {} bytes, expected {} bytes - {}".format(written[0],fileSize,entryName))
+    # Remove the partial entry so the archive can still be used
+    except:
+        removeArchiveEntry(archive,offset,entryInfo)
+        raise
+    finally:
+        releaseArchive(archive)
+    # Add to the index
+    with archiveLock:
+        archiveIndex[entryName] = {"archive": os.path.basename(archive["path"]),
+                                   "offset": offset,
+                                   "length": length,
+                                   "size": fileSize,
+                                   "hash": fileHash.hexdigest()}
+# End of add archive entry function
+
+
+# Start of remove archive entry function
+def removeArchiveEntry(archive,offset,entryInfo):
+    # Zip - Remove the entry from the central directory written when the archive is closed
+    if (archive["format"] == "zip"):
+        zipArchive = archive["zip"]
+        if (len(zipArchive.filelist) > 0) and (zipArchive.filelist[-1] is entryInfo):
+            zipArchive.filelist.pop()
+            zipArchive.NameToInfo.pop(entryInfo.filename, None)
+        zipArchive.start_dir = offset
+    # Cut the entry off the end of the archive
+    archive["file"].seek(offset)
+    archive["file"].truncate()
+# End of remove archive entry function
+
+
+# Start of folder exists function
+def folderExists(folderPath):
+    # Folder has been added to the archive
+    if (archiveLocation != None):
+        return (folderPath in archiveFolders)
+    return os.path.exists(folderPath)
+# End of folder exists function
+
+
+# Start of make folder function
+def makeFolder(folderPath):
+    if (archiveLocation == None):
+        os.mkdir(folderPath)
+        return
+    # Add the folder to an archive so empty folders are kept
+    with archiveLock:
+        archiveFolders.add(folderPath)
+    entryName = os.path.relpath(folderPath,archiveLocation).replace(os.sep,"/") + "/"
+    archive = getArchive()
+    try:
+        if (archive["format"] == "zip"):
+            entryInfo = zipfile.ZipInfo(entryName,time.localtime()[:6])
+            entryInfo.external_attr = (0o40755 << 16) | 0x10
+            archive["zip"].writestr(entryInfo,b"")
+        else:
+            entryInfo = tarfile.TarInfo(entryName)
+            entryInfo.type = tarfile.DIRTYPE
+            entryInfo.mode = 0o755
+            entryInfo.mtime = time.time()
+            archive["file"].write(zstandard.ZstdCompressor(level=archiveCompressionLevel).compress(entryInfo.tobuf(format=tarfile.PAX_FORMAT)))
+    finally:
+        releaseArchive(archive)
+# End of make folder function
+
+
+# Start of get archive function
+def getArchive():
+    global archiveCount
+    with archiveLock:
+        # Use an archive that is not being written to
+        if (len(openArchives) > 0):
+            return openArchives.pop()
+        # Otherwise start a new archive - One for each file being written at the same time
+        archiveCount += 1
+        archivePath = os.path.join(archiveLocation,"Backup-{:04d}.{}".format(archiveCount,archiveFormat.lower()))
+    printMessage("Creating archive - " + archivePath + "...","info")
+    archive = {"path": archivePath,
+               "format": archiveFormat.lower(),
+               "file": open(archivePath,"wb")}
+    if (archive["format"] == "zip"):
+        archive["zip"] = zipfile.ZipFile(archive["file"],"w",zipfile.ZIP_DEFLATED,allowZip64=True)
+    return archive
+# End of get archive function
+
+
+# Start of release archive function
+def releaseArchive(archive):
+    # Finish the archive if it is full, so a new one is started
+    if (archive["file"].tell() >= archiveMaxSize):
+        closeArchive(archive)
+    else:
+        with archiveLock:
+            openArchives.append(archive)
+# End of release archive function
+
+
+# Start of close archive function
+def closeArchive(archive):
+    if (archive["format"] == "zip"):
+        archive["zip"].close()
+    else:
+        # End of the tar archive
+        archive["file"].write(zstandard.ZstdCompressor(level=archiveCompressionLevel).compress(b"\0" * 1024))
+    archive["file"].close()
+# End of close archive function
+
+
+# Start of close archives function
+def closeArchives():
+    global archiveLocation
+    # Finish all the archives
+    with archiveLock:
+        archives = list(openArchives)
+        del openArchives[:]
+    for archive in archives:
+        closeArchive(archive)
+    # Write the index next to the archives
+    indexPath = os.path.join(archiveLocation,archiveIndexFile)
+    with open(indexPath, "w") as jsonFile:
+        json.dump({"format": archiveFormat.lower(), "entries": archiveIndex}, jsonFile, indent=1)
+    printMessage("Saved archive index - " + indexPath + "...","info")
+    archiveLocation = None
+# End of close archives function
+
+
+# Start of read archive entry function
+def readArchiveEntry(backupLocation,entryName,outputPath):
+    # Find the file in the index
+    with open(os.path.join(backupLocation,archiveIndexFile)) as jsonFile:
+        index = json.load(jsonFile)
+    entry = index["entries"][entryName]
+    archivePath = os.path.join(backupLocation,entry["archive"])
+    with open(outputPath, "wb") as outputFile:
+        # Zip - Read the entry using the central directory
+        if (index["format"] == "zip"):
+            with zipfile.ZipFile(archivePath) as archive:
+                with archive.open(entryName) as entryData:
+                    shutil.copyfileobj(entryData,outputFile,downloadChunkSize)
+        # Tar - Read just the frame for the entry
+        else:
+            with open(archivePath, "rb") as archiveFile:
+                archiveFile.seek(entry["offset"])
+                entryReader = zstandard.ZstdDecompressor().stream_reader(archiveFile)
+                with tarfile.open(fileobj=entryReader,mode="r|") as archive:
+                    shutil.copyfileobj(archive.extractfile(archive.next()),outputFile,downloadChunkSize)
+    return outputPath
+# End of read archive entry function
+
+
+# Start of load manifest function
+def loadManifest(manifestPath):
+    global previousManifest, manifest
+    # Read the manifest from the previous backup
+    previousManifest = {"backupFolder": None, "items": {}, "attachments": {}}
+    if os.path.isfile(manifestPath):
+        with open(manifestPath) as jsonFile:
+            previousManifest = json.load(jsonFile)
+        printMessage("Loaded manifest from previous backup - " + manifestPath + "...","info")
+    # Manifest for this backup
+    manifest = {"backupFolder": None, "items": {}, "attachments": {}}
+# End of load manifest function
+
+
+# Start of save manifest function
+def saveManifest(manifestPath):
+    # Write to a temporary file then replace the manifest, so it is never left half written
+    with open(manifestPath + ".tmp", "w") as jsonFile:
+        json.dump(manifest, jsonFile, indent=1)
+    os.replace(manifestPath + ".tmp", manifestPath)
+    printMessage("Saved manifest - " + manifestPath + "...","info")
+# End of save manifest function
+
+
+# Start of get item version function
+def getItemVersion(item):
+    version = {"modified": item.modified, "size": item.size}
+    # Edits to a hosted feature service don't change the item, so also use the last edit date of each layer
+    if (isHostedFeatureService(item)):
+        lastEditDates = []
+        with metadataLimit:
+            for featureLayer in item.layers + item.tables:
+                editingInfo = featureLayer.properties.get("editingInfo") or {}
+                lastEditDates.append(editingInfo.get("lastEditDate"))
+        # Can't tell if the data has changed
+        if (None in lastEditDates):
+            return None
+        version["lastEditDates"] = lastEditDates
+    return version
+# End of get item version function
+
+
+# Start of link previous files function
+def linkPreviousFiles(files,downloadLocation,targetPaths=None,hashes=None):
+    # No previous backup
+    if (previousManifest["backupFolder"] == None):
+        return False
+    # Files are relative to the backup folder, by default keep the same path in the new backup
+    if (targetPaths == None):
+        targetPaths = [os.path.join(downloadLocation,file) for file in files]
+    if (hashes == None):
+        hashes = [None] * len(files)
+    for file, targetPath, fileHash in zip(files,targetPaths,hashes):
+        sourcePath = os.path.join(previousManifest["backupFolder"],file)
+        # Use the object store if the file is in it - The previous backup may have been deleted
+        if (objectLocation != None) and (fileHash) and (os.path.isfile(getObjectPath(fileHash))):
+            sourcePath = getObjectPath(fileHash)
+        if not os.path.isfile(sourcePath):
+            return False
+        # Same folder as the previous backup e.g. no dated folder
+        if (os.path.abspath(sourcePath) == os.path.abspath(targetPath)):
+            continue
+        if not os.path.exists(os.path.dirname(targetPath)):
+            os.makedirs(os.path.dirname(targetPath))
+        if os.path.exists(targetPath):
+            os.remove(targetPath)
+        # Hard link so the file isn't stored twice, copy if links are not supported e.g. a different drive
+        try:
+            os.link(sourcePath,targetPath)
+        except OSError:
+            shutil.copy2(sourcePath,targetPath)
+    return True
+# End of link previous files function
+
+
+# Start of store file function
+def storeFile(filePath,fileHash=None):
+    if (fileHash == None):
+        fileHash = hashFile(filePath)
+    objectPath = getObjectPath(fileHash)
+    if not os.path.exists(os.path.dirname(objectPath)):
+        os.makedirs(os.path.dirname(objectPath),exist_ok=True)
+    try:
+        # Add the file to the store if it is not already there
+        os.link(filePath,objectPath)
+    except FileExistsError:
+        # Replace the file with a link to the one already stored
+        if not os.path.samefile(filePath,objectPath):
+            os.link(objectPath,filePath + ".link")
+            os.replace(filePath + ".link",filePath)
+    # Links are not supported e.g. FAT32 or network drive, so keep the file as is
+    except OSError:
+        pass
+    return fileHash
+# End of store file function
+
+
+# Start of get object path function
+def getObjectPath(fileHash):
+    # Sub folder for the first two characters of the hash, so no folder has too many files
+    return os.path.join(objectLocation,fileHash[:2],fileHash)
+# End of get object path function
+
+
+# Start of collect garbage function
+def collectGarbage(downloadLocation):
+    # Delete dated backups past the number to keep
+    if (int(backupRetention) > 0):
+        backupFolders = sorted(folder for folder in os.listdir(downloadLocation) if folder.startswith("AGSBackup-") and os.path.isdir(os.path.join(downloadLocation,folder)))
+        for backupFolder in backupFolders[:-int(backupRetention)]:
+            printMessage("Deleting old backup - " + os.path.join(downloadLocation,backupFolder) + "...","info")
+            shutil.rmtree(os.path.join(downloadLocation,backupFolder))
+
+    # Delete stored files that are not linked to from any backup
+    objectStore = os.path.join(downloadLocation,objectFolder)
+    if not os.path.isdir(objectStore):
+        return
+    deletedCount = 0
+    deletedSize = 0
+    for folderPath, folderNames, fileNames in os.walk(objectStore):
+        for fileName in fileNames:
+            objectPath = os.path.join(folderPath,fileName)
+            objectStat = os.stat(objectPath)
+            # Only link is the one in the store
+            if (objectStat.st_nlink <= 1):
+                os.remove(objectPath)
+                deletedCount += 1
+                deletedSize += objectStat.st_size
+    printMessage("Deleted {} files no longer used from the object store ({} MB)...".format(deletedCount,round(deletedSize / 1048576.0, 2)),"info")
+# End of collect garbage function
+
+
+# Start of hash file function
+def hashFile(filePath):
+    fileHash = hashlib.sha256()
+    with open(filePath, "rb") as fileData:
+        for chunk in iter(lambda: fileData.read(1024 * 1024), b""):
+            fileHash.update(chunk)
+    return fileHash.hexdigest()
+# End of hash file function
+
+
+# Start of start executor function
+def startExecutor():
+    global executor
+    # One pool of threads shared by all the work
+    if (executor == None):
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=maxWorkers)
+# End of start executor function
+
+
+# Start of stop executor function
+def stopExecutor(cancelTasks):
+    global executor
+    if (executor != None):
+        # Cancel the tasks that have not started if there was an error (Python 3.9+)
+        if (cancelTasks == True) and (sys.version_info >= (3, 9)):
+            executor.shutdown(wait=True, cancel_futures=True)
+        else:
+            executor.shutdown(wait=True)
+        executor = None
+# End of stop executor function
+
+
+# Start of run tasks function
+def runTasks(function,argumentsList):
+    # Run in this thread if there is no worker pool
+    if (executor == None):
+        return [function(*arguments) for arguments in argumentsList]
+
+    tasks = []
+    for arguments in argumentsList:
+        # Add the task to the pool if there is room in the queue, otherwise run it in this thread so the queue can't grow without limit
+        if queuedTasks.acquire(blocking=False):
+            tasks.append([executor.submit(runTask,function,arguments),arguments])
+        else:
+            tasks.append([None,function(*arguments)])
+
+    results = []
+    for task, arguments in tasks:
+        # Ran in this thread
+        if (task == None):
+            results.append(arguments)
+        # Run the task in this thread if it has not started yet - So a task waiting for its own tasks can't use up all the threads
+        elif task.cancel():
+            queuedTasks.release()
+            results.append(function(*arguments))
+        else:
+            results.append(task.result())
+    return results
+# End of run tasks function
+
+
+# Start of run task function
+def runTask(function,arguments):
+    try:
+        return function(*arguments)
+    finally:
+        # Make room for another task in the queue
+        queuedTasks.release()
+# End of run task function
+
+
 # Start of get item folder path function
 def getFeatureFolderPath(dataID,joinValue):
-    dataIDFound = False
-    path = None
-    # For each feature location
-    for featureFolderLocation in featureFolderLocations:
-        # If there is a data ID Matching
-        if (featureFolderLocation["dataID"].lower() == dataID.lower()):  
-            dataIDFound = True
-        # If there is a feature matching
-        if (featureFolderLocation["dataID"].lower() == dataID.lower()) and (featureFolderLocation["featureID"].lower() == joinValue.lower()):
-            path = featureFolderLocation["location"]
+    # Get the feature matching from the index
+    with featureFolderLock:
+        dataIDFound = (str(dataID).lower() in featureFolderDataIDs)
+        path = featureFolderIndex.get((str(dataID).lower(),joinValue.lower()))
     # If data ID is not found
     if (dataIDFound == False):
         printMessage("Item with data ID of " + str(dataID) +  " was not found in the configuration file...","warning")
@@ -396,6 +1218,98 @@ def getFeatureFolderPath(dataID,joinValue):
 # End of get item folder path function
 
 
+# Start of sort items function
+def sortItems(itemDicts):
+    # Get the items by data ID
+    dataIDItems = {}
+    for itemDict in itemDicts:
+        if (itemDict["itemConfig"]) and (itemDict["itemConfig"].get("dataID")):
+            dataIDItems[str(itemDict["itemConfig"]["dataID"]).lower()] = itemDict
+
+    # Add each item after its parent
+    sortedItems = []
+    itemStates = {}
+    def addItem(itemDict):
+        if (itemStates.get(id(itemDict)) == "added"):
+            return
+        # Parent chain loops back to this item
+        if (itemStates.get(id(itemDict)) == "adding"):
+            printMessage("Parent data IDs loop back to data ID " + str(itemDict["itemConfig"]["dataID"]) + "...","warning")
+            return
+        itemStates[id(itemDict)] = "adding"
+        parentItem = getParentItem(itemDict,dataIDItems)
+        if (parentItem):
+            addItem(parentItem)
+        itemStates[id(itemDict)] = "added"
+        sortedItems.append(itemDict)
+    for itemDict in itemDicts:
+        addItem(itemDict)
+    return sortedItems
+# End of sort items function
+
+
+# Start of run items function
+def runItems(itemDicts,configData,downloadLocation):
+    # Run in this thread if there is no worker pool
+    if (executor == None):
+        for itemDict in itemDicts:
+            downloadItem(itemDict,configData,downloadLocation)
+        return
+
+    # Get the items by data ID
+    dataIDItems = {}
+    for itemDict in itemDicts:
+        if (itemDict["itemConfig"]) and (itemDict["itemConfig"].get("dataID")):
+            dataIDItems[str(itemDict["itemConfig"]["dataID"]).lower()] = itemDict
+
+    # Start each item straight away, or when its parent has finished - Items are sorted so parents are started first
+    itemTasks = {}
+    for itemDict in itemDicts:
+        parentItem = getParentItem(itemDict,dataIDItems)
+        if (parentItem) and (id(parentItem) in itemTasks):
+            itemTasks[id(itemDict)] = runAfterTask(itemTasks[id(parentItem)],downloadItem,(itemDict,configData,downloadLocation))
+        else:
+            itemTasks[id(itemDict)] = executor.submit(downloadItem,itemDict,configData,downloadLocation)
+
+    # Wait for all the items, raising the first error
+    for itemDict in itemDicts:
+        itemTasks[id(itemDict)].result()
+# End of run items function
+
+
+# Start of run after task function
+def runAfterTask(parentTask,function,arguments):
+    task = concurrent.futures.Future()
+    pool = executor
+    # Copy the result when the task has run
+    def finishTask(functionTask):
+        if (functionTask.exception() != None):
+            task.set_exception(functionTask.exception())
+        else:
+            task.set_result(functionTask.result())
+    # Add the task to the pool when the parent task has finished - Even if it failed, features with no parent folder use the download folder
+    def startTask(finishedTask):
+        try:
+            pool.submit(function,*arguments).add_done_callback(finishTask)
+        # Pool has been shut down
+        except RuntimeError as error:
+            task.set_exception(error)
+    parentTask.add_done_callback(startTask)
+    return task
+# End of run after task function
+
+
+# Start of get parent item function
+def getParentItem(itemDict,dataIDItems):
+    # Item for the parent data ID in the config
+    if (itemDict["itemConfig"]) and (itemDict["itemConfig"].get("parentDataID")):
+        parentItem = dataIDItems.get(str(itemDict["itemConfig"]["parentDataID"]).lower())
+        if (parentItem is not itemDict):
+            return parentItem
+    return None
+# End of get parent item function
+
+
 # Start of get ID fields function
 def getIDFields(featureLayer,configItem):
     # Get the field names
@@ -546,9 +1460,6 @@ if __name__ == '__main__':
         logger.info("Process started.")
     # Setup the use of a proxy for requests
     if (enableProxy == "true"):
-        # Setup the proxy
-        proxy = urllib2.ProxyHandler({requestProtocol : proxyURL})
-        openURL = urllib2.build_opener(proxy)
-        # Install the proxy
-        urllib2.install_opener(openURL)
+        # Setup the proxy on the shared session
+        RESTClient.setProxy(requestProtocol, proxyURL)
     mainFunction(*argv)
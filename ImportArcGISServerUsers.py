@@ -15,9 +15,9 @@ import os
 import sys
 import logging
 import smtplib
-import httplib
 import json
 import urllib
+import RESTClient
 import urlparse
 import arcpy
 
@@ -105,9 +105,9 @@ def mainFunction(agsServerSite,username,password,usersCSV): # Get parameters fro
                 count +=1
 
             # Call functions to add users and roles
-            addRoles(roles,token,serverName,serverPort)
-            addUsers(users,token,serverName,serverPort)
-            addUserToRoles(addUserRole,token,serverName,serverPort)
+            addRoles(roles,token,serverName,serverPort,protocol)
+            addUsers(users,token,serverName,serverPort,protocol)
+            addUserToRoles(addUserRole,token,serverName,serverPort,protocol)
             
         # --------------------------------------- End of code --------------------------------------- #  
             
@@ -168,7 +168,7 @@ def mainFunction(agsServerSite,username,password,usersCSV): # Get parameters fro
 
 
 # Start of Add roles to ArcGIS Server function
-def addRoles(roleDict, token, serverName, serverPort):  
+def addRoles(roleDict, token, serverName, serverPort, protocol):  
     for item in roleDict.keys():
         # Build the dictionary with the role name and description
         roleToAdd = {"rolename":item}
@@ -179,20 +179,13 @@ def addRoles(roleDict, token, serverName, serverPort):
         # URL for adding a role
         addroleURL = "/arcgis/admin/security/roles/add"
         params = urllib.urlencode({'token':token,'f':'json','Role':jsRole})
-        headers = {"Content-type": "application/x-www-form-urlencoded", "Accept": "text/plain"}
 
-        # Build the connection to add the roles to the server
-        httpRoleConn = httplib.HTTPConnection(serverName, serverPort)
-        httpRoleConn.request("POST",addroleURL,params,headers)
-
-        response = httpRoleConn.getresponse()
-        if (response.status != 200):
-            httpRoleConn.close()
+        # Post to the server to add the role
+        response, data = postToServer(serverName, serverPort, protocol, addroleURL, params)
+        if (response.status_code != 200):
             arcpy.AddError("Could not add role...")
             return
         else:
-            data = response.read()
-            
             # Check that data returned is not an error object
             if not assertJsonSuccess(data):          
                 arcpy.AddError("Error when adding role. " + str(data))
@@ -200,84 +193,59 @@ def addRoles(roleDict, token, serverName, serverPort):
             else:
                 arcpy.AddMessage("Added role successfully...")
 
-        httpRoleConn.close()
-
         # Assign a privilege to the recently added role 
         assignAdminUrl = "/arcgis/admin/security/roles/assignPrivilege"
         params = urllib.urlencode({'token':token,'f':'json',"rolename":item, "privilege":roleDict[item].keys()[0]})
-            
-        headers = {"Content-type": "application/x-www-form-urlencoded", "Accept": "text/plain"}
 
-        # Build the connection to assign the privilege
-        httpRoleAdminConn = httplib.HTTPConnection(serverName, serverPort)
-        httpRoleAdminConn.request("POST",assignAdminUrl,params,headers)
-
-        response = httpRoleAdminConn.getresponse()
-        if (response.status != 200):
-            httpRoleAdminConn.close()
+        # Post to the server to assign the privilege
+        response, data = postToServer(serverName, serverPort, protocol, assignAdminUrl, params)
+        if (response.status_code != 200):
             arcpy.AddError("Could not assign privilege to role.")
             return
         else:
-            data = response.read()
-            
             # Check that data returned is not an error object
             if not assertJsonSuccess(data):          
                 arcpy.AddError("Error when assigning privileges to role. " + str(data))
                 return
             else:
                 arcpy.AddMessage("Assigned privileges to role successfully...")
-
-        httpRoleAdminConn.close()
 # End of Add roles to ArcGIS Server function
 
 
 # Start of Add users to ArcGIS Server function
-def addUsers(userDict,token, serverName, serverPort):
+def addUsers(userDict,token, serverName, serverPort, protocol):
     for userAdd in userDict:
         jsUser = json.dumps(userDict[userAdd])
         
         # URL for adding a user
         addUserURL = "/arcgis/admin/security/users/add"
         params = urllib.urlencode({'token':token,'f':'json','user':jsUser})
-        headers = {"Content-type": "application/x-www-form-urlencoded", "Accept": "text/plain"}
-
-        # Build the connection to add the users
-        httpRoleConn = httplib.HTTPConnection(serverName, serverPort)
-        httpRoleConn.request("POST",addUserURL,params,headers)
 
-        httpRoleConn.close()
+        # Post to the server to add the user
+        postToServer(serverName, serverPort, protocol, addUserURL, params)
 # End of Add roles to ArcGIS Server function
 
 
 # Start of Add user to roles function
-def addUserToRoles(userRoleDict,token, serverName, serverPort):
+def addUserToRoles(userRoleDict,token, serverName, serverPort, protocol):
     for userRole in userRoleDict.keys():
 
         # Using the current role build the URL to assign the right users to the role
         addUserURL = "/arcgis/admin/security/roles/addUsersToRole"
         params = urllib.urlencode({'token':token,'f':'json',"rolename":userRole,"users":userRoleDict[userRole]})
-        headers = {"Content-type": "application/x-www-form-urlencoded", "Accept": "text/plain"}
-    
-        # Build the connection
-        httpRoleConn = httplib.HTTPConnection(serverName, serverPort)
-        httpRoleConn.request("POST",addUserURL,params,headers)
 
-        response = httpRoleConn.getresponse()
-        if (response.status != 200):
-            httpRoleConn.close()
+        # Post to the server to add the users to the role
+        response, data = postToServer(serverName, serverPort, protocol, addUserURL, params)
+        if (response.status_code != 200):
             arcpy.AddError("Could not add user to role...")
             return
         else:
-            data = response.read()
-            
             # Check that data returned is not an error object
             if not assertJsonSuccess(data):          
                 arcpy.AddError("Error when adding user to role. " + str(data))
                 return
             else:
                 arcpy.AddMessage("Added user to role successfully...")
-                    
-        httpRoleConn.close()
 # End of Add user to roles function
 
         
@@ -298,7 +266,7 @@ def getToken(username, password, serverName, serverPort, protocol):
             sys.exit()
         return -1    
     # If there is an error getting the token
-    if (response.status != 200):
+    if (response.status_code != 200):
         arcpy.AddError("Error while generating the token.")
         arcpy.AddError(str(data))
         # Log error
@@ -340,25 +308,15 @@ def postToServer(serverName, serverPort, protocol, url, params):
     # If on secure port
     if (serverPort == -1 and protocol == 'https'):
         serverPort = 443
-        
-    if (protocol == 'http'):
-        httpConn = httplib.HTTPConnection(serverName, int(serverPort))
 
-    if (protocol == 'https'):
-        httpConn = httplib.HTTPSConnection(serverName, int(serverPort))
-        
     headers = {"Content-type": "application/x-www-form-urlencoded", "Accept": "text/plain",'referer':'backuputility','referrer':'backuputility'}
-     
+
     # URL encode the resource URL
     url = urllib.quote(url.encode('utf-8'))
 
-    # Build the connection to add the roles to the server
-    httpConn.request("POST", url, params, headers) 
-
-    response = httpConn.getresponse()
-    data = response.read()
-
-    httpConn.close()
+    # Post the request on the shared session - Connection is kept alive for the next request
+    response = RESTClient.sendRequest(protocol + "://" + serverName + ":" + str(serverPort) + url, params, "POST", headers)
+    data = response.content
 
     # Return response
     return (response, data)
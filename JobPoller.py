@@ -0,0 +1,104 @@
+#-------------------------------------------------------------
+# Name:       Job Poller
+# Purpose:    Shared polling of ArcGIS Server geoprocessing jobs used by the toolkit scripts. Jobs are checked
+#             with an exponential backoff and jitter between checks, stopped at a deadline and cancelled
+#             through the cancel endpoint, and the time spent queued and executing is reported separately.
+# Author:     Shaun Weston (shaun_weston@eagle.co.nz)
+# Date Created:    18/10/2026
+# Last Updated:    18/10/2026
+# Copyright:   (c) Eagle Technology
+# ArcGIS Version:   ArcMap (ArcPy) 10.1+ or ArcGIS API for Python 1.4.2+
+# Python Version:   2.7 or 3.6.5+ (Requests 2.10+ - See Packages folder)
+#--------------------------------
+
+# Import main modules
+import time
+import random
+import TokenManager
+
+# Set global variables
+# Backoff
+initialWait = 1 # Seconds to wait before the first check
+maxWait = 30 # Maximum seconds to wait between checks
+backoffFactor = 2 # Multiply the wait by this after each check
+jitter = 0.25 # Randomly vary each wait by up to this fraction so jobs are not checked in step
+# Deadline
+timeLimit = 3600 # Seconds to wait for a job to finish before it is cancelled
+# Job status
+queuedStatuses = ["esrijobnew","esrijobsubmitted","esrijobwaiting"]
+executingStatuses = ["esrijobexecuting","esrijobcancelling"]
+
+
+# Start of poll job function
+def pollJob(checkJob,cancelJob=None,deadline=None):
+    # Use the default time limit if no deadline provided
+    startTime = time.time()
+    if (deadline == None):
+        deadline = startTime + timeLimit
+
+    queueTime = 0
+    executionTime = 0
+    polls = 0
+    timedOut = False
+    wait = initialWait
+    lastCheck = startTime
+    jobStatus = None
+    # Check the job
+    result = checkJob()
+    polls += 1
+    while True:
+        checkTime = time.time()
+        # Add the time since the last check to the status the job was in
+        if (str(jobStatus).lower() in queuedStatuses):
+            queueTime += checkTime - lastCheck
+        if (str(jobStatus).lower() in executingStatuses):
+            executionTime += checkTime - lastCheck
+        lastCheck = checkTime
+
+        # Stop if there is an error or the job has finished
+        jobStatus = getJobStatus(result)
+        if (str(jobStatus).lower() not in (queuedStatuses + executingStatuses)):
+            break
+
+        # Cancel the job if past the deadline
+        if (checkTime >= deadline):
+            timedOut = True
+            if (cancelJob):
+                result = cancelJob()
+                jobStatus = getJobStatus(result)
+            break
+
+        # Wait before checking again, but not past the deadline
+        time.sleep(max(0, min(wait * random.uniform(1 - jitter, 1 + jitter), deadline - checkTime)))
+        wait = min(wait * backoffFactor, maxWait)
+        result = checkJob()
+        polls += 1
+
+    # Return the result of the last check with the timings
+    return {"jobStatus": jobStatus,
+            "result": result,
+            "queueTime": round(queueTime, 2),
+            "executionTime": round(executionTime, 2),
+            "totalTime": round(time.time() - startTime, 2),
+            "polls": polls,
+            "timedOut": timedOut}
+# End of poll job function
+
+
+# Start of get job status function
+def getJobStatus(result):
+    # Error or no response
+    if not isinstance(result, dict):
+        return None
+    return result.get("jobStatus")
+# End of get job status function
+
+
+# Start of cancel job function
+def cancelJob(jobURL,token,timeout=None):
+    # Setup the parameters
+    parameters = {'token': token,
+                  'f': 'json'}
+    # Post request
+    return TokenManager.requestJSON(jobURL + "/cancel",parameters,"POST",None,timeout)
+# End of cancel job function
@@ -0,0 +1,169 @@
+#-------------------------------------------------------------
+# Name:       Latency Sketch
+# Purpose:    Compact latency histograms used by the toolkit scripts to report percentiles. Values are counted
+#             in log scaled buckets held in a fixed size array, so memory stays the same however many values
+#             are added, and sketches can be merged e.g. across time shards or saved runs. A sketch is only
+#             created when the first value is added (None until then).
+# Author:     Shaun Weston (shaun_weston@eagle.co.nz)
+# Date Created:    18/10/2026
+# Last Updated:    18/10/2026
+# Copyright:   (c) Eagle Technology
+# ArcGIS Version:   ArcMap (ArcPy) 10.1+ or ArcGIS API for Python 1.4.2+
+# Python Version:   2.7 or 3.6.5+ (NumPy)
+#--------------------------------
+
+# Import main modules
+import math
+import array
+import zlib
+import numpy
+
+# Set global variables
+# Buckets
+minValue = 0.0001 # Smallest value in seconds, anything smaller is counted in the first bucket
+maxValue = 3600 # Largest value in seconds, anything larger is counted in the last bucket
+precision = 0.05 # Relative width of each bucket e.g. percentiles are within 5%
+bucketCount = int(math.ceil(math.log(float(maxValue) / minValue) / math.log(1 + precision))) + 1
+# Percentiles reported
+percentiles = [50, 90, 95, 99]
+
+
+# Start of new sketch function
+def newSketch():
+    # First value is the largest value added, then the count in each bucket
+    return array.array("d", [0]) * (bucketCount + 1)
+# End of new sketch function
+
+
+# Start of add value function
+def addValue(sketch,value):
+    # Create the sketch when the first value is added
+    if (sketch == None):
+        sketch = newSketch()
+    value = float(value)
+    # Keep the largest value
+    if (value > sketch[0]):
+        sketch[0] = value
+    # Add one to the bucket for the value
+    sketch[getBucket(value) + 1] += 1
+    return sketch
+# End of add value function
+
+
+# Start of merge sketch function
+def mergeSketch(sketch,otherSketch):
+    # Nothing to merge
+    if (otherSketch == None):
+        return sketch
+    if (sketch == None):
+        return array.array("d", otherSketch)
+    # Keep the largest value
+    if (otherSketch[0] > sketch[0]):
+        sketch[0] = otherSketch[0]
+    # Add the counts in each bucket
+    for index in range(1, len(otherSketch)):
+        if (otherSketch[index]):
+            sketch[index] += otherSketch[index]
+    return sketch
+# End of merge sketch function
+
+
+# Start of add counts function
+def addCounts(sketch,bucketCounts,largestValue):
+    # Create the sketch when the first values are added
+    if (sketch == None):
+        sketch = newSketch()
+    # Keep the largest value
+    if (largestValue > sketch[0]):
+        sketch[0] = float(largestValue)
+    # Add the counts for each bucket e.g. from get buckets
+    for bucket in numpy.nonzero(bucketCounts)[0]:
+        sketch[int(bucket) + 1] += float(bucketCounts[bucket])
+    return sketch
+# End of add counts function
+
+
+# Start of get count function
+def getCount(sketch):
+    if (sketch == None):
+        return 0
+    return int(sum(sketch[1:]))
+# End of get count function
+
+
+# Start of get max function
+def getMax(sketch):
+    if (sketch == None):
+        return 0
+    return sketch[0]
+# End of get max function
+
+
+# Start of get percentile function
+def getPercentile(sketch,percentile):
+    count = getCount(sketch)
+    # No values added
+    if (count == 0):
+        return 0
+    # Find the bucket the percentile is in
+    rank = math.ceil(count * (float(percentile) / 100))
+    total = 0
+    for index in range(1, len(sketch)):
+        total += sketch[index]
+        if (total >= rank):
+            # Use the middle of the bucket, but no more than the largest value
+            return round(min(getBucketValue(index - 1), sketch[0]), 4)
+    return round(sketch[0], 4)
+# End of get percentile function
+
+
+# Start of get bucket function
+def getBucket(value):
+    if (value <= minValue):
+        return 0
+    return min(int(math.log(value / minValue) / math.log(1 + precision)) + 1, bucketCount - 1)
+# End of get bucket function
+
+
+# Start of get buckets function
+def getBuckets(values):
+    # Bucket for each value in a NumPy array
+    buckets = (numpy.log(numpy.maximum(values, minValue) / minValue) / math.log(1 + precision)).astype(numpy.int64) + 1
+    buckets[values <= minValue] = 0
+    return numpy.minimum(buckets, bucketCount - 1)
+# End of get buckets function
+
+
+# Start of get bucket value function
+def getBucketValue(bucket):
+    if (bucket == 0):
+        return minValue
+    # Middle of the bucket
+    return minValue * math.pow(1 + precision, bucket - 0.5)
+# End of get bucket value function
+
+
+# Start of sketch to bytes function
+def sketchToBytes(sketch):
+    # No values added
+    if (sketch == None):
+        return None
+    # Compress the array - Most buckets are empty
+    if hasattr(sketch, "tobytes"):
+        return zlib.compress(sketch.tobytes())
+    return zlib.compress(sketch.tostring())
+# End of sketch to bytes function
+
+
+# Start of sketch from bytes function
+def sketchFromBytes(data):
+    # No sketch saved
+    if not data:
+        return None
+    sketch = array.array("d")
+    if hasattr(sketch, "frombytes"):
+        sketch.frombytes(zlib.decompress(bytes(data)))
+    else:
+        sketch.fromstring(zlib.decompress(str(data)))
+    return sketch
+# End of sketch from bytes function
@@ -17,11 +17,11 @@ import os
 import sys
 import logging
 import smtplib
-import httplib
 import arcpy
 import string
 import urllib
-import urllib2
+import RESTClient
+import TokenManager
 import datetime
 import json
 import math
@@ -190,7 +190,7 @@ def mainFunction(agsServerSite,username,password,service,csvFile): # Get paramet
 
 # Start of get service info function
 def getServiceInfo(serverName, serverPort, protocol, service, token):
-    params = urllib.urlencode({'token': token, 'f': 'json'})
+    params = {'token': token, 'f': 'json'}
 
     # Construct URL to get the service status
     url = "/arcgis/admin/services/" + service
@@ -206,7 +206,7 @@ def getServiceInfo(serverName, serverPort, protocol, service, token):
         return -1
 
     # If there is an error
-    if (response.status != 200):
+    if (response.status_code != 200):
         arcpy.AddError("Error getting service status.")
         # Logging
         if (enableLogging == "true"):    
@@ -228,7 +228,7 @@ def getServiceInfo(serverName, serverPort, protocol, service, token):
 
 # Start of get service stats function
 def getServiceStats(serverName, serverPort, protocol, service, token):
-    params = urllib.urlencode({'token': token, 'f': 'json'})
+    params = {'token': token, 'f': 'json'}
 
     # Construct URL to get the service status
     url = "/arcgis/admin/services/" + service + "/statistics"
@@ -244,7 +244,7 @@ def getServiceStats(serverName, serverPort, protocol, service, token):
         return -1
 
     # If there is an error
-    if (response.status != 200):
+    if (response.status_code != 200):
         arcpy.AddError("Error getting service status.")
         # Logging
         if (enableLogging == "true"):    
@@ -271,11 +271,10 @@ def getToken(username, password, serverName, serverPort):
                   'expiration': "60",
                   'client':     'requestip'}
     
-    query_string = urllib.urlencode(query_dict)
     url = "http://{}:{}/arcgis/admin/generateToken?f=json".format(serverName, serverPort)
    
     try:
-        token = json.loads(urllib2.urlopen(url, query_string).read())
+        token = TokenManager.requestToken(url, query_dict)
         if "token" not in token or token == None:
             arcpy.AddError("Failed to get token, return message from server:")
             arcpy.AddError(token['messages'])            
@@ -288,7 +287,7 @@ def getToken(username, password, serverName, serverPort):
             # Return the token to the function which called for it
             return token['token']
     
-    except urllib2.URLError, error:
+    except RESTClient.RequestError, error:
         arcpy.AddError("Could not connect to machine {} on port {}".format(serverName, serverPort))
         arcpy.AddError(error)
         # Logging
@@ -308,24 +307,14 @@ def postToServer(serverName, serverPort, protocol, url, params):
     # If on secure port
     if (serverPort == -1 and protocol == 'https'):
         serverPort = 443
-        
-    if (protocol == 'http'):
-        httpConn = httplib.HTTPConnection(serverName, int(serverPort))
 
-    if (protocol == 'https'):
-        httpConn = httplib.HTTPSConnection(serverName, int(serverPort))
-      
     headers = {"Content-type": "application/x-www-form-urlencoded", "Accept": "text/plain",'referer':'backuputility','referrer':'backuputility'}     
     # URL encode the resource URL
     url = urllib.quote(url.encode('utf-8'))
 
-    # Build the connection to add the roles to the server
-    httpConn.request("POST", url, params, headers) 
-
-    response = httpConn.getresponse()
-    data = response.read()
-
-    httpConn.close()
+    # Post the request on the shared session - Connection is kept alive for the next request and an expired token is renewed
+    response = TokenManager.sendRequest(protocol + "://" + serverName + ":" + str(serverPort) + url, params, "POST", headers)
+    data = response.content
     # Return response
     return (response, data)
 # End of HTTP POST request to the server function
@@ -448,10 +437,7 @@ if __name__ == '__main__':
         logger.info("Process started.")
     # Setup the use of a proxy for requests
     if (enableProxy == "true"):
-        # Setup the proxy
-        proxy = urllib2.ProxyHandler({requestProtocol : proxyURL})
-        openURL = urllib2.build_opener(proxy)
-        # Install the proxy
-        urllib2.install_opener(openURL)
+        # Setup the proxy on the shared session
+        RESTClient.setProxy(requestProtocol, proxyURL)
     mainFunction(*argv)
     
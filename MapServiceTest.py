@@ -1,9 +1,12 @@
 #-------------------------------------------------------------
 # Name:       Map Service Test
-# Purpose:    Runs a configurable query against a map service and produces a report on draw times at specified scales.
+# Purpose:    Runs a configurable query against a map service and produces a report on draw times at specified scales,
+#             broken down into DNS, connect, TLS, wait (Server time to first byte) and transfer time. Can also
+#             run a load test, requesting from many threads at a target rate and reporting throughput, error rate
+#             and latency percentiles for each scale.
 # Author:     Shaun Weston (shaun_weston@eagle.co.nz)
 # Date Created:    05/08/2015
-# Last Updated:    11/08/2015
+# Last Updated:    18/10/2026
 # Copyright:   (c) Eagle Technology
 # ArcGIS Version:   10.3+
 # Python Version:   2.7
@@ -16,12 +19,21 @@ import logging
 import smtplib
 import arcpy
 import string
-import urllib
-import urllib2
+import RESTClient
+import TokenManager
 import time
 import json
-import math
-from urlparse import urlparse
+import re
+import calendar
+import datetime
+import urllib
+import hashlib
+import numpy
+import threading
+import multiprocessing.pool
+import LatencySketch
+import ResultsStore
+from urlparse import urlparse, parse_qsl
 
 # Enable data to be overwritten
 arcpy.env.overwriteOutput = True
@@ -35,6 +47,26 @@ emailUser = ""
 emailPassword = ""
 emailSubject = ""
 emailMessage = ""
+# Results
+useResultsDatabase = "true" # Keep the timings of every run (See ResultsStore) and compare them to the previous runs to find slowdowns
+failOnRegression = "false" # Exit with an error code if significantly slower than the previous runs
+# Responses
+responseSink = "discard" # What to do with each image downloaded - "discard" (count the bytes only), "hash" (also keep a hash to find repeated images e.g. blank tiles), "sample" (write 1 in every responseSampleEvery to the scratch folder) or "file" (write all to the scratch folder)
+responseSampleEvery = 100 # Write 1 in this many images at each scale to the scratch folder when sampling
+# Sampling
+sampleExtents = "false" # Request random viewports across the bounding box at each scale instead of the centre, so the cache is not warm
+sampleCount = 10 # Number of random viewports at each scale for each query
+sampleSeed = 1 # Random seed so the same viewports are requested each run
+sampleWeightFile = "" # Optional density raster or point feature class to weight where the viewports are drawn e.g. r"C:\Data\Density.tif"
+# Replay
+replayLog = "" # Replay the requests in a log instead of generating them - ArcGIS Server logs saved as JSON from /admin/logs/query, or a web adaptor (IIS) access log e.g. r"C:\inetpub\logs\LogFiles\W3SVC1\u_ex181018.log"
+replaySpeed = 1 # Replay at this multiple of the recorded speed e.g. 1, 2 or 5
+# Load test
+loadTest = "false" # Send requests from many threads for a set time instead of timing each scale in turn
+loadTestThreads = 20 # Number of requests sent at the same time (Also used when replaying)
+loadTestRate = 0 # Target requests per second across all threads, 0 to send as fast as possible
+loadTestRampUp = 30 # Seconds to start all the threads and build up to the target rate
+loadTestDuration = 120 # Seconds to run the load test for
 enableProxy = "false"
 requestProtocol = "http" # http or https
 proxyURL = ""
@@ -48,10 +80,32 @@ def mainFunction(mapService,username,password,boundingBox,scales,imageFormat,num
         dpi = 96
         ImageWidth = 1280
         ImageHeight = 768
+        # Settings that change what is requested - Runs are only compared to previous runs with the same settings
+        workload = {"boundingBox": boundingBox,
+                    "scales": scales,
+                    "imageFormat": imageFormat,
+                    "numberQueries": numberQueries,
+                    "imageSize": [ImageWidth, ImageHeight, dpi],
+                    "sampleExtents": sampleExtents,
+                    "sampleCount": sampleCount,
+                    "sampleSeed": sampleSeed,
+                    "sampleWeightFile": sampleWeightFile,
+                    "replayLog": replayLog,
+                    "replaySpeed": replaySpeed,
+                    "loadTest": loadTest,
+                    "loadTestThreads": loadTestThreads,
+                    "loadTestRate": loadTestRate,
+                    "loadTestRampUp": loadTestRampUp,
+                    "loadTestDuration": loadTestDuration}
         
         # GlobalVariables
         cachedMapService = False
         scaleData = []
+        # Images downloaded and request timings at each scale
+        responseSinks = {}
+        scaleTimings = {}
+        # Draw time at each scale for each query
+        runTimings = []
 
         # Seperate out XY coordinates
         boundingBox = boundingBox.split(" ")
@@ -88,24 +142,31 @@ def mainFunction(mapService,username,password,boundingBox,scales,imageFormat,num
             query = mapService + "?f=json";
 
         # Make the query to the map service
-        response, downloadTime = urlQuery(query)
+        response, downloadTime, timing = urlQuery(query)
         dataObject = json.loads(response)
+
+        # Setup the random viewports if sampling
+        sampler = newSampler(boundingBox)
+        # If replaying a log
+        if (replayLog):
+            arcpy.AddMessage("Replaying requests from " + replayLog + " at " + str(replaySpeed) + "x speed with " + str(loadTestThreads) + " threads...")
+            loadResults = runReplay(getReplayRequests(replayLog, mapService, imageFormat, token))
+        # If running a load test
+        elif (loadTest == "true"):
+            arcpy.AddMessage("Load testing map service with " + str(loadTestThreads) + " threads for " + str(loadTestDuration) + " seconds...")
+            loadResults = runLoadTest(getLoadTestRequests(mapService, dataObject, boundingBox, sampler, scales, imageFormat, token, dpi, ImageWidth, ImageHeight))
         # If the map service is cached
-        if "tileInfo" in dataObject:
+        elif "tileInfo" in dataObject:
             arcpy.AddMessage("Map Service is cached...")
             cachedMapService = True
         
-            # Get the tile info
+            # Get the tiles to request at each level for each query - New viewports each query when sampling
             tileInfo = dataObject['tileInfo']
-            tileHeight = tileInfo['rows']
-            tileWidth = tileInfo['cols']
-            tileOriginX = tileInfo['origin']['x']
-            tileOriginY = tileInfo['origin']['y']
-            dpi = tileInfo['dpi']
-
-            # Get the centre point of the bounding box
-            searchPointX = float(boundingBox[0]) + ((float(boundingBox[2]) - float(boundingBox[0])) / 2);
-            searchPointY = float(boundingBox[1]) + ((float(boundingBox[3]) - float(boundingBox[1])) / 2);
+            tilePlans = []
+            for query in range(int(numberQueries)):
+                if (sampler) or (query == 0):
+                    tilePlan = getTilePlan(tileInfo, getViewports(sampler, boundingBox, [level['scale'] for level in tileInfo['lods']], ImageWidth, ImageHeight, tileInfo['dpi']), ImageWidth, ImageHeight, tileInfo['dpi'])
+                tilePlans.append(tilePlan)
 
             count = 0
             # Make the number of queries as specified
@@ -113,81 +174,36 @@ def mainFunction(mapService,username,password,boundingBox,scales,imageFormat,num
                 arcpy.AddMessage("Map service query " + str(count + 1))
                 
                 # Iterate through the levels
-                for level in tileInfo['lods']:
-                    thisLevel = level['level']
-                    thisScale = level['scale']
-                    thisResolution = level['resolution']
+                for levelPlan in tilePlans[count]:
+                    thisLevel = levelPlan['level']
+                    thisScale = levelPlan['scale']
                     
-                    # Dividing image width by DPI to get it in inches
-                    imgWidthInInch = ImageWidth / dpi;
-                    imgHeightInInch = ImageHeight / dpi;
-
-                    # Converting inch to metre (assume the map is in metre)
-                    imgWidthInMapUnit = imgWidthInInch * 0.0254;
-                    imgHeightInMapUnit = imgHeightInInch * 0.0254;
-
-                    # Calculating half of maps height & width at the specific scale
-                    halfX = (imgWidthInMapUnit * thisScale) / 2;
-                    halfY = (imgHeightInMapUnit * thisScale) / 2;
-
-                    # Setup the extent
-                    XMin = searchPointX - halfX
-                    XMax = searchPointX + halfX
-                    YMin = searchPointY - halfY
-                    YMax = searchPointY + halfY
-
-                    # Get the tile info - Top left
-                    topLeftPointX = XMin
-                    topLeftPointY = YMax
-                    # Get the tile info - Bottom right
-                    bottomRightPointX = XMax
-                    bottomRightPointY = YMin
-                    
-                    # Find the tile row and column - Top left
-                    topLeftTileColumn = int(math.floor((float(topLeftPointX) - float(tileOriginX)) / (float(thisResolution) * float(tileWidth))))                    
-                    topLeftTileRow = int(math.floor((float(tileOriginY) - float(topLeftPointY)) / (float(thisResolution) * float(tileHeight))))        
-                    # Find the tile row and column - Bottom right
-                    bottomRightTileColumn = int(math.floor((float(bottomRightPointX) - float(tileOriginX)) / (float(thisResolution) * float(tileWidth))))                    
-                    bottomRightTileRow = int(math.floor((float(tileOriginY) - float(bottomRightPointY)) / (float(thisResolution) * float(tileHeight))))       
-
-                    # Return all the tiles in between
+                    # Get the tiles covering the image at this level
                     tileCount = 0
                     tileMissingCount = 0
                     totalDownloadTime = 0
-                    column = topLeftTileColumn
-                    while (column < bottomRightTileColumn):
-                        row = topLeftTileRow
-                        while (row < bottomRightTileRow):
-                            query = mapService + "/tile/" + str(thisLevel) + "/" + str(row) + "/" + str(column);
-                            # If token received
-                            if (token):
-                                # Add token to query
-                                query = query + "?token=" + token
-                        
-                            # Make the query to the map service
-                            response, downloadTime = urlQuery(query)
-
-                            # If tile returned
-                            if (response.lower() != "missing"):
-                                # Update total download time
-                                totalDownloadTime = totalDownloadTime + downloadTime
-
-                                # Set the file path
-                                file = os.path.join(arcpy.env.scratchFolder, "MapService_" + str(thisScale) + "_" + str(row) + "_" + str(column) + "." + str(imageFormat))
-
-                                # Open the file for writing
-                                responseImage = open(file, "wb")
-
-                                # Read from request while writing to file
-                                responseImage.write(response)
-                                responseImage.close()
+                    for row, column in levelPlan['tiles']:
+                        query = getTileQuery(mapService, thisLevel, row, column, token)
+
+                        # Make the query to the map service
+                        response, downloadTime, timing = urlQuery(query)
+                        RESTClient.addTiming(scaleTimings.setdefault(str(thisScale), RESTClient.newTiming()), timing)
+
+                        # If tile returned
+                        if (response.lower() != "missing"):
+                            # Update total download time
+                            totalDownloadTime = totalDownloadTime + downloadTime
+
+                            # Set the file path
+                            file = os.path.join(arcpy.env.scratchFolder, "MapService_" + str(thisScale) + "_" + str(row) + "_" + str(column) + "." + str(imageFormat))
+
+                            # Count, hash or write out the image
+                            sinkResponse(responseSinks.setdefault(str(thisScale), newResponseSink()), response, file)
                     
-                                tileCount = tileCount + 1
-                            # Missing tiles
-                            else:
-                                tileMissingCount = tileMissingCount + 1
-                            row = row + 1
-                        column = column + 1
+                            tileCount = tileCount + 1
+                        # Missing tiles
+                        else:
+                            tileMissingCount = tileMissingCount + 1
 
                     arcpy.AddMessage("Tiles found - " + str(tileCount) + "...")
                     arcpy.AddMessage("Tiles missing - " + str(tileMissingCount) + "...")
@@ -198,12 +214,13 @@ def mainFunction(mapService,username,password,boundingBox,scales,imageFormat,num
                         # If scale is already in array
                         if (str(thisScale) == str(eachScaleData[0])):
                             # Add results to existing array value
-                            eachScaleData[2] = float(eachScaleData[2]) + float(totalDownloadTime)
+                            eachScaleData[3] = float(eachScaleData[3]) + float(totalDownloadTime)
                             
                     # If on the first query
                     if (count == 0):
                         # Add results to array
                         scaleData.append([str(thisScale), str(tileCount), str(tileMissingCount), str(totalDownloadTime)])
+                    runTimings.append([str(thisScale), totalDownloadTime])
 
                 count = count + 1
         # Dynamic map service
@@ -219,23 +236,26 @@ def mainFunction(mapService,username,password,boundingBox,scales,imageFormat,num
             # Make the number of queries as specified
             while (count < int(numberQueries)):
                 arcpy.AddMessage("Map service query " + str(count + 1))
+                # Get the extents to draw at each scale - New viewports each query when sampling
+                viewports = getViewports(sampler, boundingBox, scales, ImageWidth, ImageHeight, dpi)
                                     
                 # For each scale specified
-                for scale in scales:
-                    # Setup the query
-                    query = mapService + "/export?f=image&dpi=" + str(dpi);
-                    query = query + "&format=" + str(imageFormat)            
-                    query = query + "&size=" + str(ImageWidth) + "," + str(ImageHeight)
-                    query = query + "&mapScale=" + str(scale)
-                    query = query + "&bbox=" + str(boundingBox[0]) + "," + str(boundingBox[1]) + "," + str(boundingBox[2]) + "," + str(boundingBox[3])
-
-                    # If token received
-                    if (token):
-                        # Add token to query
-                        query = query + "&token=" + token
+                for scale, scaleViewports in zip(scales, viewports):
+                    downloadTime = 0
+                    for viewport, viewportBox in enumerate(scaleViewports):
+                        # Setup the query
+                        query = getExportQuery(mapService, dpi, imageFormat, ImageWidth, ImageHeight, scale, viewportBox, token)
             
-                    # Make the query to the map service
-                    response, downloadTime = urlQuery(query)                 
+                        # Make the query to the map service
+                        response, viewportTime, timing = urlQuery(query)
+                        downloadTime = downloadTime + viewportTime
+                        RESTClient.addTiming(scaleTimings.setdefault(str(scale), RESTClient.newTiming()), timing)
+
+                        # Set the file path
+                        file = os.path.join(arcpy.env.scratchFolder, "MapService_" + str(scale) + getViewportSuffix(viewport) + "." + str(imageFormat))
+                    
+                        # Count, hash or write out the image
+                        sinkResponse(responseSinks.setdefault(str(scale), newResponseSink()), response, file)
 
                     arcpy.AddMessage("1:" + str(scale) + " draw time - " + str(downloadTime) + "...")
 
@@ -250,43 +270,57 @@ def mainFunction(mapService,username,password,boundingBox,scales,imageFormat,num
                     if (count == 0):
                         # Add results to array
                         scaleData.append([str(scale), str(downloadTime)])
-                                     
-                    # Set the file path
-                    file = os.path.join(arcpy.env.scratchFolder, "MapService_" + str(scale) + "." + str(imageFormat))
-                    
-                    # Open the file for writing
-                    responseImage = open(file, "wb")
-
-                    # Read from request while writing to file
-                    responseImage.write(response)
-                    responseImage.close()
+                    runTimings.append([str(scale), downloadTime])
                     
                 count = count + 1
 
-        arcpy.AddMessage("Downloaded images location - " + arcpy.env.scratchFolder)
-                    
         # Open text file and write header line and data     
         summaryFile = open(csvFile, "w")         
-                        
-        if (cachedMapService == True):               
-            header = "Scale,Number of Tiles Found,Number of Tiles Missing,Draw Time (Seconds)\n"
+
+        # If load test or replay
+        if (replayLog) or (loadTest == "true"):
+            header = "Scale,Requests,Errors,Missing Tiles,Error Rate (%),Throughput (Requests/Second),P50 (Seconds),P95 (Seconds),P99 (Seconds),Max (Seconds),Mean DNS (Seconds),Mean Connect (Seconds),Mean TLS (Seconds),Mean Wait (Seconds),Mean Transfer (Seconds)\n"
+            # Results are for each service operation when replaying
+            if (replayLog):
+                header = header.replace("Scale,", "Service Operation,", 1)
+            summaryFile.write(header)
+            for scale in loadResults["scales"]:
+                summaryFile.write(getLoadTestLine(scale, loadResults["results"][scale], loadResults["duration"]))
+            summaryFile.write(getLoadTestLine("All", loadResults["total"], loadResults["duration"]))
+        elif (cachedMapService == True):               
+            header = "Scale,Number of Tiles Found,Number of Tiles Missing,Draw Time (Seconds),DNS (Seconds),Connect (Seconds),TLS (Seconds),Wait (Seconds),Transfer (Seconds),Bytes Downloaded,Repeated Images\n"
             summaryFile.write(header)
             for eachScaleData in scaleData:
                 scale = eachScaleData[0]
                 tileCount = eachScaleData[1]
                 tileMissingCount = eachScaleData[2]
                 drawTime = eachScaleData[3]
-                serviceLine = str(scale) + "," + str(tileCount) + "," + str(tileMissingCount) + "," + str(round(float(drawTime)/float(numberQueries),4)) + "\n"          
+                serviceLine = str(scale) + "," + str(tileCount) + "," + str(tileMissingCount) + "," + str(round(float(drawTime)/float(numberQueries)/getViewportCount(sampler),4)) + "," + getTimingColumns(scaleTimings.get(scale), float(numberQueries) * getViewportCount(sampler)) + "," + getSinkColumns(responseSinks.get(scale)) + "\n"          
                 summaryFile.write(serviceLine)          
         else:
-            header = "Scale,Draw Time (Seconds)\n"            
+            header = "Scale,Draw Time (Seconds),DNS (Seconds),Connect (Seconds),TLS (Seconds),Wait (Seconds),Transfer (Seconds),Bytes Downloaded,Repeated Images\n"            
             summaryFile.write(header)
             for eachScaleData in scaleData:
                 scale = eachScaleData[0]
                 drawTime = eachScaleData[1]   
-                serviceLine = str(scale) + "," + str(round(float(drawTime)/float(numberQueries),4)) + "\n"          
+                serviceLine = str(scale) + "," + str(round(float(drawTime)/float(numberQueries)/getViewportCount(sampler),4)) + "," + getTimingColumns(scaleTimings.get(scale), float(numberQueries) * getViewportCount(sampler)) + "," + getSinkColumns(responseSinks.get(scale)) + "\n"          
                 summaryFile.write(serviceLine)
         summaryFile.close()
+
+        # If any images were written out
+        if (sum(responseSinks[scale]["written"] for scale in responseSinks) > 0):
+            arcpy.AddMessage("Downloaded images location - " + arcpy.env.scratchFolder)
+
+        # Compare the draw times to the previous runs - Not for load tests and replays
+        regressionFound = False
+        if (useResultsDatabase == "true") and (runTimings):
+            runInfo = {"arcgis": arcpy.GetInstallInfo().get("Version"),
+                       "boundingBox": boundingBox,
+                       "imageFormat": imageFormat,
+                       "numberQueries": numberQueries,
+                       "sampleExtents": sampleExtents,
+                       "sampleSeed": sampleSeed}
+            regressionFound = reportComparisons(ResultsStore.checkRun("MapServiceTest", mapService, runTimings, runInfo, None, workload))
             
         # --------------------------------------- End of code --------------------------------------- #  
             
@@ -307,7 +341,9 @@ def mainFunction(mapService,username,password,boundingBox,scales,imageFormat,num
             # Remove file handler and close log file            
             logging.FileHandler.close(logMessage)
             logger.removeHandler(logMessage)
-        pass
+        # Exit with an error if slower than the previous runs
+        if (regressionFound == True) and (failOnRegression == "true"):
+            sys.exit(1)
     # If arcpy error
     except arcpy.ExecuteError:           
         # Build and show the error message
@@ -350,26 +386,548 @@ def mainFunction(mapService,username,password,boundingBox,scales,imageFormat,num
 # End of main function
 
 
+# Start of get tile plan function
+def getTilePlan(tileInfo, boundingBoxes, ImageWidth, ImageHeight, dpi):
+    # Scale and resolution of each level and the bounding boxes as arrays
+    scales = numpy.array([float(level['scale']) for level in tileInfo['lods']])
+    resolutions = numpy.array([float(level['resolution']) for level in tileInfo['lods']])
+    boxes = numpy.array(boundingBoxes, dtype=float)
+    # Use the same bounding boxes at every level unless given for each level e.g. random viewports
+    if (boxes.ndim < 3):
+        boxes = numpy.tile(boxes.reshape(1, -1, 4), (len(scales), 1, 1))
+
+    # Centre point of each bounding box at each level
+    searchPointX = boxes[:, :, 0] + ((boxes[:, :, 2] - boxes[:, :, 0]) / 2)
+    searchPointY = boxes[:, :, 1] + ((boxes[:, :, 3] - boxes[:, :, 1]) / 2)
+
+    # Half of the image width and height in metres at each scale (assume the map is in metres)
+    halfX = ((float(ImageWidth) / float(dpi)) * 0.0254 * scales) / 2
+    halfY = ((float(ImageHeight) / float(dpi)) * 0.0254 * scales) / 2
+
+    # Width and height of a tile in map units at each level
+    tileWidth = resolutions * float(tileInfo['cols'])
+    tileHeight = resolutions * float(tileInfo['rows'])
+    tileOriginX = float(tileInfo['origin']['x'])
+    tileOriginY = float(tileInfo['origin']['y'])
+
+    # Find the top left and bottom right tile row and column for every level (rows) and bounding box (columns)
+    topLeftTileColumn = numpy.floor((searchPointX - halfX[:, numpy.newaxis] - tileOriginX) / tileWidth[:, numpy.newaxis]).astype(int)
+    topLeftTileRow = numpy.floor((tileOriginY - (searchPointY + halfY[:, numpy.newaxis])) / tileHeight[:, numpy.newaxis]).astype(int)
+    bottomRightTileColumn = numpy.floor((searchPointX + halfX[:, numpy.newaxis] - tileOriginX) / tileWidth[:, numpy.newaxis]).astype(int)
+    bottomRightTileRow = numpy.floor((tileOriginY - (searchPointY - halfY[:, numpy.newaxis])) / tileHeight[:, numpy.newaxis]).astype(int)
+
+    # Get the tiles for each level - Including the bottom right row and column
+    tilePlan = []
+    for index, level in enumerate(tileInfo['lods']):
+        tiles = []
+        tilesAdded = set()
+        for box in range(boxes.shape[1]):
+            columns, rows = numpy.meshgrid(numpy.arange(topLeftTileColumn[index, box], bottomRightTileColumn[index, box] + 1),
+                                           numpy.arange(topLeftTileRow[index, box], bottomRightTileRow[index, box] + 1),
+                                           indexing="ij")
+            # Don't request the same tile twice where bounding boxes overlap
+            for row, column in zip(rows.ravel().tolist(), columns.ravel().tolist()):
+                if (row, column) not in tilesAdded:
+                    tilesAdded.add((row, column))
+                    tiles.append([row, column])
+        tilePlan.append({"level": level['level'],
+                         "scale": level['scale'],
+                         "tiles": tiles})
+    return tilePlan
+# End of get tile plan function
+
+
+# Start of new sampler function
+def newSampler(boundingBox):
+    # Not sampling - Use the centre of the bounding box
+    if (sampleExtents != "true"):
+        return None
+    arcpy.AddMessage("Sampling " + str(sampleCount) + " random viewports at each scale (Seed " + str(sampleSeed) + ")...")
+    sampler = {"randomState": numpy.random.RandomState(int(sampleSeed)),
+               "points": None}
+
+    # If weighting the viewports
+    if (sampleWeightFile):
+        pointX, pointY, weights, cellWidth, cellHeight = getSampleWeights(sampleWeightFile)
+        # Only use the points inside the bounding box
+        inBox = (pointX >= float(boundingBox[0])) & (pointX <= float(boundingBox[2])) & (pointY >= float(boundingBox[1])) & (pointY <= float(boundingBox[3])) & (weights > 0)
+        if (numpy.any(inBox)):
+            sampler["points"] = {"x": pointX[inBox],
+                                 "y": pointY[inBox],
+                                 "probability": weights[inBox] / numpy.sum(weights[inBox]),
+                                 "cellWidth": cellWidth,
+                                 "cellHeight": cellHeight}
+        else:
+            arcpy.AddWarning("No weights found inside the bounding box, sampling viewports uniformly...")
+    return sampler
+# End of new sampler function
+
+
+# Start of get sample weights function
+def getSampleWeights(weightFile):
+    describe = arcpy.Describe(weightFile)
+    # Density raster - Weight each cell by its value
+    if (describe.dataType in ["RasterDataset","RasterLayer"]):
+        values = arcpy.RasterToNumPyArray(weightFile, nodata_to_value=0).astype(float)
+        # Use the first band
+        if (values.ndim > 2):
+            values = values[0]
+        cellWidth = float(describe.meanCellWidth)
+        cellHeight = float(describe.meanCellHeight)
+        # Centre of each cell - First row is at the top of the raster
+        rows, columns = numpy.indices(values.shape)
+        pointX = float(describe.extent.XMin) + ((columns.ravel() + 0.5) * cellWidth)
+        pointY = float(describe.extent.YMax) - ((rows.ravel() + 0.5) * cellHeight)
+        return pointX, pointY, numpy.maximum(values.ravel(), 0), cellWidth, cellHeight
+    # Points - Each point is equally likely
+    points = arcpy.da.FeatureClassToNumPyArray(weightFile, ["SHAPE@X","SHAPE@Y"])
+    pointX = points["SHAPE@X"].astype(float)
+    pointY = points["SHAPE@Y"].astype(float)
+    return pointX, pointY, numpy.ones(len(pointX)), 0, 0
+# End of get sample weights function
+
+
+# Start of get viewports function
+def getViewports(sampler, boundingBox, scales, ImageWidth, ImageHeight, dpi):
+    # Not sampling - Just the bounding box at each scale
+    if (sampler == None):
+        return [[boundingBox]] * len(scales)
+
+    # Get the centre of each viewport at each scale
+    size = (len(scales), int(sampleCount))
+    randomState = sampler["randomState"]
+    points = sampler["points"]
+    if (points == None):
+        # Anywhere in the bounding box
+        searchPointX = randomState.uniform(float(boundingBox[0]), float(boundingBox[2]), size)
+        searchPointY = randomState.uniform(float(boundingBox[1]), float(boundingBox[3]), size)
+    else:
+        # Pick points by their weight, then anywhere in the raster cell
+        pick = randomState.choice(len(points["x"]), size, p=points["probability"])
+        searchPointX = points["x"][pick] + randomState.uniform(-0.5, 0.5, size) * points["cellWidth"]
+        searchPointY = points["y"][pick] + randomState.uniform(-0.5, 0.5, size) * points["cellHeight"]
+
+    # Extent of the image around each centre at each scale (assume the map is in metres)
+    scales = numpy.array(scales, dtype=float).reshape(-1, 1)
+    halfX = ((float(ImageWidth) / float(dpi)) * 0.0254 * scales) / 2
+    halfY = ((float(ImageHeight) / float(dpi)) * 0.0254 * scales) / 2
+    return numpy.dstack([searchPointX - halfX, searchPointY - halfY, searchPointX + halfX, searchPointY + halfY])
+# End of get viewports function
+
+
+# Start of get viewport count function
+def getViewportCount(sampler):
+    if (sampler == None):
+        return 1
+    return int(sampleCount)
+# End of get viewport count function
+
+
+# Start of get viewport suffix function
+def getViewportSuffix(viewport):
+    # Name the images for each viewport when sampling
+    if (sampleExtents != "true"):
+        return ""
+    return "_" + str(viewport + 1)
+# End of get viewport suffix function
+
+
+# Start of get tile query function
+def getTileQuery(mapService, level, row, column, token):
+    query = mapService + "/tile/" + str(level) + "/" + str(row) + "/" + str(column);
+    # If token received
+    if (token):
+        # Add token to query
+        query = query + "?token=" + token
+    return query
+# End of get tile query function
+
+
+# Start of get export query function
+def getExportQuery(mapService, dpi, imageFormat, ImageWidth, ImageHeight, scale, boundingBox, token):
+    query = mapService + "/export?f=image&dpi=" + str(dpi);
+    query = query + "&format=" + str(imageFormat)            
+    query = query + "&size=" + str(ImageWidth) + "," + str(ImageHeight)
+    query = query + "&mapScale=" + str(scale)
+    query = query + "&bbox=" + str(boundingBox[0]) + "," + str(boundingBox[1]) + "," + str(boundingBox[2]) + "," + str(boundingBox[3])
+
+    # If token received
+    if (token):
+        # Add token to query
+        query = query + "&token=" + token
+    return query
+# End of get export query function
+
+
+# Start of get load test requests function
+def getLoadTestRequests(mapService, dataObject, boundingBox, sampler, scales, imageFormat, token, dpi, ImageWidth, ImageHeight):
+    loadRequests = []
+    # If the map service is cached
+    if "tileInfo" in dataObject:
+        # Request each tile in the plan at each level
+        tileInfo = dataObject['tileInfo']
+        viewports = getViewports(sampler, boundingBox, [level['scale'] for level in tileInfo['lods']], ImageWidth, ImageHeight, tileInfo['dpi'])
+        for levelPlan in getTilePlan(tileInfo, viewports, ImageWidth, ImageHeight, tileInfo['dpi']):
+            for row, column in levelPlan['tiles']:
+                loadRequests.append([str(levelPlan['scale']), getTileQuery(mapService, levelPlan['level'], row, column, token)])
+    # Dynamic map service
+    else:
+        # If a string, convert to array for scales
+        if isinstance(scales, basestring):
+            scales = string.split(scales, ";")
+        # Request an image for each viewport at each scale
+        for scale, scaleViewports in zip(scales, getViewports(sampler, boundingBox, scales, ImageWidth, ImageHeight, dpi)):
+            for viewportBox in scaleViewports:
+                loadRequests.append([str(scale), getExportQuery(mapService, dpi, imageFormat, ImageWidth, ImageHeight, scale, viewportBox, token)])
+    return loadRequests
+# End of get load test requests function
+
+
+# Start of run load test function
+def runLoadTest(loadRequests):
+    # Nothing to request e.g. no scales or no tiles inside the bounding box
+    if (len(loadRequests) == 0):
+        arcpy.AddWarning("No requests to send for the load test, check the scales and bounding box...")
+        return mergeLoadTestResults([], loadRequests, time.time())
+
+    # Keep enough connections alive for all the threads
+    if (RESTClient.poolSize < loadTestThreads):
+        RESTClient.configurePool(RESTClient.poolConnections, loadTestThreads)
+
+    # Shared between the threads - Next request to send and when it can be sent
+    loadState = {"startTime": time.time(),
+                 "nextRequest": 0,
+                 "nextSendTime": time.time(),
+                 "lock": threading.Lock()}
+    loadState["endTime"] = loadState["startTime"] + float(loadTestDuration)
+
+    # Run each thread until the end of the test
+    pool = multiprocessing.pool.ThreadPool(int(loadTestThreads))
+    try:
+        threadResults = pool.map(lambda thread: runLoadTestThread(thread, loadRequests, loadState), range(int(loadTestThreads)))
+    finally:
+        pool.close()
+        pool.join()
+    return mergeLoadTestResults(threadResults, loadRequests, loadState["startTime"])
+# End of run load test function
+
+
+# Start of merge load test results function
+def mergeLoadTestResults(threadResults, loadRequests, startTime):
+    duration = time.time() - startTime
+    # Merge the results from each thread for each scale and in total
+    scales = []
+    results = {}
+    total = newLoadTestResult()
+    for threadResult in threadResults:
+        for scale in threadResult:
+            if scale not in results:
+                results[scale] = newLoadTestResult()
+            mergeLoadTestResult(results[scale], threadResult[scale])
+            mergeLoadTestResult(total, threadResult[scale])
+    # Keep the scales in the order they were requested
+    for loadRequest in loadRequests:
+        if (loadRequest[0] in results) and (loadRequest[0] not in scales):
+            scales.append(loadRequest[0])
+    arcpy.AddMessage("Load test sent " + str(total["requests"]) + " requests with " + str(total["errors"]) + " errors in " + str(round(duration, 2)) + " seconds...")
+    return {"scales": scales, "results": results, "total": total, "duration": duration}
+# End of merge load test results function
+
+
+# Start of run load test thread function
+def runLoadTestThread(thread, loadRequests, loadState):
+    threadResults = {}
+    # Start the threads one after another over the ramp up time
+    time.sleep(float(loadTestRampUp) * thread / int(loadTestThreads))
+    while (time.time() < loadState["endTime"]):
+        with loadState["lock"]:
+            # Get the next request - Go through the requests in order so each scale is requested evenly
+            loadRequest = loadRequests[loadState["nextRequest"] % len(loadRequests)]
+            loadState["nextRequest"] += 1
+            sendTime = time.time()
+            # If a request rate is set, space out the requests - Rate increases over the ramp up time
+            if (float(loadTestRate) > 0):
+                rampUp = 1
+                if (float(loadTestRampUp) > 0):
+                    rampUp = min(1, max(0.1, (time.time() - loadState["startTime"]) / float(loadTestRampUp)))
+                sendTime = max(loadState["nextSendTime"], time.time())
+                loadState["nextSendTime"] = sendTime + (1 / (float(loadTestRate) * rampUp))
+        # Wait until the request can be sent
+        if (sendTime >= loadState["endTime"]):
+            break
+        if (sendTime > time.time()):
+            time.sleep(sendTime - time.time())
+
+        # Send the request and time it
+        sendLoadTestRequest(threadResults, loadRequest[0], loadRequest[1])
+    return threadResults
+# End of run load test thread function
+
+
+# Start of send load test request function
+def sendLoadTestRequest(threadResults, label, url):
+    if label not in threadResults:
+        threadResults[label] = newLoadTestResult()
+    result = threadResults[label]
+    startTime = RESTClient.clock()
+    try:
+        response, timing = RESTClient.timeRequest(url, None, "GET")
+        content = response.content
+        downloadTime = timing["total"]
+        RESTClient.addTiming(result["timing"], timing)
+        # Missing tile
+        if (response.status_code == 404):
+            result["missing"] += 1
+        # Error from the server
+        elif (response.status_code >= 400) or ("json" in response.headers.get("Content-Type", "") and "error" in content):
+            result["errors"] += 1
+    # If the request fails e.g. timed out
+    except RESTClient.RequestError, error:
+        downloadTime = RESTClient.clock() - startTime
+        result["errors"] += 1
+    result["requests"] += 1
+    result["sketch"] = LatencySketch.addValue(result["sketch"], downloadTime)
+# End of send load test request function
+
+
+# Start of get replay requests function
+def getReplayRequests(logFile, mapService, imageFormat, token):
+    # Replay against the site the map service is on
+    if ("/rest/services" in mapService.lower()):
+        siteURL = mapService[:mapService.lower().index("/rest/services")]
+    else:
+        parse_object = urlparse(mapService)
+        siteURL = parse_object.scheme + "://" + parse_object.netloc + "/arcgis"
+    # ArcGIS Server logs or an access log
+    if (logFile.lower().endswith(".json")):
+        replayRequests = getServerLogRequests(logFile, siteURL, imageFormat, token)
+    else:
+        replayRequests = getAccessLogRequests(logFile, siteURL, token)
+    # Oldest request first
+    replayRequests.sort(key=lambda replayRequest: replayRequest[2])
+    arcpy.AddMessage(str(len(replayRequests)) + " requests to replay...")
+    return replayRequests
+# End of get replay requests function
+
+
+# Start of get server log requests function
+def getServerLogRequests(logFile, siteURL, imageFormat, token):
+    replayRequests = []
+    queryCount = 0
+    logData = open(logFile, "r")
+    logMessages = json.load(logData)
+    logData.close()
+    # Response from /admin/logs/query or just the log messages
+    if isinstance(logMessages, dict):
+        logMessages = logMessages.get("logMessages", [])
+    for logMessage in logMessages:
+        # Map draws log the extent, size and scale - e.g. Extent:xmin,ymin,xmax,ymax;Size:1280,768;Scale:50000
+        match = re.search("Extent:\\s*([^;]+);\\s*Size:\\s*(\\d+)\\s*,\\s*(\\d+)", logMessage.get("message", ""))
+        if (match) and (".MapServer" in logMessage.get("source", "")):
+            query = siteURL + "/rest/services/" + logMessage["source"].replace(".MapServer", "/MapServer") + "/export?f=image"
+            query = query + "&format=" + str(imageFormat)
+            query = query + "&size=" + match.group(2) + "," + match.group(3)
+            query = query + "&bbox=" + match.group(1).replace(" ", "")
+            # If token received
+            if (token):
+                # Add token to query
+                query = query + "&token=" + token
+            replayRequests.append([logMessage["source"] + " export", query, float(logMessage["time"]) / 1000])
+        # Queries are logged without their parameters
+        elif re.search("End (Query|Find|Identify)", logMessage.get("message", "")):
+            queryCount = queryCount + 1
+    # If there were queries that can't be replayed
+    if (queryCount > 0):
+        arcpy.AddWarning(str(queryCount) + " queries in the ArcGIS Server logs can't be replayed as their parameters are not logged, use an access log to replay queries...")
+    return replayRequests
+# End of get server log requests function
+
+
+# Start of get access log requests function
+def getAccessLogRequests(logFile, siteURL, token):
+    replayRequests = []
+    fields = []
+    logData = open(logFile, "r")
+    for line in logData:
+        line = line.strip()
+        # Fields in each line - e.g. #Fields: date time s-ip cs-method cs-uri-stem cs-uri-query ...
+        if line.startswith("#Fields:"):
+            fields = line.split()[1:]
+            continue
+        if (not line) or line.startswith("#"):
+            continue
+        values = dict(zip(fields, line.split()))
+        # Only replay requests to services
+        path = values.get("cs-uri-stem", "")
+        if (values.get("cs-method") != "GET") or ("/rest/services/" not in path.lower()):
+            continue
+        # Recorded tokens will have expired - Use the current token
+        parameters = [parameter for parameter in parse_qsl(values.get("cs-uri-query", "-").replace("+", "%20")) if parameter[0].lower() != "token"]
+        if (token):
+            parameters.append(("token", token))
+        query = siteURL + path[path.lower().index("/rest/services/"):]
+        if (parameters):
+            query = query + "?" + urllib.urlencode(parameters)
+        recordTime = calendar.timegm(datetime.datetime.strptime(values["date"] + " " + values["time"], "%Y-%m-%d %H:%M:%S").timetuple())
+        replayRequests.append([getServiceOperation(path), query, float(recordTime)])
+    logData.close()
+    return replayRequests
+# End of get access log requests function
+
+
+# Start of get service operation function
+def getServiceOperation(path):
+    # Split the service and the operation - e.g. /arcgis/rest/services/Folder/Name/MapServer/0/query
+    parts = path[path.lower().index("/rest/services/") + len("/rest/services/"):].strip("/").split("/")
+    for index, part in enumerate(parts):
+        if part.lower().endswith("server"):
+            # Operation is the last part that is not a number e.g. query or tile
+            operations = [operation for operation in parts[index + 1:] if not operation.isdigit()]
+            if (operations):
+                return "/".join(parts[:index + 1]) + " " + operations[-1]
+            return "/".join(parts[:index + 1])
+    return "/".join(parts)
+# End of get service operation function
+
+
+# Start of run replay function
+def runReplay(replayRequests):
+    # Nothing to replay e.g. no requests in the log for the map service
+    if (len(replayRequests) == 0):
+        arcpy.AddWarning("No requests for the map service found in the log to replay...")
+        return mergeLoadTestResults([], replayRequests, time.time())
+
+    # Keep enough connections alive for all the threads
+    if (RESTClient.poolSize < loadTestThreads):
+        RESTClient.configurePool(RESTClient.poolConnections, loadTestThreads)
+
+    # Shared between the threads - Next request to send and how far behind the recorded times
+    replayState = {"startTime": time.time(),
+                   "nextRequest": 0,
+                   "maxLag": 0,
+                   "lock": threading.Lock()}
+
+    # Run the threads until all the requests are sent
+    pool = multiprocessing.pool.ThreadPool(int(loadTestThreads))
+    try:
+        threadResults = pool.map(lambda thread: runReplayThread(replayRequests, replayState), range(int(loadTestThreads)))
+    finally:
+        pool.close()
+        pool.join()
+    # If the requests could not be sent on time
+    if (replayState["maxLag"] > 1):
+        arcpy.AddWarning("Replay fell up to " + str(round(replayState["maxLag"], 2)) + " seconds behind the recorded times, use more threads...")
+    return mergeLoadTestResults(threadResults, replayRequests, replayState["startTime"])
+# End of run replay function
+
+
+# Start of run replay thread function
+def runReplayThread(replayRequests, replayState):
+    threadResults = {}
+    while True:
+        with replayState["lock"]:
+            # Stop when all the requests are sent
+            if (replayState["nextRequest"] >= len(replayRequests)):
+                break
+            replayRequest = replayRequests[replayState["nextRequest"]]
+            replayState["nextRequest"] += 1
+        # Wait until the recorded time, sped up
+        sendTime = replayState["startTime"] + ((replayRequest[2] - replayRequests[0][2]) / float(replaySpeed))
+        if (sendTime > time.time()):
+            time.sleep(sendTime - time.time())
+        else:
+            with replayState["lock"]:
+                replayState["maxLag"] = max(replayState["maxLag"], time.time() - sendTime)
+        # Send the request and time it
+        sendLoadTestRequest(threadResults, replayRequest[0], replayRequest[1])
+    return threadResults
+# End of run replay thread function
+
+
+# Start of new load test result function
+def newLoadTestResult():
+    return {"requests": 0, "errors": 0, "missing": 0, "sketch": None, "timing": RESTClient.newTiming()}
+# End of new load test result function
+
+
+# Start of merge load test result function
+def mergeLoadTestResult(result, otherResult):
+    result["requests"] += otherResult["requests"]
+    result["errors"] += otherResult["errors"]
+    result["missing"] += otherResult["missing"]
+    result["sketch"] = LatencySketch.mergeSketch(result["sketch"], otherResult["sketch"])
+    RESTClient.addTiming(result["timing"], otherResult["timing"])
+# End of merge load test result function
+
+
+# Start of get timing columns function
+def getTimingColumns(timing, count):
+    if (timing == None):
+        timing = RESTClient.newTiming()
+    # Average time for each part of the request
+    columns = []
+    for key in ["dns", "connect", "tls", "wait", "transfer"]:
+        columns.append(str(round(timing[key] / max(float(count), 1), 4)))
+    return ",".join(columns)
+# End of get timing columns function
+
+
+# Start of get load test line function
+def getLoadTestLine(scale, result, duration):
+    errorRate = 0
+    if (result["requests"] > 0):
+        errorRate = round(100.0 * result["errors"] / result["requests"], 2)
+    throughput = round(result["requests"] / max(duration, 0.001), 2)
+    return str(scale) + "," + str(result["requests"]) + "," + str(result["errors"]) + "," + str(result["missing"]) + "," + str(errorRate) + "," + str(throughput) + "," + str(LatencySketch.getPercentile(result["sketch"], 50)) + "," + str(LatencySketch.getPercentile(result["sketch"], 95)) + "," + str(LatencySketch.getPercentile(result["sketch"], 99)) + "," + str(round(LatencySketch.getMax(result["sketch"]), 4)) + "," + getTimingColumns(result["timing"], result["requests"]) + "\n"
+# End of get load test line function
+
+
+# Start of report comparisons function
+def reportComparisons(comparisons):
+    # Not enough previous runs to compare to
+    if (comparisons == None):
+        arcpy.AddMessage("Saved the results, not enough previous runs to compare to yet...")
+        return False
+    regressionMessage = ResultsStore.getRegressionMessage(comparisons)
+    # If nothing is slower
+    if not regressionMessage:
+        arcpy.AddMessage("No significant slowdown compared to the previous runs...")
+        return False
+    arcpy.AddWarning("Significantly slower than the previous runs:")
+    arcpy.AddWarning(regressionMessage)
+    # Logging
+    if (enableLogging == "true"):
+        logger.warning("Significantly slower than the previous runs:")
+        logger.warning(regressionMessage)
+    if (sendErrorEmail == "true"):
+        # Send email
+        sendEmail("Significantly slower than the previous runs:\n" + regressionMessage)
+    return True
+# End of report comparisons function
+
+
 # Start of url query function
 def urlQuery(query):
     # Make the query to the map service
     try:
-        startTime = time.time()
-        response = urllib2.urlopen(query).read()
-    except urllib2.URLError, error:
+        # Time the request - Once the whole response has been read
+        response, timing = RESTClient.timeRequest(query, None, "GET")
         # If no image found
-        if (error.code == 404):
+        if (response.status_code == 404):
             response = "Missing"
-        # If any other error
         else:
-            arcpy.AddError(error)
-            # Logging
-            if (enableLogging == "true"):
-                logger.error(error)
-            sys.exit()
+            response.raise_for_status()
+            response = response.content
+    # If any other error
+    except RESTClient.RequestError, error:
+        arcpy.AddError(error)
+        # Logging
+        if (enableLogging == "true"):
+            logger.error(error)
+        sys.exit()
 
-    # If there is an error in the response
-    if "error" in response:
+    # If there is an error in the response - Only check responses that are not images
+    if (not isImage(response)) and ("error" in response):
         arcpy.AddError("Error in the query response.")
         arcpy.AddError(response)        
         # Logging
@@ -378,13 +936,54 @@ def urlQuery(query):
             logger.error(response)
         sys.exit()  
     else:
-        # Get the time for the request
-        endTime = time.time()
-        downloadTime = endTime - startTime                            
-        return response, downloadTime
+        downloadTime = timing["total"]
+        return response, downloadTime, timing
 # End of url query function
 
 
+# Start of is image function
+def isImage(response):
+    # PNG, JPG and GIF signatures
+    return response.startswith("\x89PNG") or response.startswith("\xff\xd8") or response.startswith("GIF8")
+# End of is image function
+
+
+# Start of new response sink function
+def newResponseSink():
+    return {"responses": 0, "bytes": 0, "hashes": {}, "written": 0}
+# End of new response sink function
+
+
+# Start of sink response function
+def sinkResponse(sink, response, file):
+    sink["responses"] += 1
+    sink["bytes"] += len(response)
+    # Count each distinct image
+    if (responseSink == "hash"):
+        responseHash = hashlib.sha1(response).hexdigest()
+        sink["hashes"][responseHash] = sink["hashes"].get(responseHash, 0) + 1
+    # Write out all the images or the first of every so many
+    if (responseSink == "file") or ((responseSink == "sample") and ((sink["responses"] - 1) % int(responseSampleEvery) == 0)):
+        # Open the file for writing
+        responseImage = open(file, "wb")
+        responseImage.write(response)
+        responseImage.close()
+        sink["written"] += 1
+# End of sink response function
+
+
+# Start of get sink columns function
+def getSinkColumns(sink):
+    if (sink == None):
+        return "0,"
+    # Images the same as another image e.g. blank tiles - Only known when hashing
+    repeatedImages = ""
+    if (responseSink == "hash"):
+        repeatedImages = str(sink["responses"] - len(sink["hashes"]))
+    return str(sink["bytes"]) + "," + repeatedImages
+# End of get sink columns function
+
+
 # Start of get token function
 def getToken(username, password, serverName, serverPort):
     
@@ -394,20 +993,10 @@ def getToken(username, password, serverName, serverPort):
                   'client':     'requestip',
                   'f' : 'json'}
     
-    parameters = urllib.urlencode(parameters)
-    url = "https://{}:{}/arcgis/tokens/generateToken?".format(serverName, serverPort)
+    url = "https://{}:{}/arcgis/tokens/generateToken".format(serverName, serverPort)
    
     try:
-        response = urllib2.urlopen(url,parameters)
-        # Python version check
-        if sys.version_info[0] >= 3:
-            # Python 3.x
-            # Read json response
-            responseJSON = json.loads(response.read().decode('utf8'))
-        else:
-            # Python 2.x
-            # Read json response
-            responseJSON = json.loads(response.read())
+        responseJSON = TokenManager.requestToken(url,parameters)
         if "token" not in responseJSON or responseJSON == None:
             arcpy.AddError("Failed to get token, return message from server:")
             arcpy.AddError(responseJSON)           
@@ -420,7 +1009,7 @@ def getToken(username, password, serverName, serverPort):
             # Return the token to the function which called for it
             return responseJSON['token']
     
-    except urllib2.URLError, error:
+    except RESTClient.RequestError, error:
         arcpy.AddError("Could not connect to machine {} on port {}".format(serverName, serverPort))
         arcpy.AddError(error)
         # Logging
@@ -484,10 +1073,7 @@ if __name__ == '__main__':
         logger.info("Process started.")
     # Setup the use of a proxy for requests
     if (enableProxy == "true"):
-        # Setup the proxy
-        proxy = urllib2.ProxyHandler({requestProtocol : proxyURL})
-        openURL = urllib2.build_opener(proxy)
-        # Install the proxy
-        urllib2.install_opener(openURL)
+        # Setup the proxy on the shared session
+        RESTClient.setProxy(requestProtocol, proxyURL)
     mainFunction(*argv)
     
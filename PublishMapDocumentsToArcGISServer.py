@@ -23,10 +23,9 @@ import email.mime.application
 import csv
 import xml.dom.minidom as DOM
 import json
-import urllib
-import urllib2
-import ssl
 import re
+import RESTClient
+import TokenManager
 # Import ArcGIS modules
 useArcPy = "true"
 useArcGISAPIPython = "false"
@@ -50,6 +49,8 @@ emailServerPort = None # e.g. 25
 emailTo = "" # Address of email sent to
 emailUser = "" # Address of email sent from
 emailPassword = ""
+# Requests
+verifyCertificate = "false" # Verify SSL certificates (Sites use self signed certificates)
 # Proxy
 enableProxy = "false"
 requestProtocol = "http" # http or https
@@ -356,16 +357,13 @@ def checkAGSFolder(token,serviceURL,folder):
     printMessage("Checking ArcGIS Server folder - " + folder,"info")
     
     # Setup the parameters
-    parameters = urllib.urlencode({'token': token,
+    parameters = {'token': token,
                   'folderName': folder,
-                  'f': 'json'})
-    queryString = parameters.encode('utf-8')
+                  'f': 'json'}
 
     # Request to check if folder exists
     try:
-        context = ssl._create_unverified_context()
-        request = urllib2.Request(serviceURL + "/exists",queryString)
-        responseJSON = json.loads(urllib2.urlopen(request, context=context).read())
+        responseJSON = TokenManager.requestJSON(serviceURL + "/exists",parameters)
         if "error" in responseJSON:
             printMessage(responseJSON,"error")
         else:
@@ -375,7 +373,7 @@ def checkAGSFolder(token,serviceURL,folder):
                 createAGSFolder(token,serviceURL,folder)
             else:
                 printMessage("ArcGIS Server folder already exists - " + folder,"info")                
-    except urllib2.URLError, error:
+    except RESTClient.RequestError, error:
         printMessage("Could not connect...","error")
         printMessage(error,"error")
 # End of check ArcGIS Server folder function
@@ -386,21 +384,18 @@ def createAGSFolder(token,serviceURL,folder):
     printMessage("Creating ArcGIS Server folder - " + folder,"info")
     
     # Setup the parameters
-    parameters = urllib.urlencode({'token': token,
+    parameters = {'token': token,
                   'folderName': folder,
-                  'f': 'json'})
-    queryString = parameters.encode('utf-8')
+                  'f': 'json'}
 
     # Request to create folder
     try:
-        context = ssl._create_unverified_context()
-        request = urllib2.Request(serviceURL + "/createFolder",queryString)
-        responseJSON = json.loads(urllib2.urlopen(request, context=context).read())
+        responseJSON = TokenManager.requestJSON(serviceURL + "/createFolder",parameters)
         if "error" in responseJSON:
             printMessage(responseJSON,"error")
         else:
             printMessage("ArcGIS Server folder created - " + folder,"info")                
-    except urllib2.URLError, error:
+    except RESTClient.RequestError, error:
         printMessage("Could not connect...","error")
         printMessage(error,"error")
 # End of create ArcGIS Server folder function
@@ -411,15 +406,12 @@ def testService(serviceURL,token):
     printMessage("Testing service - " + serviceURL,"info")
 
     # Setup the parameters
-    parameters = urllib.urlencode({'token': token,
-                  'f': 'json'})
-    queryString = parameters.encode('utf-8')
+    parameters = {'token': token,
+                  'f': 'json'}
 
     # Request to get layer IDs
     try:
-        context = ssl._create_unverified_context()
-        request = urllib2.Request(serviceURL,queryString)
-        responseJSON = json.loads(urllib2.urlopen(request, context=context).read())
+        responseJSON = TokenManager.requestJSON(serviceURL,parameters)
         if "error" in responseJSON:
             printMessage("Test failed...","error")
             printMessage(responseJSON,"error")
@@ -434,7 +426,7 @@ def testService(serviceURL,token):
             else:
                 printMessage("Test failed...","error")
                 printMessage("This is an issue with the layers in the service...","error")            
-    except urllib2.URLError, error:
+    except RESTClient.RequestError, error:
         printMessage("Could not connect...","error")
         printMessage(error,"error")
 # End of test service function
@@ -445,24 +437,21 @@ def queryServiceLayer(serviceLayerURL,token):
     printMessage("Querying service layer - " + serviceLayerURL,"info")
 
     # Setup the parameters
-    parameters = urllib.urlencode({'token': token,
+    parameters = {'token': token,
                   'where': '1=1',
                   'outFields': '*',
-                  'f': 'json'})
-    queryString = parameters.encode('utf-8')
+                  'f': 'json'}
 
     # Request to query service layer
     try:
-        context = ssl._create_unverified_context()
-        request = urllib2.Request(serviceLayerURL,queryString)
-        responseJSON = json.loads(urllib2.urlopen(request, context=context).read())
+        responseJSON = TokenManager.requestJSON(serviceLayerURL,parameters)
         if "error" in responseJSON:
             printMessage("Test failed...","error")
             printMessage(responseJSON,"error")
         else:
             if "features" in responseJSON: 
                 printMessage("Test succeeded...","info")       
-    except urllib2.URLError, error:
+    except RESTClient.RequestError, error:
         printMessage("Could not connect...","error")
         printMessage(error,"error") 
 # End of query service layer function
@@ -473,15 +462,12 @@ def getItemIDs(token,serviceURL):
     printMessage("Requesting item ID from service - " + serviceURL,"info")
         
     # Setup the parameters
-    parameters = urllib.urlencode({'token': token,
-                  'f': 'json'})
-    queryString = parameters.encode('utf-8')
+    parameters = {'token': token,
+                  'f': 'json'}
 
     # Request to get item
     try:
-        context = ssl._create_unverified_context()
-        request = urllib2.Request(serviceURL,queryString)
-        responseJSON = json.loads(urllib2.urlopen(request, context=context).read())
+        responseJSON = TokenManager.requestJSON(serviceURL,parameters)
         if "error" in responseJSON:
             printMessage(responseJSON,"error")
             return None
@@ -490,7 +476,7 @@ def getItemIDs(token,serviceURL):
             portalItems = portalProperties.get('portalItems')
             # Return result
             return portalItems
-    except urllib2.URLError, error:
+    except RESTClient.RequestError, error:
         printMessage("Could not connect...","error")
         printMessage(error,"error")
         return None
@@ -502,22 +488,19 @@ def getItemOwner(token,portalURL,portalItem):
     printMessage("Requesting item owner...","info")
 
     # Setup the parameters
-    parameters = urllib.urlencode({'token': token,           
-                  'f': 'json'})
-    queryString = parameters.encode('utf-8')
+    parameters = {'token': token,           
+                  'f': 'json'}
 
     # Request to search for item
     try:
-        context = ssl._create_unverified_context()
-        request = urllib2.Request(portalURL + "/sharing/rest/content/items/" + portalItem["itemID"],queryString)
-        responseJSON = json.loads(urllib2.urlopen(request, context=context).read())
+        responseJSON = TokenManager.requestJSON(portalURL + "/sharing/rest/content/items/" + portalItem["itemID"],parameters)
         if "error" in responseJSON:
             printMessage(responseJSON,"error")
             return None
         else:  
             # Return result
             return responseJSON["owner"]
-    except urllib2.URLError, error:
+    except RESTClient.RequestError, error:
         printMessage("Could not connect...","error")
         printMessage(error,"error")
         return None
@@ -538,23 +521,20 @@ def setSharing(token,portalURL,portalUser,portalItem,organisationSharing,groupSh
     printMessage("Sharing with the following groups - " + groupSharing,"info")
     
     # Setup the parameters
-    parameters = urllib.urlencode({'token': token,
+    parameters = {'token': token,
                   'everyone': everyoneBoolean,
                   'org': orgBoolean,
                   'groups': groupSharing,
-                  'f': 'json'})
-    queryString = parameters.encode('utf-8')
+                  'f': 'json'}
 
     # Request to share item
     try:
-        context = ssl._create_unverified_context()
-        request = urllib2.Request( portalURL + "/sharing/rest/content/users/" + portalUser + "/items/" + portalItem["itemID"] + "/share",queryString)
-        responseJSON = json.loads(urllib2.urlopen(request, context=context).read())
+        responseJSON = TokenManager.requestJSON(portalURL + "/sharing/rest/content/users/" + portalUser + "/items/" + portalItem["itemID"] + "/share",parameters)
         if "error" in responseJSON:
             printMessage(responseJSON,"error")
         else:
             printMessage(responseJSON,"info")           
-    except urllib2.URLError, error:
+    except RESTClient.RequestError, error:
         printMessage("Could not connect...","error")
         printMessage(error,"error") 
 # End of set sharing function
@@ -565,22 +545,19 @@ def updateItemDetails(token,portalURL,portalUser,portalItem,title,thumbnail):
     printMessage("Updating item title and thumbnail - " + portalItem["itemID"],"info")
     
     # Setup the parameters
-    parameters = urllib.urlencode({'token': token,
+    parameters = {'token': token,
                   'title': title,
                   'thumbnail': thumbnail,                                   
-                  'f': 'json'})
-    queryString = parameters.encode('utf-8')
+                  'f': 'json'}
 
    # Request to update item
     try:
-        context = ssl._create_unverified_context()
-        request = urllib2.Request( portalURL + "/sharing/rest/content/users/" + portalUser + "/items/" + portalItem["itemID"] + "/update",queryString) 
-        responseJSON = json.loads(urllib2.urlopen(request, context=context).read())
+        responseJSON = TokenManager.requestJSON(portalURL + "/sharing/rest/content/users/" + portalUser + "/items/" + portalItem["itemID"] + "/update",parameters)
         if "error" in responseJSON:
             printMessage(responseJSON,"error")
         else:
             printMessage(responseJSON,"info") 
-    except urllib2.URLError, error:
+    except RESTClient.RequestError, error:
         printMessage("Could not connect...","error")
         printMessage(error,"error")      
 # End of update item details function
@@ -593,18 +570,15 @@ def getItemIDGroup(token,portalURL,groupTitles):
         printMessage("Requesting Item ID for " + groupTitle + "...","info")        
 
         # Setup the parameters
-        parameters = urllib.urlencode({'token': token,
+        parameters = {'token': token,
                       'q': 'title:' + groupTitle,
                       'sort_field': 'title',
                       'sort_order': 'asc',              
-                      'f': 'json'})
-        queryString = parameters.encode('utf-8')
+                      'f': 'json'}
 
         # Request to search for item
         try:
-            context = ssl._create_unverified_context()
-            request = urllib2.Request( portalURL + "/sharing/rest/community/groups",queryString)
-            responseJSON = json.loads(urllib2.urlopen(request, context=context).read())
+            responseJSON = TokenManager.requestJSON(portalURL + "/sharing/rest/community/groups",parameters)
             if "error" in responseJSON:
                 printMessage(responseJSON,"error")
             else:
@@ -614,7 +588,7 @@ def getItemIDGroup(token,portalURL,groupTitles):
                     if (result["title"].lower() == groupTitle.lower()):
                         # Add ID to array
                         groupIDs.append(result["id"])     
-        except urllib2.URLError, error:
+        except RESTClient.RequestError, error:
             printMessage("Could not connect...","error")
             printMessage(error,"error")
             
@@ -627,26 +601,23 @@ def getToken(portalURL,portalUser,portalPassword):
     printMessage("Getting portal token - " + portalURL + "/sharing/rest/generateToken","info")
         
     # Setup the parameters
-    parameters = urllib.urlencode({'username': portalUser,
+    parameters = {'username': portalUser,
                   'password': portalPassword,
                   'client': 'referer',
                   'referer': portalURL,
                   'expiration': '60',
-                  'f': 'json'})
-    queryString = parameters.encode('utf-8')
+                  'f': 'json'}
 
     # Request to get token
     try:
-        context = ssl._create_unverified_context()
-        request = urllib2.Request(portalURL + "/sharing/rest/generateToken",queryString)
-        responseJSON = json.loads(urllib2.urlopen(request, context=context).read())
+        responseJSON = TokenManager.requestToken(portalURL + "/sharing/rest/generateToken",parameters)
         if "error" in responseJSON:
             printMessage(responseJSON,"error")
             return None
         else:
             token = responseJSON.get('token')
             return token
-    except urllib2.URLError, error:
+    except RESTClient.RequestError, error:
         printMessage("Could not connect...","error")
         printMessage(error,"error")
         return None
@@ -752,9 +723,8 @@ if __name__ == '__main__':
         logger.info("Process started.")
     # Setup the use of a proxy for requests
     if (enableProxy == "true"):
-        # Setup the proxy
-        proxy = urllib2.ProxyHandler({requestProtocol : proxyURL})
-        openURL = urllib2.build_opener(proxy)
-        # Install the proxy
-        urllib2.install_opener(openURL)
+        # Setup the proxy on the shared session
+        RESTClient.setProxy(requestProtocol, proxyURL)
+    # Don't verify SSL certificates on the shared session if turned off
+    RESTClient.setVerifyCertificate(verifyCertificate)
     mainFunction(*argv)
@@ -0,0 +1,338 @@
+#-------------------------------------------------------------
+# Name:       REST Client
+# Purpose:    Shared HTTP session used by the toolkit scripts for all ArcGIS Server and Portal REST/admin
+#             requests. Connections are kept alive and pooled per host so a sweep across hundreds of
+#             services only pays the TCP/TLS handshake once per host, and responses are gzip compressed.
+#             Requests can be timed with a breakdown of DNS, connect, TLS, wait (time to first byte) and
+#             transfer time.
+# Author:     Shaun Weston (shaun_weston@eagle.co.nz)
+# Date Created:    18/10/2026
+# Last Updated:    18/10/2026
+# Copyright:   (c) Eagle Technology
+# ArcGIS Version:   ArcMap (ArcPy) 10.1+ or ArcGIS API for Python 1.4.2+
+# Python Version:   2.7 or 3.6.5+ (Requests 2.10+ - See Packages folder, ijson 2.3+ optional)
+#--------------------------------
+
+# Import main modules
+import sys
+import time
+import socket
+import threading
+import json
+import decimal
+import requests
+from requests.adapters import HTTPAdapter
+# Incremental JSON parser used to stream large responses (Optional - Whole response is read if not installed)
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+# Set global variables
+# Connection pooling
+poolConnections = 10 # Number of hosts to keep a connection pool for
+poolSize = 20 # Maximum number of open connections kept alive to each host
+poolBlock = "false" # Wait for a free connection when the pool is full instead of opening a new one
+# Requests
+requestTimeout = 120 # Seconds to wait to connect and for each read
+verifyCertificate = "true" # Verify SSL certificates - Scripts for sites with self signed certificates turn this off with setVerifyCertificate
+enableGzip = "true" # Ask the server to gzip compress responses
+# Proxy
+proxies = {}
+
+# Clock used to time requests - Python 2 has no monotonic clock, but time.clock is one on Windows
+if hasattr(time, "monotonic"):
+    clock = time.monotonic
+elif sys.platform.startswith("win"):
+    clock = time.clock
+else:
+    clock = time.time
+# Timing of the request being made on each thread
+timingLocal = threading.local()
+
+# Errors raised by the session e.g. could not connect, timed out
+RequestError = requests.exceptions.RequestException
+
+# Shared session
+session = None
+sessionLock = threading.Lock()
+# Lock used when hooking the connection pools to time new connections
+hookLock = threading.Lock()
+
+# Time DNS lookups made when opening a connection - Lookups are only timed on a thread timing a request
+getAddressInfo = socket.getaddrinfo
+
+
+# Start of get session function
+def getSession():
+    global session
+    # Create the session the first time it is needed
+    if (session == None):
+        with sessionLock:
+            if (session == None):
+                newSession = requests.Session()
+                # Setup the connection pool for http and https
+                adapter = HTTPAdapter(pool_connections=poolConnections, pool_maxsize=poolSize, pool_block=(poolBlock == "true"))
+                # Time the connections opened by the pools, including through a proxy
+                hookPoolManager(adapter.poolmanager)
+                proxyManagerFor = adapter.proxy_manager_for
+                def timedProxyManagerFor(proxy, **proxyArguments):
+                    proxyManager = proxyManagerFor(proxy, **proxyArguments)
+                    hookPoolManager(proxyManager)
+                    return proxyManager
+                adapter.proxy_manager_for = timedProxyManagerFor
+                # Time the DNS lookups made when opening connections
+                socket.getaddrinfo = timedLookup
+                newSession.mount("http://", adapter)
+                newSession.mount("https://", adapter)
+                newSession.headers.update({"Connection": "keep-alive"})
+                if (enableGzip == "true"):
+                    newSession.headers.update({"Accept-Encoding": "gzip, deflate"})
+                else:
+                    newSession.headers.update({"Accept-Encoding": "identity"})
+                newSession.verify = (verifyCertificate == "true")
+                newSession.proxies.update(proxies)
+                session = newSession
+    return session
+# End of get session function
+
+
+# Start of configure pool function
+def configurePool(connections,size):
+    global poolConnections, poolSize
+    poolConnections = int(connections)
+    poolSize = int(size)
+    # Recreate the session with the new pool size on the next request
+    closeSession()
+# End of configure pool function
+
+
+# Start of set proxy function
+def setProxy(requestProtocol,proxyURL):
+    proxies[requestProtocol] = proxyURL
+    # Update the session if already created
+    if (session != None):
+        session.proxies.update(proxies)
+# End of set proxy function
+
+
+# Start of set verify certificate function
+def setVerifyCertificate(verify):
+    global verifyCertificate
+    verifyCertificate = verify
+    # Turn off warnings for unverified certificates
+    if (verifyCertificate != "true"):
+        requests.packages.urllib3.disable_warnings(requests.packages.urllib3.exceptions.InsecureRequestWarning)
+    # Update the session if already created
+    if (session != None):
+        session.verify = (verifyCertificate == "true")
+# End of set verify certificate function
+
+
+# Start of send request function
+def sendRequest(url,parameters=None,method="POST",headers=None,stream=False,timeout=None):
+    if (timeout == None):
+        timeout = requestTimeout
+    # Post the parameters in the body or add them to the query string
+    if (method.upper() == "POST"):
+        response = getSession().post(url, data=parameters, headers=headers, stream=stream, timeout=timeout)
+    else:
+        response = getSession().get(url, params=parameters, headers=headers, stream=stream, timeout=timeout)
+    return response
+# End of send request function
+
+
+# Start of time request function
+def timeRequest(url,parameters=None,method="POST",headers=None,timeout=None):
+    timing = newTiming()
+    # Time opening a new connection to the host if one is needed
+    timingLocal.timing = timing
+    try:
+        startTime = clock()
+        # Returns once the headers have been read
+        response = sendRequest(url,parameters,method,headers,True,timeout)
+        headersTime = clock()
+        # Read the whole response
+        content = response.content
+        endTime = clock()
+    finally:
+        timingLocal.timing = None
+    # Waiting for the server is the time to the headers after connecting
+    timing["wait"] = max(0, headersTime - startTime - timing["dns"] - timing["connect"] - timing["tls"])
+    timing["transfer"] = endTime - headersTime
+    timing["total"] = endTime - startTime
+    # Bytes read from the network (Before decompressing) if known
+    if hasattr(response.raw, "tell"):
+        timing["bytes"] = response.raw.tell() or len(content)
+    else:
+        timing["bytes"] = len(content)
+    return response, timing
+# End of time request function
+
+
+# Start of new timing function
+def newTiming():
+    # Seconds spent in each part of the request and the bytes read
+    return {"dns": 0, "connect": 0, "tls": 0, "wait": 0, "transfer": 0, "total": 0, "bytes": 0, "connections": 0}
+# End of new timing function
+
+
+# Start of add timing function
+def addTiming(totalTiming,timing):
+    # Add up the timings e.g. for all the tiles at a scale
+    for key in totalTiming:
+        totalTiming[key] += timing.get(key, 0)
+    return totalTiming
+# End of add timing function
+
+
+# Start of hook pool manager function
+def hookPoolManager(poolManager):
+    # Only hook each pool manager once - Proxy managers are looked up on every request
+    with hookLock:
+        if getattr(poolManager, "timingHooked", False):
+            return
+        poolManager.timingHooked = True
+    newPool = poolManager._new_pool
+    # Time the connections opened by each pool the manager creates
+    def timedNewPool(*arguments, **keywordArguments):
+        pool = newPool(*arguments, **keywordArguments)
+        hookPool(pool)
+        return pool
+    poolManager._new_pool = timedNewPool
+# End of hook pool manager function
+
+
+# Start of hook pool function
+def hookPool(pool):
+    newConnection = pool._new_conn
+    # Time each new connection the pool opens
+    def timedNewConnection():
+        connection = newConnection()
+        hookConnection(connection, getattr(pool, "scheme", "http"))
+        return connection
+    pool._new_conn = timedNewConnection
+# End of hook pool function
+
+
+# Start of hook connection function
+def hookConnection(connection,scheme):
+    newSocket = connection._new_conn
+    connect = connection.connect
+    # Time the DNS lookup and opening the socket
+    def timedNewSocket():
+        timing = getattr(timingLocal, "timing", None)
+        if (timing == None):
+            return newSocket()
+        # Lookups made while opening the socket are added up by the timed lookup function
+        timingLocal.lookupTime = 0
+        connectStart = clock()
+        try:
+            sock = newSocket()
+        finally:
+            lookupTime = timingLocal.lookupTime
+            timingLocal.lookupTime = None
+            timing["dns"] += lookupTime
+            timing["connect"] += max(0, (clock() - connectStart) - lookupTime)
+        return sock
+    # Time the TLS handshake - Time to connect after the socket is open
+    def timedConnect():
+        timing = getattr(timingLocal, "timing", None)
+        if (timing == None):
+            return connect()
+        socketTime = timing["dns"] + timing["connect"]
+        connectStart = clock()
+        connect()
+        timing["connections"] += 1
+        if (scheme == "https"):
+            timing["tls"] += max(0, (clock() - connectStart) - (timing["dns"] + timing["connect"] - socketTime))
+    connection._new_conn = timedNewSocket
+    connection.connect = timedConnect
+# End of hook connection function
+
+
+# Start of timed lookup function
+def timedLookup(*arguments, **keywordArguments):
+    # Only time lookups made while a timed connection is opening its socket
+    if (getattr(timingLocal, "lookupTime", None) == None):
+        return getAddressInfo(*arguments, **keywordArguments)
+    lookupStart = clock()
+    try:
+        return getAddressInfo(*arguments, **keywordArguments)
+    finally:
+        timingLocal.lookupTime += clock() - lookupStart
+# End of timed lookup function
+
+
+# Start of request JSON function
+def requestJSON(url,parameters=None,method="POST",headers=None,timeout=None):
+    response = sendRequest(url,parameters,method,headers,False,timeout)
+    # Raise an error if the server did not return a successful status
+    response.raise_for_status()
+    # Read json response
+    return json.loads(response.content.decode("utf-8"))
+# End of request JSON function
+
+
+# Start of stream JSON function
+def streamJSON(response,arrayName,responseInfo):
+    itemPath = arrayName + ".item"
+    # Read the whole response if the incremental parser is not installed
+    if (ijson == None):
+        responseJSON = json.loads(response.content.decode("utf-8"))
+        for key in responseJSON:
+            if (key != arrayName):
+                responseInfo[key] = responseJSON[key]
+        for item in responseJSON.get(arrayName, []):
+            yield item
+        return
+
+    # Decompress the response as it is read
+    response.raw.decode_content = True
+    # Everything in the response apart from the records e.g. hasMore or error
+    infoBuilder = ijson.common.ObjectBuilder()
+    itemBuilder = None
+    depth = 0
+    for path, event, value in ijson.parse(response.raw):
+        # Numbers are returned as decimals
+        if isinstance(value, decimal.Decimal):
+            if (value == value.to_integral_value()):
+                value = int(value)
+            else:
+                value = float(value)
+        # If building a record
+        if (itemBuilder != None):
+            itemBuilder.event(event, value)
+            if event in ("start_map","start_array"):
+                depth += 1
+            if event in ("end_map","end_array"):
+                depth -= 1
+            # Return the record when it is complete
+            if (depth == 0):
+                yield itemBuilder.value
+                itemBuilder = None
+        # Start of a record
+        elif (path == itemPath):
+            if event in ("start_map","start_array"):
+                itemBuilder = ijson.common.ObjectBuilder()
+                itemBuilder.event(event, value)
+                depth = 1
+            # Record is a single value e.g. object ID
+            else:
+                yield value
+        else:
+            infoBuilder.event(event, value)
+    if isinstance(infoBuilder.value, dict):
+        responseInfo.update(infoBuilder.value)
+# End of stream JSON function
+
+
+# Start of close session function
+def closeSession():
+    global session
+    with sessionLock:
+        if (session != None):
+            # Close all the pooled connections
+            session.close()
+            session = None
+# End of close session function
@@ -15,9 +15,9 @@ import sys
 import logging
 import smtplib
 import arcpy
-import urllib
-import urllib2
 import json
+import RESTClient
+import TokenManager
 
 # Enable data to be overwritten
 arcpy.env.overwriteOutput = True
@@ -58,14 +58,9 @@ def mainFunction(portalUrl, portalAdminName, portalAdminPassword, service, servi
         dict['description'] = serviceDescription
         dict['tags'] = serviceTags   
         dict['thumbnail'] = serviceThumbnail
-        params = urllib.urlencode(dict)       
-
-        # Setup the request
-        request = urllib2.Request(portalUrl + "/sharing/rest/content/users/" + portalAdminName + "/addItem",params)
 
         # POST the request
-        response = urllib2.urlopen(request).read()
-        responseJSON = json.loads(response)
+        responseJSON = TokenManager.requestJSON(portalUrl + "/sharing/rest/content/users/" + portalAdminName + "/addItem",dict)
 
         # Log results
         if responseJSON.has_key('error'):
@@ -89,14 +84,9 @@ def mainFunction(portalUrl, portalAdminName, portalAdminPassword, service, servi
             if (serviceAccess.lower() == "org"):
                 dict['everyone'] = "false"
                 dict['org'] = "true"            
-            params = urllib.urlencode(dict)
-        
-            # Setup the request
-            request = urllib2.Request(portalUrl + "/sharing/rest/content/users/" + portalAdminName + "/items/" + itemId + "/share",params)
 
             # POST the request
-            response = urllib2.urlopen(request).read()
-            responseJSON = json.loads(response)
+            responseJSON = TokenManager.requestJSON(portalUrl + "/sharing/rest/content/users/" + portalAdminName + "/items/" + itemId + "/share",dict)
             
             # Log results
             if responseJSON.has_key('error'):
@@ -172,19 +162,17 @@ def mainFunction(portalUrl, portalAdminName, portalAdminPassword, service, servi
 # Start of get token function
 def generateToken(username, password, portalUrl):
     '''Retrieves a token to be used with API requests.'''
-    parameters = urllib.urlencode({'username' : username,
-                                   'password' : password,
-                                   'client' : 'referer',
-                                   'referer': portalUrl,
-                                   'expiration': 60,
-                                   'f' : 'json'})
+    parameters = {'username' : username,
+                  'password' : password,
+                  'client' : 'referer',
+                  'referer': portalUrl,
+                  'expiration': 60,
+                  'f' : 'json'}
     try:
-        response = urllib2.urlopen(portalUrl + '/sharing/rest/generateToken?',
-                              parameters).read()     
+        responseJSON = TokenManager.requestToken(portalUrl + '/sharing/rest/generateToken',parameters)
     except Exception as e:
         arcpy.AddError( 'Unable to open the url %s/sharing/rest/generateToken' % (portalUrl))
         arcpy.AddError(e)
-    responseJSON =  json.loads(response.strip(' \t\n\r'))
     # Log results
     if responseJSON.has_key('error'):
         errDict = responseJSON['error']
@@ -253,10 +241,7 @@ if __name__ == '__main__':
         logger.info("Process started.")
     # Setup the use of a proxy for requests
     if (enableProxy == "true"):
-        # Setup the proxy
-        proxy = urllib2.ProxyHandler({requestProtocol : proxyURL})
-        openURL = urllib2.build_opener(proxy)
-        # Install the proxy
-        urllib2.install_opener(openURL)
+        # Setup the proxy on the shared session
+        RESTClient.setProxy(requestProtocol, proxyURL)
     mainFunction(*argv)
     
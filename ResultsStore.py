@@ -0,0 +1,248 @@
+#-------------------------------------------------------------
+# Name:       Results Store
+# Purpose:    Shared store of test results used by the benchmark scripts. Every run is kept in a SQLite
+#             database with its environment, and the timings are compared against the runs before it
+#             with the same workload settings (the baseline) to find requests that have slowed down. A request timed once in the run is tested
+#             against the spread of its baseline times, requests timed more than once with a one sided
+#             Mann-Whitney test.
+# Author:     Shaun Weston (shaun_weston@eagle.co.nz)
+# Date Created:    18/10/2026
+# Last Updated:    18/10/2026
+# Copyright:   (c) Eagle Technology
+# ArcGIS Version:   ArcMap (ArcPy) 10.1+ or ArcGIS API for Python 1.4.2+
+# Python Version:   2.7 or 3.6.5+
+#--------------------------------
+
+# Import main modules
+import os
+import sys
+import math
+import time
+import json
+import socket
+import platform
+import sqlite3
+
+# Set global variables
+# Database
+resultsDatabase = os.path.join(os.path.dirname(os.path.abspath(__file__)), "TestResults.sqlite") # e.g. os.path.join(os.path.dirname(__file__), "TestResults.sqlite")
+# Baseline
+baselineRuns = 10 # Number of previous runs of the same test the run is compared to
+minimumBaselineRuns = 3 # Don't compare until there are this many previous runs
+significance = 0.01 # P value below which a slowdown is significant
+minimumSlowdown = 0.1 # Only report a slowdown if the median time is at least this fraction slower e.g. 10%
+
+
+# Start of open results database function
+def openResultsDatabase(databaseFile=None):
+    if (databaseFile == None):
+        databaseFile = resultsDatabase
+    database = sqlite3.connect(databaseFile)
+    # Create the tables if they don't exist
+    database.execute("CREATE TABLE IF NOT EXISTS runs (id INTEGER PRIMARY KEY AUTOINCREMENT, test TEXT, target TEXT, runTime REAL, environment TEXT)")
+    database.execute("CREATE TABLE IF NOT EXISTS timings (run INTEGER, name TEXT, value REAL)")
+    database.execute("CREATE INDEX IF NOT EXISTS timingsRun ON timings (run, name)")
+    # Workload settings the run was made with - Added after the first version of the table
+    if "workload" not in [column[1] for column in database.execute("PRAGMA table_info(runs)")]:
+        database.execute("ALTER TABLE runs ADD COLUMN workload TEXT")
+    database.commit()
+    return database
+# End of open results database function
+
+
+# Start of get environment function
+def getEnvironment(extraInfo=None):
+    # Where and how the test was run
+    environment = {"machine": socket.gethostname(),
+                   "platform": platform.platform(),
+                   "python": sys.version.split()[0]}
+    if (extraInfo):
+        environment.update(extraInfo)
+    return environment
+# End of get environment function
+
+
+# Start of save run function
+def saveRun(database,test,target,timings,environment,workload=None):
+    # Add the run and each of its timings - Timings are a list of name and seconds
+    cursor = database.execute("INSERT INTO runs (test, target, runTime, environment, workload) VALUES (?, ?, ?, ?, ?)", (test, target, time.time(), json.dumps(environment), getWorkloadKey(workload)))
+    runID = cursor.lastrowid
+    database.executemany("INSERT INTO timings (run, name, value) VALUES (?, ?, ?)", [(runID, str(name), float(value)) for name, value in timings])
+    database.commit()
+    return runID
+# End of save run function
+
+
+# Start of get run timings function
+def getRunTimings(database,runIDs):
+    runTimings = {}
+    if (len(runIDs) == 0):
+        return runTimings
+    # Group the timings by name
+    query = "SELECT name, value FROM timings WHERE run IN (" + ",".join("?" * len(runIDs)) + ")"
+    for name, value in database.execute(query, tuple(runIDs)):
+        runTimings.setdefault(name, []).append(value)
+    return runTimings
+# End of get run timings function
+
+
+# Start of compare run function
+def compareRun(database,runID):
+    test, target, workload = database.execute("SELECT test, target, workload FROM runs WHERE id = ?", (runID,)).fetchone()
+    # Previous runs of the same test against the same target with the same workload settings
+    baselineIDs = [row[0] for row in database.execute("SELECT id FROM runs WHERE test = ? AND target = ? AND workload IS ? AND id < ? ORDER BY id DESC LIMIT ?", (test, target, workload, runID, int(baselineRuns)))]
+    if (len(baselineIDs) < int(minimumBaselineRuns)):
+        return None
+    runTimings = getRunTimings(database, [runID])
+    baselineTimings = getRunTimings(database, baselineIDs)
+
+    # Compare each request and all the requests together
+    runTimings["All"] = [value for name in runTimings for value in runTimings[name]]
+    baselineTimings["All"] = [value for name in baselineTimings if name in runTimings for value in baselineTimings[name]]
+    comparisons = []
+    for name in runTimings:
+        if name not in baselineTimings:
+            continue
+        # A single time can't be ranked against a few baseline times, so test how far outside the baseline it is
+        if (len(runTimings[name]) == 1):
+            pValue = predictionTest(runTimings[name][0], baselineTimings[name])
+        else:
+            pValue = mannWhitney(runTimings[name], baselineTimings[name])
+        runMedian = getMedian(runTimings[name])
+        baselineMedian = getMedian(baselineTimings[name])
+        comparisons.append({"name": name,
+                            "runMedian": runMedian,
+                            "baselineMedian": baselineMedian,
+                            "pValue": pValue,
+                            "slower": (pValue < float(significance)) and (runMedian > baselineMedian * (1 + float(minimumSlowdown)))})
+    return comparisons
+# End of compare run function
+
+
+# Start of mann whitney function
+def mannWhitney(sample,baseline):
+    # One sided test that the sample is slower than the baseline (Normal approximation)
+    sampleCount = len(sample)
+    baselineCount = len(baseline)
+    if (sampleCount == 0) or (baselineCount == 0):
+        return 1.0
+    # Rank all the values together, ties get the average rank
+    values = sorted([(value, 0) for value in sample] + [(value, 1) for value in baseline])
+    sampleRanks = 0
+    tieTotal = 0
+    index = 0
+    while (index < len(values)):
+        tieEnd = index
+        while (tieEnd + 1 < len(values)) and (values[tieEnd + 1][0] == values[index][0]):
+            tieEnd += 1
+        rank = (index + tieEnd) / 2.0 + 1
+        tieCount = tieEnd - index + 1
+        tieTotal += (tieCount ** 3) - tieCount
+        sampleRanks += rank * sum(1 for tie in values[index:tieEnd + 1] if tie[1] == 0)
+        index = tieEnd + 1
+    uValue = sampleRanks - (sampleCount * (sampleCount + 1) / 2.0)
+    # Mean and standard deviation of U if the sample and baseline are the same
+    total = sampleCount + baselineCount
+    mean = sampleCount * baselineCount / 2.0
+    variance = (sampleCount * baselineCount / 12.0) * ((total + 1) - (tieTotal / float(total * (total - 1) or 1)))
+    if (variance <= 0):
+        return 1.0
+    # Continuity correction
+    zValue = (uValue - mean - 0.5) / math.sqrt(variance)
+    return 0.5 * math.erfc(zValue / math.sqrt(2))
+# End of mann whitney function
+
+
+# Start of get workload key function
+def getWorkloadKey(workload):
+    # Same settings always give the same key
+    if (workload == None):
+        return None
+    return json.dumps(workload, sort_keys=True)
+# End of get workload key function
+
+
+# Start of prediction test function
+def predictionTest(value,baseline):
+    # One sided test that a single time is slower than the baseline times would predict (Student's t)
+    baselineCount = len(baseline)
+    if (baselineCount < 2):
+        return 1.0
+    # Times are skewed so compare them on a log scale
+    logValue = math.log(max(value, 1e-6))
+    logBaseline = [math.log(max(baselineValue, 1e-6)) for baselineValue in baseline]
+    mean = sum(logBaseline) / baselineCount
+    variance = sum((logTime - mean) ** 2 for logTime in logBaseline) / (baselineCount - 1)
+    # Baseline times are all the same
+    if (variance <= 0):
+        if (logValue > mean):
+            return 0.0
+        return 1.0
+    # Spread of a new time is the baseline spread plus the uncertainty in the baseline mean
+    tValue = (logValue - mean) / math.sqrt(variance * (1 + 1.0 / baselineCount))
+    return studentTail(tValue, baselineCount - 1)
+# End of prediction test function
+
+
+# Start of student tail function
+def studentTail(tValue,freedom):
+    # Probability of a t value at least this large with whole degrees of freedom (Abramowitz and Stegun 26.7.3 and 26.7.4)
+    angle = math.atan(abs(tValue) / math.sqrt(freedom))
+    cosine = math.cos(angle)
+    if (freedom % 2 == 1):
+        series = 0
+        term = cosine
+        power = 1
+        while (power <= freedom - 2):
+            series += term
+            term *= cosine * cosine * (power + 1) / float(power + 2)
+            power += 2
+        within = (2 / math.pi) * (angle + math.sin(angle) * series)
+    else:
+        series = 0
+        term = 1.0
+        power = 0
+        while (power <= freedom - 2):
+            series += term
+            term *= cosine * cosine * (power + 1) / float(power + 2)
+            power += 2
+        within = math.sin(angle) * series
+    # Probability of a value between -t and t, so half the rest is above t
+    if (tValue >= 0):
+        return (1 - within) / 2.0
+    return (1 + within) / 2.0
+# End of student tail function
+
+
+# Start of get median function
+def getMedian(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if (len(values) % 2 == 1):
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+# End of get median function
+
+
+# Start of check run function
+def checkRun(test,target,timings,extraInfo=None,databaseFile=None,workload=None):
+    # Save the run and compare it to the baseline - Workload is the settings that change what is requested, so only runs with the same settings are compared
+    database = openResultsDatabase(databaseFile)
+    try:
+        runID = saveRun(database, test, target, timings, getEnvironment(extraInfo), workload)
+        comparisons = compareRun(database, runID)
+    finally:
+        database.close()
+    return comparisons
+# End of check run function
+
+
+# Start of get regression message function
+def getRegressionMessage(comparisons):
+    # Message for the requests that are significantly slower
+    lines = []
+    for comparison in comparisons or []:
+        if (comparison["slower"]):
+            lines.append(comparison["name"] + " - Median " + str(round(comparison["runMedian"], 4)) + " seconds, baseline " + str(round(comparison["baselineMedian"], 4)) + " seconds (p = " + str(round(comparison["pValue"], 5)) + ")")
+    return "\n".join(lines)
+# End of get regression message function
@@ -43,15 +43,9 @@ if (arcgisDesktop == "true"):
     import arcpy
     # Enable data to be overwritten
     arcpy.env.overwriteOutput = True
-# Python version check
-if sys.version_info[0] >= 3:
-    # Python 3.x
-    import urllib.request as urllib2
-else:
-    # Python 2.x
-    import urllib2  
-import httplib
 import json
+import RESTClient
+import TokenManager
 import urllib
 import urlparse
 
@@ -87,8 +81,8 @@ def mainFunction(agsServerSite,username,password,startStop,allServices,userServi
                 url = "https://{}:{}/arcgis/admin/services{}?f=pjson&token={}".format(serverName, serverPort, folder, token)
                 # Make the request 
                 try:
-                    serviceList = json.loads(urllib2.urlopen(url).read())
-                except urllib2.URLError, error:
+                    serviceList = TokenManager.requestJSON(url, None, "GET")
+                except RESTClient.RequestError, error:
                     printMessage(error,"error")
                     # Logging
                     if (enableLogging == "true"):
@@ -110,7 +104,7 @@ def mainFunction(agsServerSite,username,password,startStop,allServices,userServi
                     for folder in folderList:
                         # Query the folder for map services
                         URL = "https://{}:{}/arcgis/admin/services/{}?f=pjson&token={}".format(serverName, serverPort, folder, token)    
-                        fList = json.loads(urllib2.urlopen(URL).read())
+                        fList = TokenManager.requestJSON(URL, None, "GET")
                         
                         for single in fList["services"]:
                             # Add the services found to the list
@@ -123,7 +117,7 @@ def mainFunction(agsServerSite,username,password,startStop,allServices,userServi
             for service in services:
                 # Start or stop the map service
                 op_service_url = "https://{}:{}/arcgis/admin/services/{}/{}?token={}&f=json".format(serverName, serverPort, service, startStop, token)
-                status = urllib2.urlopen(op_service_url, ' ').read()
+                status = RESTClient.sendRequest(op_service_url, ' ').text
 
                 # If successfully started/stopped                    
                 if 'success' in status:
@@ -234,11 +228,10 @@ def getToken(username, password, serverName, serverPort):
                   'expiration': "60",
                   'client':     'requestip'}
     
-    query_string = urllib.urlencode(query_dict)
     url = "https://{}:{}/arcgis/admin/generateToken?f=json".format(serverName, serverPort)
    
     try:
-        token = json.loads(urllib2.urlopen(url, query_string).read())
+        token = TokenManager.requestToken(url, query_dict)
         if "token" not in token or token == None:
             arcpy.AddError("Failed to get token, return message from server:")
             arcpy.AddError(token['messages'])            
@@ -251,7 +244,7 @@ def getToken(username, password, serverName, serverPort):
             # Return the token to the function which called for it
             return token['token']
     
-    except urllib2.URLError, error:
+    except RESTClient.RequestError, error:
         arcpy.AddError("Could not connect to machine {} on port {}".format(serverName, serverPort))
         arcpy.AddError(error)
         # Logging
@@ -384,9 +377,6 @@ if __name__ == '__main__':
         logger.info("Process started.")
     # Setup the use of a proxy for requests
     if (enableProxy == "true"):
-        # Setup the proxy
-        proxy = urllib2.ProxyHandler({requestProtocol : proxyURL})
-        openURL = urllib2.build_opener(proxy)
-        # Install the proxy
-        urllib2.install_opener(openURL)
+        # Setup the proxy on the shared session
+        RESTClient.setProxy(requestProtocol, proxyURL)
     mainFunction(*argv)  
@@ -0,0 +1,248 @@
+#-------------------------------------------------------------
+# Name:       Token Manager
+# Purpose:    Shared token cache used by the toolkit scripts. Tokens are cached per site, user and referer
+#             in memory and optionally in an encrypted file on disk, refreshed shortly before they expire and
+#             requests that fail with an invalid token (498) are retried once with a new token.
+# Author:     Shaun Weston (shaun_weston@eagle.co.nz)
+# Date Created:    18/10/2026
+# Last Updated:    18/10/2026
+# Copyright:   (c) Eagle Technology
+# ArcGIS Version:   ArcMap (ArcPy) 10.1+ or ArcGIS API for Python 1.4.2+
+# Python Version:   2.7 or 3.6.5+ (Requests 2.10+ - See Packages folder)
+#--------------------------------
+
+# Import main modules
+import os
+import threading
+import time
+import json
+import hashlib
+import RESTClient
+# Windows data protection is used to encrypt the token file (Part of pywin32)
+try:
+    import win32crypt
+except ImportError:
+    win32crypt = None
+
+# Set global variables
+# Refresh
+refreshSeconds = 120 # Get a new token when the cached token expires within this many seconds
+# Token file
+enableTokenFile = "false" # Also cache tokens in an encrypted file so they can be used across script runs (Windows only)
+tokenFile = os.path.join(os.path.dirname(os.path.abspath(__file__)), "TokenCache.dat")
+
+# Cached tokens - Key is the site, user and referer
+tokens = {}
+# Cache key for each token handed out
+tokenKeys = {}
+tokenLock = threading.RLock()
+tokenFileLoaded = False
+
+
+# Start of request token function
+def requestToken(tokenURL,parameters,headers=None):
+    key = getTokenKey(tokenURL,parameters)
+    with tokenLock:
+        loadTokenFile()
+        # Return the cached token if it is not about to expire
+        if (key in tokens) and (not tokenExpiring(tokens[key])):
+            # Keep the parameters so the token can be refreshed later (Not stored for tokens read from file)
+            tokens[key]["parameters"] = parameters
+            tokens[key]["headers"] = headers
+            return tokens[key]["response"]
+
+        # Request a new token
+        responseJSON = RESTClient.requestJSON(tokenURL,parameters,"POST",headers)
+        # If a token was returned
+        if ("token" in responseJSON):
+            tokens[key] = {"url": tokenURL,
+                           "parameters": parameters,
+                           "headers": headers,
+                           "response": responseJSON,
+                           "expires": getExpiry(responseJSON,parameters)}
+            tokenKeys[responseJSON["token"]] = key
+            saveTokenFile()
+        return responseJSON
+# End of request token function
+
+
+# Start of send request function
+def sendRequest(url,parameters=None,method="POST",headers=None,stream=False,timeout=None):
+    key, parameters = useCurrentToken(parameters)
+
+    response = RESTClient.sendRequest(url,parameters,method,headers,stream,timeout)
+
+    # If the token was rejected, get a new token and try once more
+    if (key) and (not stream) and (invalidToken(readJSON(response))):
+        parameters["token"] = currentToken(key,True)
+        response = RESTClient.sendRequest(url,parameters,method,headers,stream,timeout)
+    return response
+# End of send request function
+
+
+# Start of request JSON function
+def requestJSON(url,parameters=None,method="POST",headers=None,timeout=None):
+    response = sendRequest(url,parameters,method,headers,False,timeout)
+    # Raise an error if the server did not return a successful status
+    response.raise_for_status()
+    # Read json response
+    return json.loads(response.content.decode("utf-8"))
+# End of request JSON function
+
+
+# Start of stream JSON function
+def streamJSON(url,parameters=None,arrayName="features",responseInfo=None,method="POST",headers=None,timeout=None):
+    if (responseInfo == None):
+        responseInfo = {}
+    key, parameters = useCurrentToken(parameters)
+
+    for attempt in range(2):
+        responseInfo.clear()
+        response = RESTClient.sendRequest(url,parameters,method,headers,True,timeout)
+        # Raise an error if the server did not return a successful status
+        response.raise_for_status()
+        # Return each record as it is read
+        recordCount = 0
+        for record in RESTClient.streamJSON(response,arrayName,responseInfo):
+            recordCount += 1
+            yield record
+        response.close()
+        # If the token was rejected, get a new token and try once more
+        if (key) and (recordCount == 0) and (attempt == 0) and (invalidToken(responseInfo)):
+            parameters["token"] = currentToken(key,True)
+        else:
+            break
+# End of stream JSON function
+
+
+# Start of use current token function
+def useCurrentToken(parameters):
+    key = None
+    # If the request uses a token from the cache
+    if isinstance(parameters, dict) and (parameters.get("token") in tokenKeys):
+        key = tokenKeys[parameters["token"]]
+        # Use the current token for this site and user, refreshing it if about to expire
+        parameters = dict(parameters)
+        parameters["token"] = currentToken(key,False)
+    return key, parameters
+# End of use current token function
+
+
+# Start of read JSON function
+def readJSON(response):
+    try:
+        return json.loads(response.content.decode("utf-8"))
+    # Not a json response e.g. an image
+    except ValueError:
+        return None
+# End of read JSON function
+
+
+# Start of current token function
+def currentToken(key,forceRefresh):
+    with tokenLock:
+        tokenInfo = tokens[key]
+        if (forceRefresh) or (tokenExpiring(tokenInfo)):
+            # Remove the cached token and request a new one
+            del tokens[key]
+            requestToken(tokenInfo["url"],tokenInfo["parameters"],tokenInfo["headers"])
+            # Keep the old token if a new one could not be generated
+            if (key not in tokens):
+                tokens[key] = tokenInfo
+        return tokens[key]["response"]["token"]
+# End of current token function
+
+
+# Start of invalid token function
+def invalidToken(responseJSON):
+    if not isinstance(responseJSON, dict):
+        return False
+    # Sharing API e.g. {"error": {"code": 498}}
+    if isinstance(responseJSON.get("error"), dict):
+        return (str(responseJSON["error"].get("code")) == "498")
+    # Admin API e.g. {"status": "error", "code": 498}
+    return ((responseJSON.get("status") == "error") and (str(responseJSON.get("code")) == "498"))
+# End of invalid token function
+
+
+# Start of token expiring function
+def tokenExpiring(tokenInfo):
+    return ((time.time() + refreshSeconds) * 1000 >= tokenInfo["expires"])
+# End of token expiring function
+
+
+# Start of get expiry function
+def getExpiry(responseJSON,parameters):
+    # Expiry time is returned in milliseconds since epoch
+    if responseJSON.get("expires"):
+        return float(responseJSON["expires"])
+    # Otherwise use the expiration requested in minutes
+    expiration = 60
+    if isinstance(parameters, dict) and parameters.get("expiration"):
+        expiration = float(parameters["expiration"])
+    return (time.time() + (expiration * 60)) * 1000
+# End of get expiry function
+
+
+# Start of get token key function
+def getTokenKey(tokenURL,parameters):
+    username = ""
+    password = ""
+    referer = ""
+    if isinstance(parameters, dict):
+        username = parameters.get("username", "")
+        password = parameters.get("password", "")
+        referer = parameters.get("referer", "") or parameters.get("client", "")
+    # Password is hashed so a changed password does not reuse a cached token
+    passwordHash = hashlib.sha256(str(password).encode("utf-8")).hexdigest()
+    return tokenURL.split("?")[0].lower() + "|" + str(username).lower() + "|" + str(referer).lower() + "|" + passwordHash
+# End of get token key function
+
+
+# Start of load token file function
+def loadTokenFile():
+    global tokenFileLoaded
+    if (tokenFileLoaded) or (enableTokenFile != "true") or (win32crypt == None):
+        return
+    tokenFileLoaded = True
+    if os.path.isfile(tokenFile):
+        try:
+            # Decrypt the file for the current Windows user
+            with open(tokenFile, "rb") as tokenData:
+                fileTokens = json.loads(win32crypt.CryptUnprotectData(tokenData.read(), None, None, None, 0)[1].decode("utf-8"))
+            for key in fileTokens:
+                if not tokenExpiring(fileTokens[key]):
+                    tokens[key] = fileTokens[key]
+                    tokenKeys[fileTokens[key]["response"]["token"]] = key
+        # If the file can't be read, tokens will be requested again
+        except Exception:
+            pass
+# End of load token file function
+
+
+# Start of save token file function
+def saveTokenFile():
+    if (enableTokenFile != "true") or (win32crypt == None):
+        return
+    # Passwords are never written to the file
+    fileTokens = {}
+    for key in tokens:
+        fileTokens[key] = {"url": tokens[key]["url"],
+                           "response": tokens[key]["response"],
+                           "expires": tokens[key]["expires"]}
+        fileTokens[key]["parameters"] = dict((name, value) for name, value in tokens[key]["parameters"].items() if name != "password")
+        fileTokens[key]["headers"] = tokens[key]["headers"]
+    # Encrypt the file for the current Windows user
+    tokenData = win32crypt.CryptProtectData(json.dumps(fileTokens).encode("utf-8"), "ArcGIS Enterprise Toolkit Tokens", None, None, None, 0)
+    with open(tokenFile, "wb") as tokenFileData:
+        tokenFileData.write(tokenData)
+# End of save token file function
+
+
+# Start of clear tokens function
+def clearTokens():
+    with tokenLock:
+        tokens.clear()
+        tokenKeys.clear()
+        saveTokenFile()
+# End of clear tokens function